@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from Auths.models import CustomUser  # Ensure this matches the correct app name
@@ -58,6 +59,38 @@ class Tag(models.Model):
         return cls.objects.all()
 
 
+def _count_per_file(model):
+    """Rows of `model` for the outer file, counted in a correlated subquery."""
+    counts = (
+        model.objects.filter(file=models.OuterRef("pk"))
+        .order_by().values("file").annotate(total=models.Count("pk")).values("total")
+    )
+    return Coalesce(models.Subquery(counts), 0)
+
+
+class FileQuerySet(models.QuerySet):
+    def for_display(self, user=None):
+        """
+        Loads everything FileSerializer shows in a fixed number of queries,
+        however many files: author and category are joined, tags prefetched,
+        likes and comments counted in a subquery each (joining both would
+        multiply their rows) and is_liked an EXISTS subquery.
+        """
+        if user is not None and user.is_authenticated:
+            is_liked = models.Exists(Like.objects.filter(file=models.OuterRef("pk"), user=user))
+        else:
+            is_liked = models.Value(False)
+        return (
+            self.select_related("author", "category")
+            .prefetch_related("tags")
+            .annotate(
+                likes_total=_count_per_file(Like),
+                comments_total=_count_per_file(Comment),
+                liked_by_user=is_liked,
+            )
+        )
+
+
 class File(models.Model):
     """
     Model representing a file in the archive.
@@ -83,6 +116,8 @@ class File(models.Model):
     views = models.PositiveIntegerField(default=0)
     downloads = models.PositiveIntegerField(default=0)
 
+    objects = FileQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.title} by {self.author.get_full_name()}"
 
@@ -104,10 +139,11 @@ class File(models.Model):
 
     def increment_downloads(self):
         """
-        Increment the download count for the file.
+        Increment the download count for the file, in the database, so
+        concurrent downloads are all counted.
         """
+        File.objects.filter(pk=self.pk).update(downloads=models.F("downloads") + 1)
         self.downloads += 1
-        self.save()
 
 
 class Comment(models.Model):
@@ -55,14 +55,19 @@ class FileSerializer(serializers.ModelSerializer):
 
     def get_likes_count(self, obj):
         """
-        Returns the total number of likes for the file.
+        Returns the total number of likes for the file
+        (annotated by File.objects.for_display(), counted here otherwise).
         """
+        if hasattr(obj, "likes_total"):
+            return obj.likes_total
         return obj.likes.count()
 
     def get_comments_count(self, obj):
         """
         Returns the total number of comments for the file.
         """
+        if hasattr(obj, "comments_total"):
+            return obj.comments_total
         return obj.comments.count()
 
     def get_file_url(self, obj):
@@ -78,6 +83,8 @@ class FileSerializer(serializers.ModelSerializer):
         """
         Checks if the current user has liked the file.
         """
+        if hasattr(obj, "liked_by_user"):
+            return obj.liked_by_user
         user = self.context.get('request').user
         if user.is_authenticated:
             return obj.likes.filter(user=user).exists()
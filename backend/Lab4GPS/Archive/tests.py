@@ -1,3 +1,154 @@
-from django.test import TestCase
+import hashlib
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from Auths.models import CustomUser
+from .models import Category, Comment, File, Like, Tag
+
+
+class FileQueryCountTests(TestCase):
+    """Listing and reading files costs the same number of queries however many files there are."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Research Materials")
+        cls.tags = [Tag.objects.create(name="AI"), Tag.objects.create(name="Research")]
+        cls.users = [
+            CustomUser.objects.create_user(username=f"user{i}", email=f"user{i}@example.com", password="pw")
+            for i in range(3)
+        ]
+
+    def make_files(self, count):
+        start = File.objects.count()
+        for i in range(start, start + count):
+            file = File.objects.create(
+                title=f"File {i}", description="...", category=self.category,
+                author=self.users[i % 3], file=f"uploaded_files/file{i}.pdf",
+            )
+            file.tags.set(self.tags)
+            for user in self.users[: i % 3 + 1]:
+                Like.objects.create(file=file, user=user)
+                Comment.objects.create(file=file, user=user, text="Nice")
+
+    def count_queries(self, client, url):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        self.make_files(1)
+        single, data = self.count_queries(client, "/archive/files/")
+        self.assertEqual(len(data["files"]), 1)
+
+        self.make_files(4)
+        full_page, data = self.count_queries(client, "/archive/files/")
+        self.assertEqual(len(data["files"]), 5)
+        self.assertEqual(full_page, single)
+        self.assertEqual([f["title"] for f in data["files"]], [f"File {i}" for i in range(4, -1, -1)])
+
+        first = data["files"][0]  # the newest, File 4
+        self.assertEqual(first["likes_count"], 2)
+        self.assertEqual(first["comments_count"], 2)
+        self.assertTrue(first["is_liked"])
+        self.assertEqual(sorted(first["tags"]), ["AI", "Research"])
+        # user0 likes every file; user2 only every third one.
+        client.force_authenticate(self.users[2])
+        _, data = self.count_queries(client, "/archive/files/")
+        self.assertEqual([f["is_liked"] for f in data["files"]], [False, False, True, False, False])  # File 2
+
+        filtered, data = self.count_queries(client, "/archive/files/?tags=AI&tags=Research")
+        self.assertEqual(filtered, full_page)
+        self.assertEqual([f["likes_count"] for f in data["files"]], [2, 1, 3, 2, 1])
+        self.assertEqual([f["comments_count"] for f in data["files"]], [2, 1, 3, 2, 1])
+
+    def test_anonymous_list_and_detail(self):
+        self.make_files(5)
+        client = APIClient()
+        _, data = self.count_queries(client, "/archive/files/")
+        self.assertFalse(any(f["is_liked"] for f in data["files"]))
+
+        file = File.objects.order_by("id").last()
+        _, detail = self.count_queries(client, f"/archive/files/{file.pk}/")
+        self.assertEqual(detail["likes_count"], 2)
+        self.assertEqual(detail["comments_count"], 2)
+        self.assertEqual(detail["views"], 1)
+
+
+class FileDownloadTests(TestCase):
+    data = bytes(range(256)) * 4
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        author = CustomUser.objects.create_user(username="author", email="author@example.com", password="pw")
+        self.file = File.objects.create(
+            title="Data", description="...", category=Category.objects.create(name="Research Materials"),
+            author=author, file=ContentFile(self.data, name="data.bin"),
+        )
+        self.url = f"/archive/files/{self.file.pk}/download/"
+        self.client = APIClient()
+
+    def downloads(self):
+        self.file.refresh_from_db(fields=["downloads"])
+        return self.file.downloads
+
+    def test_a_full_download_is_counted(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.data)
+        self.assertEqual(response["ETag"], f'"{hashlib.sha256(self.data).hexdigest()}"')
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(self.downloads(), 1)
+
+    def test_ranges(self):
+        for header, status, content_range, body in (
+            ("bytes=0-9", 206, "bytes 0-9/1024", self.data[:10]),
+            ("bytes=1000-", 206, "bytes 1000-1023/1024", self.data[1000:]),
+            ("bytes=-5", 206, "bytes 1019-1023/1024", self.data[-5:]),
+            ("bytes=1020-5000", 206, "bytes 1020-1023/1024", self.data[1020:]),
+            ("bytes=0-1,5-6", 200, None, self.data),  # multi-range: the whole file
+        ):
+            with self.subTest(header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(response.get("Content-Range"), content_range)
+                self.assertEqual(b"".join(response.streaming_content), body)
+
+    def test_a_range_past_the_end_is_unsatisfiable(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=1024-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+        self.assertEqual(self.downloads(), 0)
+
+    def test_only_new_downloads_are_counted(self):
+        etag = self.client.get(self.url, HTTP_RANGE="bytes=0-99")["ETag"]  # counted: starts at 0
+        self.client.get(self.url, HTTP_RANGE="bytes=100-")  # the same download, resumed
+        self.client.head(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.downloads(), 1)
+
+    def test_a_stale_if_range_gets_the_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=100-", HTTP_IF_RANGE='"an-old-version"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.downloads(), 1)
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE="bytes=100-", HTTP_IF_RANGE=etag).status_code, 206)
+
+    @override_settings(FILE_SENDFILE_MODE="x-accel-redirect", FILE_SENDFILE_URL_PREFIX="/protected-media/")
+    def test_the_proxy_can_send_the_bytes(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.file.file.name}")
+        self.assertEqual(response.content, b"")
+        self.assertEqual(self.downloads(), 1)
@@ -4,6 +4,8 @@ from rest_framework import status, generics, permissions
 from .models import Category, Tag, File, Comment, Like
 from .serializers import CategorySerializer, TagSerializer, FileSerializer, CommentSerializer, LikeSerializer
 from django.db.models import Q
+from Lab4GPS.uploadhandlers import HashingUploadMixin
+from blobs.serving import serve_file
 
 
 class CategoryListView(generics.ListAPIView):
@@ -50,11 +52,11 @@ class FileListView(APIView):
         if search:
             files = files.filter(Q(title__icontains=search) | Q(description__icontains=search))
 
-        # Pagination
+        # Pagination, newest first (counted before the display annotations, which only the page needs)
         total_files = files.count()
         start = (page - 1) * files_per_page
         end = start + files_per_page
-        files_paginated = files[start:end]
+        files_paginated = files.for_display(request.user).order_by("-upload_date", "-id")[start:end]
 
         serializer = FileSerializer(files_paginated, many=True, context={"request": request})
         return Response({
@@ -71,7 +73,7 @@ class FileDetailView(APIView):
 
     def get(self, request, pk):
         try:
-            file = File.objects.get(pk=pk)
+            file = File.objects.for_display(request.user).get(pk=pk)
             file.increment_views()
             serializer = FileSerializer(file, context={"request": request})
             return Response(serializer.data)
@@ -98,9 +100,9 @@ class FileDetailView(APIView):
             return Response({"error": "File not found"}, status=status.HTTP_404_NOT_FOUND)
 
 
-class FileUploadView(APIView):
+class FileUploadView(HashingUploadMixin, APIView):
     """
-    View to handle file uploads.
+    View to handle file uploads. Uploaded files are hashed as they arrive.
     """
     permission_classes = [permissions.IsAuthenticated]
 
@@ -152,15 +154,21 @@ class CommentView(APIView):
 
 class FileDownloadView(APIView):
     """
-    View to handle file downloads and increment the download count.
+    View to stream a file's bytes (with Range and conditional GET support, see
+    blobs/serving.py) and count the download.
     """
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
     def get(self, request, pk):
         try:
-            file = File.objects.get(pk=pk)
-            file.increment_downloads()
-            serializer = FileSerializer(file, context={"request": request})
-            return Response(serializer.data)
+            file = File.objects.only("id", "file").get(pk=pk)
         except File.DoesNotExist:
             return Response({"error": "File not found"}, status=status.HTTP_404_NOT_FOUND)
+        if not file.file or not file.file.storage.exists(file.file.name):
+            return Response({"error": "File content is missing"}, status=status.HTTP_404_NOT_FOUND)
+
+        response, counted = serve_file(request, file.file)
+        # Resumed ranges, revalidations and HEADs are not new downloads.
+        if counted:
+            file.increment_downloads()
+        return response
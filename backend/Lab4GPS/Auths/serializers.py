@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from .models import CustomUser
-from django.core.mail import send_mail
+from .tasks import send_email
 import logging
 from django.utils import timezone
 from datetime import timedelta
@@ -47,12 +47,11 @@ class RegisterSerializer(serializers.ModelSerializer):
 
             logger.info(f"User {user.email} registered successfully with OTP {user.otp}.")
 
-            send_mail(
+            send_email.defer(
                 'Your OTP for Chakan Stamp & Verify',
                 f'Your OTP is: {user.otp}',
                 'CS&V <no-reply@chakanstamp.com>',
                 [user.email],
-                fail_silently=False,
             )
             return user
         except Exception as e:
@@ -175,12 +174,11 @@ class ForgotPasswordSerializer(serializers.Serializer):
         try:
             user = CustomUser.objects.get(email=data['email'])
             user.generate_reset_password_otp()
-            send_mail(
+            send_email.defer(
                 'Reset Your Password - CS&V',
                 f'Your OTP is: {user.reset_password_otp}',
                 'CS&V <sarahmueni5235@gmail.com>',
                 [user.email],
-                fail_silently=False,
             )
             return data
         except CustomUser.DoesNotExist:
@@ -0,0 +1,10 @@
+# Auths/tasks.py
+from django.core.mail import send_mail
+
+from tasks.registry import task
+
+
+@task(priority=10, max_attempts=5, concurrency=2, backoff=30)
+def send_email(subject, message, from_email, recipient_list):
+    """Sends one email off the request path; SMTP errors are retried with backoff."""
+    send_mail(subject, message, from_email, recipient_list, fail_silently=False)
@@ -1,11 +1,11 @@
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.core.mail import send_mail 
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import CustomUser
+from .tasks import send_email
 from .serializers import (
     RegisterSerializer,
     VerifyOtpSerializer,
@@ -193,12 +193,11 @@ class RequestOtpView(APIView):
         user = request.user
         # Generate new OTP and save user.
         user.generate_otp()
-        # Send OTP email to the user.
-        send_mail(
+        # Queue the OTP email to the user.
+        send_email.defer(
             'Your OTP for Chakan Stamp & Verify',
             f'Your OTP is: {user.otp}',
             'CS&V <no-reply@chakanstamp.com>',
             [user.email],
-            fail_silently=False,
         )
         return Response({"message": "OTP sent successfully."}, status=status.HTTP_200_OK)
\ No newline at end of file
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Lab4GPS.settings')
 
 application = get_asgi_application()
+
+# Build the verify-document hash filter now, not in the first request (stamps/bloom.py).
+from stamps.bloom import warm_up  # noqa: E402  (needs the app registry)
+
+warm_up()
@@ -0,0 +1,84 @@
+# Lab4GPS/listing.py
+"""
+Cheap list endpoints for per-user collections (documents, stamps).
+
+CreatedAtCursorPagination pages by keyset on (created_at, id), newest first,
+instead of COUNT(*) plus OFFSET: a page is one index range scan on
+(user, created_at, id), so page 500 costs the same as page 1. Clients follow
+the opaque `next` / `previous` links; there are no page numbers.
+
+FieldProjectionMixin adds `?fields=id,serial_number,...` to GET requests:
+the serializer emits only those fields and the query loads only the columns
+they read (via .only()).
+"""
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    ordering = ("-created_at", "-id")
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class ProjectableSerializerMixin:
+    """
+    Serializer mixin: pass fields=[...] to keep only those fields.
+    Meta.projection_sources maps computed fields (SerializerMethodField...)
+    to the model fields they read; other fields read their own `source`.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def model_fields_for(self, names):
+        model = self.Meta.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        sources = getattr(self.Meta, "projection_sources", {})
+        columns = set()
+        for name in names:
+            for source in sources.get(name, (self.fields[name].source,)):
+                source = source.split(".")[0]
+                if source in concrete:
+                    columns.add(source)
+        return columns
+
+
+class FieldProjectionMixin:
+    """ViewSet mixin applying `?fields=` to the serializer and the queryset (GET only)."""
+
+    def get_projection(self):
+        if hasattr(self, "_projection"):
+            return self._projection
+        self._projection = None
+        raw = self.request.query_params.get("fields") if self.request.method == "GET" else None
+        if raw:
+            names = list(dict.fromkeys(name.strip() for name in raw.split(",") if name.strip()))
+            available = self.get_serializer_class()(context=self.get_serializer_context()).fields
+            unknown = [name for name in names if name not in available]
+            if unknown:
+                raise ValidationError({"fields": [f"Unknown field: {name}" for name in unknown]})
+            self._projection = names
+        return self._projection
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        names = self.get_projection()
+        if names is None:
+            return queryset
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        columns = serializer.model_fields_for(names)
+        columns.add(queryset.model._meta.pk.name)
+        # The paginator reads its ordering fields to build the next cursor.
+        for field in getattr(self.paginator, "ordering", ()) or ():
+            columns.add(field.lstrip("-"))
+        return queryset.only(*columns)
+
+    def get_serializer(self, *args, **kwargs):
+        names = self.get_projection()
+        if names is not None:
+            kwargs.setdefault("fields", names)
+        return super().get_serializer(*args, **kwargs)
@@ -26,6 +26,14 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = 'django-insecure-^@u+u+p5^z6i359+lr@l-4(!p&3nmw3xgz0+7%2fb0gd_w^cn='
 
+# Signs QR payloads and hash batch roots (stamps.signing). Kept out of the repo: set it in
+# the environment to a random secret of 32+ characters; nothing is signed without it.
+DOCUMENT_SIGNING_KEY = os.environ.get('DOCUMENT_SIGNING_KEY', '')
+# Previous keys, comma-separated, still accepted when verifying (key rotation).
+DOCUMENT_SIGNING_KEY_FALLBACKS = [
+    key for key in os.environ.get('DOCUMENT_SIGNING_KEY_FALLBACKS', '').split(',') if key
+]
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
@@ -51,6 +59,8 @@ INSTALLED_APPS = [
     'Archive',
     'courses',
     'stamps',
+    'tasks',
+    'blobs',
 ]
 
 MIDDLEWARE = [
@@ -101,6 +111,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock at BEGIN: the web server and task workers write concurrently,
+        # and a deferred transaction that has to upgrade its lock fails instead of waiting.
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
     }
 }
 
@@ -147,6 +160,111 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'collected_static')  # Added to fix collect
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploaded files are stored once per content (blobs.storage); names are hard links to the blob.
+# BLOB_ROOT (default MEDIA_ROOT/blobs) must be on the same filesystem as MEDIA_ROOT.
+STORAGES = {
+    'default': {
+        'BACKEND': 'blobs.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Extra digests computed while files upload (Lab4GPS.uploadhandlers); SHA-256 is always on
+UPLOAD_DIGEST_ALGORITHMS = []
+
+# Bloom filter of issued document hashes (stamps.bloom), shared by all workers via mmap
+HASH_FILTER_PATH = os.path.join(BASE_DIR, 'var', 'document_hashes.bloom')
+HASH_FILTER_CAPACITY = 2_000_000
+HASH_FILTER_ERROR_RATE = 0.001
+# wsgi/asgi startup rebuilds the filter unless another worker did within this many seconds
+HASH_FILTER_STARTUP_MAX_AGE = 300
+
+# QR decoding for verify-document (stamps.qr)
+QR_DECODE_WORKERS = 4  # threads per process
+QR_DECODE_MAX_PENDING = 16  # queued + running decodes before requests wait
+QR_DECODE_TIMEOUT = 5.0  # seconds per request
+PDF_SCAN_WORKERS = 2  # processes rendering PDF pages when the hash does not match
+PDF_SCAN_DPI_LEVELS = (72, 150, 300)
+PDF_SCAN_MAX_PAGES = 50
+PDF_SCAN_TIMEOUT = 4.0  # seconds per request; the scan holds a web worker, so keep it short
+VERIFY_FINGERPRINT_MAX_PAGES = 50  # larger uploads skip the page-by-page comparison
+
+# Verification result cache (stamps.verify_cache)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by every web and task worker process on the host, so a save in any of them
+    # invalidates cached verify results for all (stamps.verify_cache); use Redis/Memcached across hosts
+    'verification': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'var', 'verify_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+VERIFY_CACHE_ALIAS = 'verification'
+VERIFY_CACHE_TIMEOUT = 300  # seconds, for results that name a document
+VERIFY_CACHE_NEGATIVE_TIMEOUT = 60  # seconds, for unknown files
+
+# Resumable uploads (blobs.uploads)
+UPLOAD_MAX_SIZE = 1024 ** 3  # bytes per file
+UPLOAD_CHUNK_MAX_SIZE = 16 * 1024 * 1024  # bytes per PUT
+UPLOAD_SESSION_TTL = 24 * 3600  # seconds before an unfinished upload is discarded
+
+# File downloads (blobs.serving): None streams through Django; "x-accel-redirect" (nginx,
+# with an internal location at FILE_SENDFILE_URL_PREFIX aliased to MEDIA_ROOT) or
+# "x-sendfile" (Apache/lighttpd) let the front proxy send the bytes
+FILE_SENDFILE_MODE = None
+FILE_SENDFILE_URL_PREFIX = '/protected-media/'
+
+# QR images (stamps.qr_images), rendered on demand from the stored payload
+QR_IMAGE_CACHE_ALIAS = 'default'
+QR_IMAGE_CACHE_TIMEOUT = 24 * 3600  # seconds
+
+# Bulk verification (verify-batch); up to DATA_UPLOAD_MAX_NUMBER_FILES (100) parts, more in ZIPs
+BATCH_VERIFY_WORKERS = 4  # files verified concurrently per request
+BATCH_VERIFY_MAX_FILES = 500  # per request, ZIP entries included
+BATCH_VERIFY_MAX_FILE_SIZE = 50 * 1024 * 1024  # per ZIP entry, uncompressed
+
+# Document serials (stamps.serials): XXXX-XXXX from a permuted, block-reserved counter
+SERIAL_BLOCK_SIZE = 100  # counter values each worker thread reserves at a time
+SERIAL_PERMUTATION_KEY = 'cs&v-document-serials'  # never change once serials are issued
+
+# Bulk stamping jobs (stamps.jobs); items run on the task queue
+STAMP_JOB_MAX_DOCUMENTS = 1000
+
+# Database-backed task queue (tasks app); run workers with `manage.py run_task_worker`
+# Deferred tasks run inline until a deployment runs workers and sets TASKS_EAGER=0
+TASKS_EAGER = os.environ.get('TASKS_EAGER', '1') != '0'
+TASK_POLL_INTERVAL = 1.0  # seconds a worker sleeps when nothing is due
+TASK_RETRY_BACKOFF_MAX = 3600  # seconds
+TASK_KEEP_SUCCEEDED_DAYS = 7
+TASK_TYPES = {}  # per-type overrides, e.g. {"Auths.tasks.send_email": {"concurrency": 4}}
+# Document.save stages run as tasks instead of inline ("qr", "pages"), once there are workers
+DOCUMENT_DEFERRED_STAGES = () if TASKS_EAGER else ("qr", "pages")
+
+# Page tile pyramids for the stamping canvas (stamps.tiles), cached on disk by file hash
+DOCUMENT_TILE_DIR = os.path.join(BASE_DIR, 'var', 'document_tiles')
+DOCUMENT_TILE_MAX_ZOOM = 2.0  # deepest level, in pixels per PDF point
+DOCUMENT_TILE_PRERENDER = not TASKS_EAGER  # queue overview tiles when a file is uploaded
+DOCUMENT_TILE_PRERENDER_MAX_TILES = 4  # per page and level, beyond page 1
+
+# Merkle batch attestation of document hashes (stamps.anchoring, manage.py anchor_hashes)
+HASH_ANCHOR_MAX_LEAVES = 100_000  # documents per signed batch
+
+# Verification event log (stamps.verify_log): buffered in memory, bulk-inserted in the background
+VERIFY_LOG_ENABLED = True
+VERIFY_LOG_FLUSH_INTERVAL = 5.0  # seconds between background inserts
+VERIFY_LOG_BATCH_SIZE = 500  # flush early once this many events wait
+VERIFY_LOG_MAX_PENDING = 100_000  # events buffered per process before new ones are dropped
+VERIFY_LOG_FORWARDED_FOR = False  # take the client IP from X-Forwarded-For (only behind a trusted proxy)
+VERIFY_LOG_RETENTION_DAYS = 90  # raw events kept after rollup; 0 keeps them forever
+
+# Rendered stamp cache (stamps.render_cache); renders live under MEDIA_ROOT/stamp_renders
+STAMP_RENDER_CACHE_SIZE = 256  # renders kept in memory per process
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
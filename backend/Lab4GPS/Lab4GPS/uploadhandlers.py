@@ -0,0 +1,90 @@
+# Lab4GPS/uploadhandlers.py
+"""
+Upload handlers that hash files while the multipart body is being received.
+
+Each handler wraps one of Django's stock handlers and feeds every chunk it
+keeps into the configured hashlib digests. When the file is complete the hex
+digests are attached to the resulting UploadedFile:
+
+    uploaded.digests  -> {"sha256": "...", ...}
+    uploaded.sha256   -> shortcut for the SHA-256 digest
+
+so callers never need a second pass over the bytes.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+
+
+def digest_algorithms():
+    """SHA-256 is always computed; UPLOAD_DIGEST_ALGORITHMS can add more (e.g. 'md5')."""
+    algorithms = ["sha256"]
+    for name in getattr(settings, "UPLOAD_DIGEST_ALGORITHMS", []):
+        if name not in algorithms:
+            algorithms.append(name)
+    return algorithms
+
+
+class HashingUploadHandlerMixin:
+    def new_file(self, *args, **kwargs):
+        # Set up before super(): the memory handler raises StopFutureHandlers once activated.
+        self.hashers = {name: hashlib.new(name) for name in digest_algorithms()}
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            # This handler kept the chunk, so it is the one that will produce the file.
+            for hasher in self.hashers.values():
+                hasher.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.digests = {name: hasher.hexdigest() for name, hasher in self.hashers.items()}
+            uploaded.sha256 = uploaded.digests["sha256"]
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    """Small uploads, kept in memory."""
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    """Large uploads, streamed to a temporary file."""
+
+
+def hashing_upload_handlers(request):
+    return [
+        HashingMemoryFileUploadHandler(request),
+        HashingTemporaryFileUploadHandler(request),
+    ]
+
+
+class HashingUploadMixin:
+    """
+    View mixin that swaps in the hashing handlers before DRF parses the body.
+    """
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = hashing_upload_handlers(request)
+        return super().initialize_request(request, *args, **kwargs)
+
+
+def uploaded_sha256(uploaded_file):
+    """
+    Returns the SHA-256 hex digest of an uploaded file, using the digest
+    computed during upload when present and hashing the content otherwise.
+    """
+    digest = getattr(uploaded_file, "sha256", None)
+    if digest:
+        return digest
+    sha = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        sha.update(chunk)
+    return sha.hexdigest()
@@ -19,6 +19,12 @@ urlpatterns = [
 
     path('stamps/', include('stamps.urls')), 
 
+    # Resumable chunked uploads
+    path('uploads/', include('blobs.urls')),
+
+    # Background task queue dashboard
+    path('tasks/', include('tasks.urls')),
+
 ]
 
 # Serve media files during development
@@ -0,0 +1,32 @@
+from django.contrib import admin
+from .models import Blob, StoredName, UploadSession
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    """
+    Admin interface for Blob model.
+    """
+    list_display = ('sha256', 'size', 'refcount', 'created_at')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'size', 'refcount', 'created_at')
+
+
+@admin.register(StoredName)
+class StoredNameAdmin(admin.ModelAdmin):
+    """
+    Admin interface for StoredName model.
+    """
+    list_display = ('name', 'blob', 'created_at')
+    search_fields = ('name', 'blob__sha256')
+    readonly_fields = ('name', 'blob', 'created_at')
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    """
+    Admin interface for UploadSession model.
+    """
+    list_display = ('id', 'user', 'target', 'filename', 'received', 'size', 'expires_at')
+    list_filter = ('target',)
+    search_fields = ('filename', 'user__username')
@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.core.signals import request_finished
+
+
+class BlobsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'blobs'
+
+    def ready(self):
+        from .storage import discard_rolled_back_files
+
+        request_finished.connect(discard_rolled_back_files, dispatch_uid="blobs.discard_rolled_back_files")
@@ -0,0 +1,80 @@
+import hashlib
+import os
+from collections import defaultdict
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+
+from blobs.models import StoredName
+from blobs.storage import CHUNK_SIZE, ContentAddressedStorage
+
+
+def referenced_names():
+    """Every file name held by a FileField/ImageField of any installed model."""
+    names = set()
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                values = (
+                    model._default_manager.exclude(**{field.name: ""})
+                    .exclude(**{f"{field.name}__isnull": True})
+                    .values_list(field.name, flat=True)
+                    .distinct()
+                )
+                names.update(values)
+    return names
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves media files written before the content-addressed storage under it: "
+        "each distinct content is kept once under MEDIA_ROOT/blobs and every file "
+        "name referenced by the database becomes a link to it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be reclaimed.")
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError("The default storage is not blobs.storage.ContentAddressedStorage.")
+
+        adopted = set(StoredName.objects.values_list("name", flat=True))
+        pending, missing = [], []
+        for name in sorted(referenced_names() - adopted):
+            (pending if default_storage.exists(name) else missing).append(name)
+        for name in missing:
+            self.stderr.write(f"Missing on disk, skipped: {name}")
+
+        if options["dry_run"]:
+            by_digest = defaultdict(list)
+            for name in pending:
+                by_digest[file_digest(default_storage.path(name))].append(name)
+            reclaimable = sum(
+                os.path.getsize(default_storage.path(names[0])) * (len(names) - 1)
+                for names in by_digest.values()
+            )
+            self.stdout.write(
+                f"{len(pending)} file(s), {len(by_digest)} distinct; "
+                f"about {reclaimable} bytes reclaimable (more if some match existing blobs)."
+            )
+            return
+
+        digests, reclaimed = set(), 0
+        for name in pending:
+            digest, saved = default_storage.adopt(name)
+            digests.add(digest)
+            reclaimed += saved
+        self.stdout.write(self.style.SUCCESS(
+            f"Adopted {len(pending)} file(s) into {len(digests)} blob(s); reclaimed {reclaimed} bytes."
+        ))
@@ -0,0 +1,51 @@
+import uuid
+
+from django.conf import settings
+from django.db import models
+
+
+class Blob(models.Model):
+    """
+    One stored file content, kept once under BLOB_ROOT by its SHA-256
+    (see blobs/storage.py). `refcount` is the number of StoredNames using it.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]}… ({self.refcount} refs)"
+
+
+class StoredName(models.Model):
+    """A file name handed out by the storage (what FileFields hold) and its content."""
+    name = models.CharField(max_length=255, unique=True)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name="names")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload in progress (see blobs/uploads.py). `received` bytes
+    have been written, in order, to the session's part file.
+    """
+    class Target(models.TextChoices):
+        DOCUMENT = 'document', 'Stamps document'
+        ARCHIVE_FILE = 'archive_file', 'Archive file'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="upload_sessions")
+    target = models.CharField(max_length=20, choices=Target.choices)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True, default="")
+    size = models.BigIntegerField(help_text="Total bytes the client will send.")
+    received = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
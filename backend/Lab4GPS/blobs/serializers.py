@@ -0,0 +1,23 @@
+from django.conf import settings
+from rest_framework import serializers
+from .models import UploadSession
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """
+    A resumable upload; `offset` is where the next chunk must start.
+    """
+    offset = serializers.IntegerField(source='received', read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'target', 'filename', 'content_type', 'size', 'offset', 'created_at', 'expires_at']
+        read_only_fields = ['id', 'created_at', 'expires_at']
+
+    def validate_size(self, size):
+        limit = getattr(settings, 'UPLOAD_MAX_SIZE', 1024 ** 3)
+        if size < 1:
+            raise serializers.ValidationError("The upload must not be empty.")
+        if size > limit:
+            raise serializers.ValidationError(f"Uploads may be at most {limit} bytes.")
+        return size
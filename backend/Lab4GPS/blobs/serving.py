@@ -0,0 +1,143 @@
+# blobs/serving.py
+"""
+Serving stored files from views: streaming, HTTP Range, conditional GET,
+and optionally handing the transfer to the front proxy.
+
+    response, counted = serve_file(request, file.file, download_name="report.pdf")
+
+- 200 streams the whole file through FileResponse (the WSGI server may
+  use sendfile); 206 streams one byte range (multi-range requests get the
+  whole file, as RFC 9110 allows); 416 for ranges past the end.
+- ETag is the blob's SHA-256 when the file is content-addressed (see
+  blobs/storage.py), otherwise size and mtime; Last-Modified is the mtime.
+  If-None-Match / If-Modified-Since answer 304, If-Range is honoured.
+- FILE_SENDFILE_MODE = "x-accel-redirect" (nginx) or "x-sendfile" (Apache,
+  lighttpd) returns only headers and lets the proxy send the bytes (and do
+  ranges itself).
+
+`counted` tells the caller whether this request is a new download: a full
+GET, or a ranged GET starting at byte 0. Resumed ranges, 304s and HEADs
+are not, so a counter incremented on `counted` stays accurate in every mode.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+from .storage import CHUNK_SIZE
+
+RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def file_etag(fieldfile, stat):
+    from .models import StoredName
+
+    digest = StoredName.objects.filter(name=fieldfile.name).values_list("blob_id", flat=True).first()
+    return quote_etag(digest or f"{stat.st_size:x}-{stat.st_mtime_ns:x}")
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single-range header, None to serve the whole
+    file, or "unsatisfiable".
+    """
+    match = RANGE.fullmatch((header or "").replace(" ", ""))
+    if not match:
+        return None  # absent, malformed or multi-range
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/"')):
+        return if_range == etag  # weak validators never match (strong comparison)
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(last_modified) <= since
+
+
+def _read_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+
+
+def _sendfile_response(fieldfile, path):
+    mode = getattr(settings, "FILE_SENDFILE_MODE", None)
+    response = HttpResponse()
+    if mode == "x-accel-redirect":
+        prefix = getattr(settings, "FILE_SENDFILE_URL_PREFIX", "/protected-media/")
+        response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(fieldfile.name)
+    else:
+        response["X-Sendfile"] = path
+    # Let the proxy pick the type from the file; Django's default would override it.
+    del response["Content-Type"]
+    return response
+
+
+def serve_file(request, fieldfile, download_name=None, as_attachment=True):
+    """Returns (response, counted) for the stored file behind `fieldfile`."""
+    path = fieldfile.path
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(fieldfile, stat)
+    last_modified = stat.st_mtime
+    is_get = request.method == "GET"
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if not_modified is not None:
+        return not_modified, False
+
+    requested = parse_range(request.headers.get("Range"), size) if is_get else None
+    if requested is not None and not _if_range_matches(request, etag, last_modified):
+        requested = None
+    if requested == "unsatisfiable":
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response, False
+    counted = is_get and (requested is None or requested[0] == 0)
+
+    filename = download_name or os.path.basename(fieldfile.name)
+    if getattr(settings, "FILE_SENDFILE_MODE", None):
+        response = _sendfile_response(fieldfile, path)
+        response["Content-Disposition"] = content_disposition_header(as_attachment, filename)
+    elif requested is None:
+        response = FileResponse(open(path, "rb"), as_attachment=as_attachment, filename=filename)
+    else:
+        start, end = requested
+        response = StreamingHttpResponse(
+            _read_range(path, start, end - start + 1), status=206,
+            content_type=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+        response["Content-Disposition"] = content_disposition_header(as_attachment, filename)
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    return response, counted
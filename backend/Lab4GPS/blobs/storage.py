@@ -0,0 +1,256 @@
+# blobs/storage.py
+"""
+Content-addressed file storage shared by every FileField in the project.
+
+Each distinct file content is written once, under its SHA-256, in a sharded
+tree below BLOB_ROOT (MEDIA_ROOT/blobs by default):
+
+    blobs/3f/a9/3fa9...e1
+
+The names FileFields hold ("documents/report.pdf", "uploaded_files/x.pdf")
+are hard links to that blob, so file.url, file.path, MEDIA serving and any
+code that opens the path keep working unchanged, while a PDF uploaded to
+stamps, the archive and a course occupies its bytes on disk only once.
+
+Bookkeeping lives in the database: a Blob row per content with a reference
+count, and a StoredName row per name handed out. Deleting a name drops its
+link and its reference; the blob itself is removed with its last reference.
+
+Stored files must never be modified in place (they may be shared): saving
+new content always goes through save(), which picks a new name. Blobs are
+made read-only (0444), and a hard link shares its blob's mode, so opening a
+name's .path for writing fails instead of changing every file with that
+content. If the filesystem cannot hard-link, a name falls back to a private
+(equally read-only) copy.
+
+Files are written before the rows that account for them commit. If the
+enclosing transaction rolls back, the rows vanish but the files stay; each
+write registers an on_commit hook, and a write whose hook was discarded
+(a rollback) has its link, and the blob it created, removed at the end of
+the request or on the thread's next save or delete, whichever comes first.
+"""
+import hashlib
+import os
+import stat
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+from django.db.models import F
+
+CHUNK_SIZE = 64 * 1024
+READ_ONLY = 0o444
+
+
+class _UncommittedFiles(threading.local):
+    """Files this thread wrote inside transactions that have not committed yet."""
+
+    def __init__(self):
+        self.entries = []  # [on_commit hook, storage, name, digest of a blob it created, their paths]
+
+
+_uncommitted = _UncommittedFiles()
+
+
+def discard_rolled_back_files(**kwargs):
+    """Removes files written by transactions that rolled back; connected to request_finished."""
+    for entry in list(_uncommitted.entries):
+        hook, storage, *written = entry
+        if any(queued[1] is hook for queued in connection.run_on_commit):
+            continue  # still pending
+        _uncommitted.entries.remove(entry)
+        storage._discard_uncommitted(*written)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    @property
+    def blob_root(self):
+        return getattr(settings, "BLOB_ROOT", None) or os.path.join(self.location, "blobs")
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_root, digest[:2], digest[2:4], digest)
+
+    @staticmethod
+    def content_digest(content):
+        """SHA-256 of `content`; uploads hashed on arrival (Lab4GPS/uploadhandlers.py) are not read again."""
+        digest = getattr(content, "sha256", None)
+        if digest:
+            return digest
+        sha = hashlib.sha256()
+        for chunk in content.chunks():
+            sha.update(chunk)
+        return sha.hexdigest()
+
+    # ---------------- writing ----------------
+
+    def _write_blob(self, digest, content):
+        """Writes the blob unless it exists; returns True if it was written."""
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if hasattr(content, "temporary_file_path"):
+            # Already on disk (large or resumable upload): move it rather than copy it.
+            try:
+                os.replace(content.temporary_file_path(), path)
+                os.chmod(path, READ_ONLY)
+                return True
+            except OSError:
+                pass  # another filesystem: copy below
+        # Write to a temp file and rename so no reader ever sees a partial blob.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            os.chmod(tmp_path, READ_ONLY)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
+
+    def _link(self, digest, name):
+        """Creates `name` as a link to the blob, renaming on collision; returns the name used."""
+        while True:
+            full_path = self.path(name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            try:
+                self._link_or_copy(self.blob_path(digest), full_path)
+            except FileExistsError:
+                name = self.get_available_name(name)
+                continue
+            return name
+
+    def _link_or_copy(self, source, target):
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            raise
+        except OSError:
+            # No hard links here (other filesystem, FAT...): keep a private copy.
+            with open(source, "rb") as src, open(target, "xb") as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    dst.write(chunk)
+            os.chmod(target, READ_ONLY)
+
+    def _reference(self, digest, size):
+        from .models import Blob
+
+        Blob.objects.select_for_update().get_or_create(sha256=digest, defaults={"size": size})
+        Blob.objects.filter(pk=digest).update(refcount=F("refcount") + 1)
+
+    def _track_uncommitted(self, name, new_blob_digest):
+        """Call inside the transaction that records `name`; see discard_rolled_back_files()."""
+        entry = []
+
+        def committed():
+            if entry in _uncommitted.entries:
+                _uncommitted.entries.remove(entry)
+
+        entry.extend((
+            committed, self, name, new_blob_digest,
+            self.path(name) if name else None,
+            self.blob_path(new_blob_digest) if new_blob_digest else None,
+        ))
+        _uncommitted.entries.append(entry)
+        transaction.on_commit(committed)
+
+    def _discard_uncommitted(self, name, digest, path, blob_path):
+        from .models import Blob, StoredName
+
+        # The rows are checked in case the hook was skipped (an earlier on_commit hook raised).
+        if name and not StoredName.objects.filter(name=name).exists():
+            self._unlink(path)
+        if digest and not Blob.objects.filter(pk=digest).exists():
+            self._unlink(blob_path)
+
+    def _save(self, name, content):
+        from .models import StoredName
+
+        discard_rolled_back_files()
+        digest = self.content_digest(content)
+        with transaction.atomic():
+            self._reference(digest, content.size)
+            new_blob = self._write_blob(digest, content)
+            name = str(self._link(digest, name)).replace("\\", "/")
+            StoredName.objects.create(name=name, blob_id=digest)
+            self._track_uncommitted(name, digest if new_blob else None)
+        return name
+
+    def adopt(self, name):
+        """
+        Brings a file written before this storage (a plain file at `name`)
+        under content addressing. Returns (digest, bytes reclaimed).
+        """
+        from .models import StoredName
+
+        full_path = self.path(name)
+        with open(full_path, "rb") as f:
+            sha = hashlib.sha256()
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        size = os.path.getsize(full_path)
+        blob_path = self.blob_path(digest)
+
+        with transaction.atomic():
+            self._reference(digest, size)
+            reclaimed = 0
+            if not os.path.exists(blob_path):
+                # First copy of this content: it becomes the blob, no bytes move.
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.link(full_path, blob_path)
+                os.chmod(blob_path, READ_ONLY)
+                self._track_uncommitted(None, digest)
+            elif not os.path.samefile(full_path, blob_path):
+                # Duplicate: swap the file for a link to the blob.
+                tmp_path = f"{full_path}.{os.getpid()}.tmp"
+                os.link(blob_path, tmp_path)
+                os.replace(tmp_path, full_path)
+                reclaimed = size
+            StoredName.objects.create(name=name, blob_id=digest)
+        return digest, reclaimed
+
+    # ---------------- deleting ----------------
+
+    def delete(self, name):
+        from .models import Blob, StoredName
+
+        if not name:
+            raise ValueError("The name must be given to delete().")
+        discard_rolled_back_files()
+        with transaction.atomic():
+            stored = StoredName.objects.filter(name=name).first()
+            if stored is not None:
+                stored.delete()
+                Blob.objects.filter(pk=stored.blob_id).update(refcount=F("refcount") - 1)
+                blob = Blob.objects.select_for_update().get(pk=stored.blob_id)
+                if blob.refcount <= 0:
+                    blob.delete()
+                    transaction.on_commit(lambda: self._remove_blob(stored.blob_id))
+            self._unlink(self.path(name), stored.blob_id if stored is not None else None)
+
+    def _unlink(self, path, digest=None):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # Windows will not remove a read-only file. The flag is shared with the
+            # blob the name links to, so the blob is made read-only again after.
+            os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+            os.remove(path)
+            if digest and os.path.exists(self.blob_path(digest)):
+                os.chmod(self.blob_path(digest), READ_ONLY)
+
+    def _remove_blob(self, digest):
+        from .models import Blob
+
+        # A save may have brought the content back since the delete committed.
+        if Blob.objects.filter(pk=digest).exists():
+            return
+        self._unlink(self.blob_path(digest))
@@ -0,0 +1,208 @@
+import hashlib
+import io
+import os
+import shutil
+import stat
+import tempfile
+from unittest import mock
+
+import fitz
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from Archive.models import Category, File
+from Auths.models import CustomUser
+from stamps.models import Document
+from .models import Blob, StoredName, UploadSession
+from .storage import READ_ONLY, ContentAddressedStorage, discard_rolled_back_files
+from .uploads import UploadError, append_chunk, part_path
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.storage = ContentAddressedStorage()
+
+    def save(self, name, data=b"%PDF-1.7 same content"):
+        return self.storage.save(name, ContentFile(data))
+
+    def blob(self, name):
+        return StoredName.objects.select_related("blob").get(name=name).blob
+
+    def test_identical_content_is_stored_once(self):
+        first, second = self.save("documents/a.pdf"), self.save("uploaded_files/b.pdf")
+        self.assertNotEqual(first, second)
+        self.assertTrue(os.path.samefile(self.storage.path(first), self.storage.path(second)))
+        blob = self.blob(first)
+        self.assertEqual((blob.refcount, blob.size), (2, len(b"%PDF-1.7 same content")))
+        self.assertTrue(os.path.samefile(self.storage.path(first), self.storage.blob_path(blob.sha256)))
+        self.assertEqual(Blob.objects.count(), 1)
+
+    def test_a_taken_name_gets_another_one(self):
+        first, second = self.save("documents/a.pdf"), self.save("documents/a.pdf", b"other content")
+        self.assertNotEqual(first, second)
+        with self.storage.open(first) as f:
+            self.assertEqual(f.read(), b"%PDF-1.7 same content")
+
+    def test_stored_files_are_read_only(self):
+        name = self.save("documents/a.pdf")
+        self.assertEqual(stat.S_IMODE(os.stat(self.storage.path(name)).st_mode), READ_ONLY)
+
+    def test_the_last_delete_removes_the_blob(self):
+        first, second = self.save("documents/a.pdf"), self.save("documents/b.pdf")
+        digest = self.blob(first).sha256
+        self.storage.delete(first)
+        self.assertFalse(self.storage.exists(first))
+        self.assertEqual(Blob.objects.get(pk=digest).refcount, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.delete(second)
+        self.assertFalse(Blob.objects.filter(pk=digest).exists())
+        self.assertFalse(os.path.exists(self.storage.blob_path(digest)))
+
+    def test_names_are_private_copies_without_hard_links(self):
+        with mock.patch("blobs.storage.os.link", side_effect=PermissionError("no hard links here")):
+            name = self.save("documents/a.pdf")
+        path, blob_path = self.storage.path(name), self.storage.blob_path(self.blob(name).sha256)
+        self.assertFalse(os.path.samefile(path, blob_path))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"%PDF-1.7 same content")
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), READ_ONLY)
+
+    def test_adopt_turns_existing_files_into_links(self):
+        for name in ("documents/old.pdf", "uploaded_files/old copy.pdf"):
+            os.makedirs(os.path.dirname(self.storage.path(name)), exist_ok=True)
+            with open(self.storage.path(name), "wb") as f:
+                f.write(b"written before the blob storage")
+        digest, reclaimed = self.storage.adopt("documents/old.pdf")
+        self.assertEqual(reclaimed, 0)  # the first copy becomes the blob
+        self.assertEqual(self.storage.adopt("uploaded_files/old copy.pdf"), (digest, 31))
+        for name in ("documents/old.pdf", "uploaded_files/old copy.pdf"):
+            self.assertTrue(os.path.samefile(self.storage.path(name), self.storage.blob_path(digest)))
+        self.assertEqual(Blob.objects.get(pk=digest).refcount, 2)
+
+    def test_files_written_by_a_rolled_back_transaction_are_removed(self):
+        kept = self.save("documents/kept.pdf", b"kept")
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                name = self.save("documents/a.pdf")
+                digest = self.blob(name).sha256
+                raise RuntimeError("boom")
+        discard_rolled_back_files()
+        self.assertFalse(os.path.exists(self.storage.path(name)))
+        self.assertFalse(os.path.exists(self.storage.blob_path(digest)))
+        self.assertTrue(os.path.exists(self.storage.path(kept)))  # its transaction is still open
+
+
+class ResumableUploadTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        overrides = override_settings(
+            MEDIA_ROOT=media, TASKS_EAGER=True, DOCUMENT_TILE_PRERENDER=False, DOCUMENT_SIGNING_KEY="k" * 48,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        hash_filter = mock.patch("stamps.signals.document_hash_filter")
+        hash_filter.start()
+        self.addCleanup(hash_filter.stop)
+        self.user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        pdf = fitz.open()
+        pdf.new_page().insert_text((72, 72), "A large report")
+        self.data = pdf.tobytes()
+
+    def start(self, target="document"):
+        response = self.client.post(
+            "/uploads/", {"filename": "report.pdf", "size": len(self.data), "target": target,
+                          "content_type": "application/pdf"}, format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    def put(self, upload_id, start, end):
+        return self.client.put(
+            f"/uploads/{upload_id}/", self.data[start:end], content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(self.data)}",
+        )
+
+    def send_all(self, upload_id):
+        half = len(self.data) // 2
+        self.assertEqual(self.put(upload_id, 0, half).json()["offset"], half)
+        self.assertEqual(self.put(upload_id, half, len(self.data)).json()["offset"], len(self.data))
+
+    def finalize(self, upload_id, **fields):
+        return self.client.post(f"/uploads/{upload_id}/finalize/", fields, format="json")
+
+    def test_a_chunk_out_of_order_is_refused_with_the_offset(self):
+        upload_id = self.start()
+        response = self.put(upload_id, 100, 200)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["offset"], 0)
+        self.assertFalse(os.path.exists(part_path(UploadSession.objects.get(pk=upload_id))))
+
+    def test_an_interrupted_upload_resumes_at_its_offset(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, 100)
+        self.assertEqual(self.client.get(f"/uploads/{upload_id}/").json()["offset"], 100)
+        self.assertEqual(self.put(upload_id, 0, 100).status_code, 409)  # already received
+        self.put(upload_id, 100, len(self.data))
+        response = self.finalize(upload_id, sha256=hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(response.status_code, 201)
+        with Document.objects.get().file.open("rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_a_chunk_that_loses_the_offset_leaves_the_part_file_alone(self):
+        upload_id = self.start()
+        racing = UploadSession.objects.get(pk=upload_id)  # read before the other request's chunk landed
+        self.put(upload_id, 0, 100)
+        with self.assertRaises(UploadError) as raised:
+            append_chunk(racing, io.BytesIO(b"x" * 100), 0, 100)
+        self.assertEqual((raised.exception.status, raised.exception.offset), (409, 100))
+        with open(part_path(racing), "rb") as f:
+            self.assertEqual(f.read(), self.data[:100])
+        self.assertEqual(os.listdir(os.path.dirname(part_path(racing))), [f"{upload_id}.part"])
+
+    def test_a_digest_mismatch_is_refused(self):
+        upload_id = self.start()
+        self.send_all(upload_id)
+        response = self.finalize(upload_id, sha256="0" * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Document.objects.exists())
+        self.assertEqual(self.finalize(upload_id).status_code, 201)  # the bytes are kept for a retry
+
+    def test_an_incomplete_upload_is_not_finalized(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, 100)
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["offset"], 100)
+
+    def test_finalize_creates_a_document(self):
+        upload_id = self.start()
+        self.send_all(upload_id)
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, 201)
+        document = Document.objects.get()
+        self.assertEqual((document.user, document.file_hash), (self.user, hashlib.sha256(self.data).hexdigest()))
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(os.path.dirname(part_path(UploadSession(pk=upload_id)))), [])
+
+    def test_finalize_creates_an_archive_file(self):
+        Category.objects.create(name="Research Materials")
+        upload_id = self.start(target="archive_file")
+        self.send_all(upload_id)
+        response = self.finalize(
+            upload_id, title="Report", description="Quarterly", category="Research Materials", tags=[],
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        file = File.objects.get()
+        self.assertEqual((file.title, file.author), ("Report", self.user))
+        with file.file.open("rb") as f:
+            self.assertEqual(f.read(), self.data)
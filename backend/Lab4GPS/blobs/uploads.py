@@ -0,0 +1,241 @@
+# blobs/uploads.py
+"""
+Resumable chunked uploads for large documents and archive files.
+
+    POST   /uploads/                 {"filename", "size", "target", "content_type"} -> session
+    PUT    /uploads/<id>/            raw bytes with Content-Range: bytes <start>-<end>/<size>
+    GET    /uploads/<id>/            {"offset": ...}: where to resume after a failure
+    POST   /uploads/<id>/finalize/   the target's other fields -> the created object
+    DELETE /uploads/<id>/            abandon the upload
+
+Chunks are streamed into a scratch file under BLOB_ROOT/incoming and
+copied into the session's part file, at their offset, only in order: a
+chunk that does not start at the session's offset, or loses it to another
+request sending the same range, is refused with 409 and that offset. The
+SHA-256 is updated as each chunk arrives (if a later chunk lands on another
+process, the part file is hashed once at finalize instead).
+
+On finalize the part file is handed to the target's usual serializer as an
+uploaded file that already knows its digest and temporary path, so the
+blob storage moves it into place rather than copying it, and nothing
+re-hashes it.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.utils import timezone
+
+from .models import UploadSession
+from .storage import CHUNK_SIZE
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class AssembledUpload(UploadedFile):
+    """A finished part file, presented as an upload already hashed on arrival."""
+
+    def __init__(self, path, name, content_type, size, sha256):
+        super().__init__(open(path, "rb"), name, content_type or None, size)
+        self.path = path
+        self.sha256 = sha256
+        self.digests = {"sha256": sha256}
+
+    def temporary_file_path(self):
+        return self.path
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            pass  # the storage has moved the file
+
+
+class RunningHashes:
+    """SHA-256 state per session, valid only while chunks keep arriving at this process."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, session_id, offset):
+        """The hasher for a chunk at `offset`, or None if this process has not seen every byte before it."""
+        if offset == 0:
+            return hashlib.sha256()
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry is None or entry[0] != offset:
+            return None
+        return entry[1]
+
+    def put(self, session_id, offset, hasher):
+        with self._lock:
+            self._entries[session_id] = (offset, hasher)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+
+running_hashes = RunningHashes()
+
+
+def incoming_path(filename):
+    """A scratch path on the blobs' filesystem, so the storage can move the finished file into place."""
+    blob_root = getattr(default_storage, "blob_root", None) or os.path.join(settings.MEDIA_ROOT, "blobs")
+    return os.path.join(blob_root, "incoming", filename)
+
+
+def part_path(session):
+    return incoming_path(f"{session.pk}.part")
+
+
+def create_session(user, target, filename, size, content_type=""):
+    purge_expired()
+    ttl = getattr(settings, "UPLOAD_SESSION_TTL", 24 * 3600)
+    return UploadSession.objects.create(
+        user=user, target=target, filename=os.path.basename(filename), size=size,
+        content_type=content_type, expires_at=timezone.now() + timedelta(seconds=ttl),
+    )
+
+
+def parse_content_range(header, session):
+    """(start, length) from a Content-Range header, checked against the session."""
+    match = CONTENT_RANGE.fullmatch((header or "").strip())
+    if not match:
+        raise UploadError("A Content-Range header 'bytes <start>-<end>/<size>' is required.")
+    start, end, total = (int(group) for group in match.groups())
+    if total != session.size or end < start or end >= session.size:
+        raise UploadError(f"Content-Range does not fit an upload of {session.size} bytes.")
+    length = end - start + 1
+    limit = getattr(settings, "UPLOAD_CHUNK_MAX_SIZE", 16 * 1024 * 1024)
+    if length > limit:
+        raise UploadError(f"Chunks may be at most {limit} bytes.", status=413)
+    return start, length
+
+
+def append_chunk(session, stream, start, length):
+    """Writes `length` bytes from `stream` at `start`; returns the new offset."""
+    if start != session.received:
+        raise UploadError("Chunk does not start at the upload's offset.", status=409, offset=session.received)
+
+    path = part_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    hasher = running_hashes.take(session.pk, start)
+    # The chunk lands in a file of this request's own first: the part file is
+    # only written by the request that wins the offset below.
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=f"{session.pk}.", suffix=".chunk") as chunk:
+        written = 0
+        while written < length:
+            data = stream.read(min(CHUNK_SIZE, length - written))
+            if not data:
+                break
+            chunk.write(data)
+            if hasher is not None:
+                hasher.update(data)
+            written += len(data)
+        if written != length:
+            raise UploadError("The chunk ended early; resend it.", offset=session.received)
+        chunk.seek(0)
+
+        # Only one request can move the offset past `start` (two clients racing on a
+        # chunk); the row stays locked until its bytes are in the part file, and a
+        # failed write rolls the offset back.
+        with transaction.atomic():
+            won = UploadSession.objects.filter(pk=session.pk, received=start).update(received=start + length)
+            if not won:
+                session.refresh_from_db(fields=["received"])
+                raise UploadError("Another request wrote this chunk.", status=409, offset=session.received)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.seek(start)
+                shutil.copyfileobj(chunk, f, CHUNK_SIZE)
+    session.received = start + length
+    if hasher is not None:
+        running_hashes.put(session.pk, session.received, hasher)
+    return session.received
+
+
+def assemble(session, expected_sha256=None):
+    """The completed part file as an AssembledUpload, checked against an optional client digest."""
+    if session.received != session.size:
+        raise UploadError(
+            f"Upload incomplete: {session.received} of {session.size} bytes received.",
+            status=409, offset=session.received,
+        )
+    path = part_path(session)
+    hasher = running_hashes.take(session.pk, session.received)
+    if hasher is None:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                hasher.update(chunk)
+    digest = hasher.hexdigest()
+    if expected_sha256 and expected_sha256.lower() != digest:
+        running_hashes.put(session.pk, session.received, hasher)
+        raise UploadError("SHA-256 of the received bytes does not match.", offset=session.received)
+
+    # Bytes past `received` (a chunk whose offset update rolled back) are not part of the file.
+    if os.path.getsize(path) != session.size:
+        os.truncate(path, session.size)
+    return AssembledUpload(path, session.filename, session.content_type, session.size, digest)
+
+
+def discard(session):
+    """Drops the session and whatever is left of its part file."""
+    running_hashes.discard(session.pk)
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
+
+
+def purge_expired():
+    for session in UploadSession.objects.filter(expires_at__lt=timezone.now()):
+        discard(session)
+
+
+# ---------------- targets ----------------
+
+def _create_document(request, upload, data):
+    from stamps.serializers import DocumentSerializer
+
+    serializer = DocumentSerializer(data={"file": upload}, context={"request": request})
+    serializer.is_valid(raise_exception=True)
+    serializer.save(user=request.user, stamped=False)
+    return serializer.data
+
+
+def _create_archive_file(request, upload, data):
+    from Archive.serializers import FileSerializer
+
+    serializer = FileSerializer(data={**data, "file": upload}, context={"request": request})
+    serializer.is_valid(raise_exception=True)
+    serializer.save(author=request.user)
+    return serializer.data
+
+
+TARGETS = {
+    UploadSession.Target.DOCUMENT: _create_document,
+    UploadSession.Target.ARCHIVE_FILE: _create_archive_file,
+}
@@ -0,0 +1,9 @@
+from django.urls import path
+from .views import UploadFinalizeView, UploadSessionCreateView, UploadSessionView
+
+urlpatterns = [
+    # Resumable uploads
+    path('', UploadSessionCreateView.as_view(), name='upload-create'),
+    path('<uuid:pk>/', UploadSessionView.as_view(), name='upload-session'),
+    path('<uuid:pk>/finalize/', UploadFinalizeView.as_view(), name='upload-finalize'),
+]
@@ -0,0 +1,95 @@
+from django.db import transaction
+from rest_framework import status
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .models import UploadSession
+from .serializers import UploadSessionSerializer
+from .uploads import (
+    TARGETS, UploadError, append_chunk, assemble, create_session, discard, parse_content_range,
+)
+
+
+def _error(exc):
+    body = {"error": str(exc)}
+    if exc.offset is not None:
+        body["offset"] = exc.offset
+    return Response(body, status=exc.status)
+
+
+class UploadSessionCreateView(APIView):
+    """
+    API endpoint to start a resumable upload (see blobs/uploads.py).
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser]
+
+    def post(self, request):
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = create_session(request.user, **serializer.validated_data)
+        return Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionView(APIView):
+    """
+    API endpoint to send chunks (PUT), check the offset (GET) or abandon (DELETE) an upload.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_session(self, request, pk):
+        return UploadSession.objects.filter(pk=pk, user=request.user).first()
+
+    def get(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(UploadSessionSerializer(session).data)
+
+    def put(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            start, length = parse_content_range(request.headers.get("Content-Range"), session)
+            # Read the raw body as a stream: the chunk never sits in memory whole.
+            offset = append_chunk(session, request._request, start, length)
+        except UploadError as exc:
+            return _error(exc)
+        return Response({"offset": offset, "size": session.size})
+
+    def delete(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        discard(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadFinalizeView(APIView):
+    """
+    API endpoint to turn a completed upload into its target (a Document or an
+    archive File). The body carries the target's other fields, and optionally
+    the client's "sha256" of the whole file.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser]
+
+    def post(self, request, pk):
+        session = UploadSession.objects.filter(pk=pk, user=request.user).first()
+        if session is None:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        data = dict(request.data)
+        try:
+            upload = assemble(session, expected_sha256=data.pop("sha256", None))
+        except UploadError as exc:
+            return _error(exc)
+        try:
+            with transaction.atomic():
+                result = TARGETS[session.target](request, upload, data)
+        finally:
+            upload.close()
+        discard(session)
+        return Response(result, status=status.HTTP_201_CREATED)
@@ -0,0 +1,159 @@
+# stamps/anchoring.py
+"""
+Batch attestation of document hashes with Merkle trees.
+
+Signing every document does not scale to nightly batches of tens of
+thousands, so each run of `manage.py anchor_hashes` takes every file hash
+not anchored yet, builds one Merkle tree over them and signs only its root
+(a HashBatch row). Each document keeps its inclusion proof: the sibling
+hashes on the path from its leaf to the root.
+
+verify-document recomputes the root from the document's hash and proof
+(log2(n) SHA-256 calls) and checks the batch signature (one HMAC), so a
+row whose hash was changed after anchoring no longer matches.
+
+The tree follows RFC 6962: leaves and inner nodes are hashed with distinct
+prefixes (0x00, 0x01), and a node without a sibling is carried up a level
+unchanged rather than paired with itself. A proof is a list of
+[side, sibling hex] pairs, side "l" or "r" being where the sibling sits.
+
+The root is signed with HMAC-SHA256 keyed by DOCUMENT_SIGNING_KEY (its
+fallbacks are accepted when verifying), like the QR payloads; see
+stamps/signing.py. The key lives in the environment, not the database or
+the repository, so rewriting hashes, proofs and roots in the database is not
+enough to forge a batch. Batches signed with SECRET_KEY before that key was
+introduced are re-signed with `anchor_hashes --resign-legacy`.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .signing import signing_key, verification_keys
+
+KEY_SALT = "stamps.hash-batch"
+UPDATE_CHUNK = 1000
+
+
+class AnchorError(Exception):
+    """A document's inclusion proof or its batch signature does not check out."""
+
+
+def leaf_hash(file_hash):
+    return hashlib.sha256(b"\x00" + bytes.fromhex(file_hash)).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def build_tree(file_hashes):
+    """
+    Returns (root hex, proofs) for a list of hex file hashes; proofs[i] is
+    the inclusion proof of file_hashes[i].
+    """
+    if not file_hashes:
+        raise ValueError("A Merkle tree needs at least one leaf.")
+    level = [leaf_hash(file_hash) for file_hash in file_hashes]
+    positions = list(range(len(level)))  # where each leaf's ancestor sits in `level`
+    proofs = [[] for _ in level]
+    while len(level) > 1:
+        for leaf, position in enumerate(positions):
+            sibling = position ^ 1
+            if sibling < len(level):
+                proofs[leaf].append(["l" if sibling < position else "r", level[sibling].hex()])
+        level = [
+            node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ]
+        positions = [position // 2 for position in positions]
+    return level[0].hex(), proofs
+
+
+def root_from_proof(file_hash, proof):
+    """The root that `file_hash` and `proof` lead to."""
+    current = leaf_hash(file_hash)
+    for side, sibling in proof:
+        sibling = bytes.fromhex(sibling)
+        current = node_hash(sibling, current) if side == "l" else node_hash(current, sibling)
+    return current.hex()
+
+
+def sign_root(root, secret=None):
+    """Raises SigningKeyMissing when no `secret` is given and no signing key is configured."""
+    return salted_hmac(KEY_SALT, root, secret=secret or signing_key(), algorithm="sha256").hexdigest()
+
+
+def verify_anchor(document):
+    """
+    Checks `document`'s proof against its batch. Returns the HashBatch, None
+    if the document has not been anchored yet, or raises AnchorError.
+    """
+    batch = document.anchor_batch
+    if batch is None:
+        return None
+    try:
+        root = root_from_proof(document.file_hash, document.anchor_proof or [])
+    except (TypeError, ValueError):
+        raise AnchorError("The document's inclusion proof is malformed.")
+    if not constant_time_compare(root, batch.root):
+        raise AnchorError("The document's hash does not lead to its batch's root.")
+    if not any(constant_time_compare(batch.signature, sign_root(batch.root, key)) for key in verification_keys()):
+        raise AnchorError("The batch root's signature does not match.")
+    return batch
+
+
+def anchor_pending(max_leaves=None):
+    """
+    Anchors up to `max_leaves` (HASH_ANCHOR_MAX_LEAVES) documents that have a
+    hash but no batch, oldest first, in one HashBatch. Returns the batch, or
+    None if nothing was pending.
+    """
+    from .models import Document, HashBatch
+
+    max_leaves = max_leaves or getattr(settings, "HASH_ANCHOR_MAX_LEAVES", 100_000)
+    key = signing_key()  # before anything is locked or written
+    with transaction.atomic():
+        # Locked so a document re-stamped meanwhile cannot end up with a proof for its old hash.
+        pending = list(
+            Document.objects.select_for_update()
+            .filter(anchor_batch__isnull=True, file_hash__isnull=False)
+            .exclude(file_hash="")
+            .order_by("id")
+            .only("id", "file_hash")[:max_leaves]
+        )
+        if not pending:
+            return None
+        root, proofs = build_tree([document.file_hash for document in pending])
+        batch = HashBatch.objects.create(root=root, signature=sign_root(root, key), leaf_count=len(pending))
+        for document, proof in zip(pending, proofs):
+            document.anchor_proof = proof
+        # The batch is the same for every row: one plain UPDATE per chunk, CASE only for the proofs.
+        for start in range(0, len(pending), UPDATE_CHUNK):
+            chunk = pending[start:start + UPDATE_CHUNK]
+            Document.objects.filter(pk__in=[document.pk for document in chunk]).update(anchor_batch=batch)
+            Document.objects.bulk_update(chunk, ["anchor_proof"])
+    return batch
+
+
+def resign_legacy_batches():
+    """
+    Re-signs, with the current signing key, every batch whose signature still
+    checks out under SECRET_KEY (how batches were signed before
+    DOCUMENT_SIGNING_KEY). Returns (re-signed, left alone).
+    """
+    from .models import HashBatch
+
+    key = signing_key()
+    resigned = skipped = 0
+    for batch in HashBatch.objects.only("id", "root", "signature").iterator():
+        legacy = sign_root(batch.root, settings.SECRET_KEY)
+        if constant_time_compare(batch.signature, legacy):
+            HashBatch.objects.filter(pk=batch.pk, signature=batch.signature).update(
+                signature=sign_root(batch.root, key)
+            )
+            resigned += 1
+        else:
+            skipped += 1
+    return resigned, skipped
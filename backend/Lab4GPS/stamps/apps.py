@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class StampsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stamps'
+
+    def ready(self):
+        from . import signals, signing  # noqa: F401
@@ -0,0 +1,136 @@
+# stamps/batch.py
+"""
+Helpers for verify-batch: expanding a batch upload into individual files
+and verifying them concurrently, yielding each result as soon as it is done.
+
+Files come either as several multipart parts or packed in ZIP archives (or
+both). ZIP entries are read one at a time as workers free up, so only about
+`max_pending` files are held in memory at once regardless of batch size.
+
+A request carries at most DATA_UPLOAD_MAX_NUMBER_FILES parts (Django's
+global limit, left alone); larger batches, up to BATCH_VERIFY_MAX_FILES
+files in all, come as ZIP archives.
+"""
+import mimetypes
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.exceptions import TooManyFilesSent
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections
+from rest_framework.parsers import MultiPartParser
+
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
+
+
+class BatchError(Exception):
+    """The batch as a whole cannot be processed (bad archive, too many files)."""
+
+
+class BatchMultiPartParser(MultiPartParser):
+    """verify-batch's parser: too many parts is a BatchError asking for a ZIP archive instead."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return super().parse(stream, media_type, parser_context)
+        except TooManyFilesSent:
+            raise BatchError(
+                f"Send at most {settings.DATA_UPLOAD_MAX_NUMBER_FILES} files per request; pack larger "
+                f"batches (up to {getattr(settings, 'BATCH_VERIFY_MAX_FILES', 500)} files) in a ZIP archive."
+            )
+
+
+def is_zip(uploaded_file):
+    content_type = (uploaded_file.content_type or "").lower()
+    return content_type in ZIP_CONTENT_TYPES or uploaded_file.name.lower().endswith(".zip")
+
+
+def _zip_entries(archive, max_size):
+    """Yields (name, loader) for each file in the archive, skipping directories and hidden files."""
+    for info in archive.infolist():
+        name = info.filename
+        basename = os.path.basename(name)
+        if info.is_dir() or not basename or basename.startswith(".") or name.startswith("__MACOSX/"):
+            continue
+        if info.file_size > max_size:
+            yield name, BatchError(f"File is larger than {max_size} bytes.")
+            continue
+
+        def load(info=info, basename=basename):
+            content_type = mimetypes.guess_type(basename)[0] or "application/octet-stream"
+            return SimpleUploadedFile(basename, archive.read(info), content_type=content_type)
+
+        yield name, load
+
+
+def iter_batch_files(uploaded_files):
+    """
+    Yields (name, loader) per file in the batch. `loader` is a callable
+    returning an UploadedFile, or a BatchError describing why the entry is
+    skipped. Raises BatchError if the batch is over BATCH_VERIFY_MAX_FILES
+    or an archive cannot be opened.
+    """
+    max_files = getattr(settings, "BATCH_VERIFY_MAX_FILES", 500)
+    max_size = getattr(settings, "BATCH_VERIFY_MAX_FILE_SIZE", 50 * 1024 * 1024)
+    count = 0
+    for uploaded in uploaded_files:
+        if is_zip(uploaded):
+            try:
+                archive = zipfile.ZipFile(uploaded)
+            except zipfile.BadZipFile:
+                raise BatchError(f"'{uploaded.name}' is not a valid ZIP archive.")
+            entries = _zip_entries(archive, max_size)
+        else:
+            entries = [(uploaded.name, lambda uploaded=uploaded: uploaded)]
+        for name, loader in entries:
+            count += 1
+            if count > max_files:
+                raise BatchError(f"A batch can contain at most {max_files} files.")
+            yield name, loader
+
+
+def count_batch_files(uploaded_files):
+    """Validates the batch up front (archives open, file limit) and returns its size."""
+    return sum(1 for _ in iter_batch_files(uploaded_files))
+
+
+def _run(verify, loader):
+    try:
+        if isinstance(loader, BatchError):
+            raise loader
+        return verify(loader())
+    finally:
+        # Worker threads get their own DB connections; don't leave them open.
+        connections.close_all()
+
+
+def verify_concurrently(entries, verify, workers=None, max_pending=None):
+    """
+    Runs `verify(uploaded_file)` for each (name, loader) in `entries` on a
+    thread pool and yields (name, result or exception) in completion order.
+    """
+    workers = workers or getattr(settings, "BATCH_VERIFY_WORKERS", 4)
+    max_pending = max_pending or workers * 2
+    entries = iter(entries)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="verify-batch") as pool:
+        pending = {}
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    name, loader = next(entries)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[pool.submit(_run, verify, loader)] = name
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    yield name, future.result()
+                except Exception as e:
+                    yield name, e
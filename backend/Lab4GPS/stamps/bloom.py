@@ -0,0 +1,301 @@
+# stamps/bloom.py
+"""
+Bloom filter over Document.file_hash (and the hashes of earlier revisions),
+used as a negative fast path by verify-document: most public verification
+attempts are for files we never issued, and a filter miss proves that
+without a database query.
+
+The filter lives in a memory-mapped file (HASH_FILTER_PATH), so every worker
+process on the host shares the same bits and sees new hashes as soon as any
+process adds them. Bits are only ever set, never cleared, so a stale or
+deleted hash can only cause a false positive, which falls through to the
+indexed database lookup.
+
+If the file is missing or was built with different parameters it is rebuilt
+from the database on first use. wsgi.py/asgi.py call warm_up() so that
+happens at startup rather than in the first verify request; it also rebuilds
+a file older than HASH_FILTER_STARTUP_MAX_AGE, which picks up anything that
+reached the database without going through the paths below.
+
+Hashes get in through Document post_save (stamps/signals.py) and through
+Document.objects.bulk_create / bulk_update / update(file_hash="...")
+(DocumentQuerySet). Raw SQL, or an update() setting file_hash to an
+expression, bypasses both: run `manage.py rebuild_hash_filter` afterwards,
+or verify-document answers "invalid" for those hashes until the next rebuild.
+
+A rebuild writes a new file and swaps it in with a rename. Adds and
+rebuilds take an exclusive lock on a separate file (HASH_FILTER_PATH.lock)
+that survives the swap. Under it, add() checks that the mapped file is still
+the one at HASH_FILTER_PATH and reopens it if not, so a hash is never
+written into a replaced file. A lookup that misses makes the same check
+before answering. Hashes are added once their transaction commits, so a
+concurrent rebuild either reads the row or holds the add until the new file
+is in place.
+
+Windows has no flock and will not rename over a file another process has
+mapped: the lock uses msvcrt.locking there, and a rebuild that cannot swap
+the file copies the new bits over the old ones in place instead. Bits only
+go from unset to set in that copy, so a lookup racing it cannot lose a hash
+it would have found before.
+"""
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from .models import Document, DocumentRevision
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CSVBLOOM"
+HEADER = struct.Struct("<8sQQQ")  # magic, bit count, hash count, built at (unix time)
+
+
+def _lock_exclusive(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    lock_file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)  # gives up after ~10 s
+            return
+        except OSError:
+            continue
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def optimal_parameters(capacity, error_rate):
+    """Returns (bits, hashes) for `capacity` items at the given false-positive rate."""
+    bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class BloomFilter:
+    """
+    A Bloom filter over a bytearray or any writable buffer (e.g. an mmap).
+    Positions come from double hashing of one 128-bit BLAKE2b digest.
+    """
+
+    def __init__(self, bits, hashes, buffer=None, offset=0):
+        self.bits = bits
+        self.hashes = hashes
+        self.offset = offset
+        self.buffer = buffer if buffer is not None else bytearray((bits + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        buffer, offset = self.buffer, self.offset
+        for position in self._positions(item):
+            buffer[offset + (position >> 3)] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        buffer, offset = self.buffer, self.offset
+        for position in self._positions(item):
+            if not buffer[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class SharedHashFilter:
+    """
+    The process-wide, file-backed filter of issued document hashes.
+    """
+
+    def __init__(self, path=None, capacity=None, error_rate=None):
+        self._path = path
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._lock = threading.Lock()  # taken before the file lock, never after
+        self._filter = None
+        self._mmap = None
+        self._inode = None
+
+    @property
+    def path(self):
+        return self._path or getattr(
+            settings, "HASH_FILTER_PATH", os.path.join(settings.BASE_DIR, "var", "document_hashes.bloom")
+        )
+
+    def parameters(self):
+        capacity = self._capacity or getattr(settings, "HASH_FILTER_CAPACITY", 2_000_000)
+        error_rate = self._error_rate or getattr(settings, "HASH_FILTER_ERROR_RATE", 0.001)
+        return optimal_parameters(capacity, error_rate)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive across processes; held by add() and rebuild()."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.lock", "ab") as lock_file:
+            _lock_exclusive(lock_file)
+            try:
+                yield
+            finally:
+                _unlock(lock_file)
+
+    def _header(self):
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER.size)
+        except FileNotFoundError:
+            return None
+        return HEADER.unpack(header) if len(header) == HEADER.size else None
+
+    def _file_matches(self, bits, hashes):
+        header = self._header()
+        return header is not None and header[:3] == (MAGIC, bits, hashes)
+
+    def _built_at(self):
+        """When the file at `path` was built (0 if it is missing or unusable)."""
+        header = self._header()
+        return header[3] if header is not None and header[:3] == (MAGIC, *self.parameters()) else 0
+
+    def _swapped(self):
+        """True if the mapped file is no longer the one at `path`."""
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            return True
+
+    def _open(self, file_locked=False):
+        bits, hashes = self.parameters()
+        if not self._file_matches(bits, hashes):
+            if file_locked:
+                self._rebuild()
+            else:
+                with self._file_lock():
+                    if not self._file_matches(bits, hashes):  # unless another process just rebuilt it
+                        self._rebuild()
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            mapped = mmap.mmap(fd, HEADER.size + (bits + 7) // 8)
+            self._inode = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+        # The old map is not closed here: another thread may still be reading it.
+        self._mmap = mapped
+        self._filter = BloomFilter(bits, hashes, buffer=mapped, offset=HEADER.size)
+
+    def _current(self, refresh=False):
+        with self._lock:
+            if self._filter is None or (refresh and self._swapped()):
+                self._open()
+            return self._filter
+
+    def load(self, max_age=None):
+        """
+        Maps the filter now instead of on first use, first rebuilding it if it
+        was built more than `max_age` seconds ago.
+        """
+        if max_age is not None:
+            with self._file_lock():
+                if time.time() - self._built_at() > max_age:
+                    self._rebuild()
+        self._current(refresh=True)
+
+    def might_contain(self, file_hash):
+        """False means the hash was definitely never issued."""
+        current = self._current()
+        if file_hash in current:
+            return True
+        # Not a miss that a rebuild's new file would answer.
+        fresh = self._current(refresh=True)
+        return fresh is not current and file_hash in fresh
+
+    def add(self, file_hash):
+        self.add_many([file_hash])
+
+    def add_many(self, file_hashes):
+        # Other processes write the same map and rebuild swaps it; serialise both.
+        with self._lock, self._file_lock():
+            if self._filter is None or self._swapped():
+                self._open(file_locked=True)
+            for file_hash in file_hashes:
+                self._filter.add(file_hash)
+
+    def rebuild(self):
+        """Builds a fresh filter from every stored hash and swaps it in atomically."""
+        with self._file_lock():
+            return self._rebuild()
+
+    def _rebuild(self):
+        bits, hashes = self.parameters()
+        fresh = BloomFilter(bits, hashes)
+        hashes_in_db = (
+            Document.objects.exclude(file_hash__isnull=True)
+            .exclude(file_hash="")
+            .values_list("file_hash", flat=True)
+        )
+        for file_hash in hashes_in_db.iterator(chunk_size=10_000):
+            fresh.add(file_hash)
+        # Earlier revisions of stamped documents still verify.
+        revision_hashes = DocumentRevision.objects.values_list("file_hash", flat=True)
+        for file_hash in revision_hashes.iterator(chunk_size=10_000):
+            fresh.add(file_hash)
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, bits, hashes, int(time.time())))
+            f.write(fresh.buffer)
+        try:
+            os.replace(tmp_path, self.path)
+        except PermissionError:
+            # Windows: the file is mapped by another process. Same parameters, so same size.
+            if not self._file_matches(bits, hashes):
+                raise
+            with open(tmp_path, "rb") as new, open(self.path, "r+b") as current:
+                current.write(new.read())
+            os.remove(tmp_path)
+        return fresh
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = self._filter = None
+
+
+document_hash_filter = SharedHashFilter()
+
+
+def add_hashes_on_commit(file_hashes):
+    """Adds the hashes to the shared filter once the current transaction commits."""
+    file_hashes = [file_hash for file_hash in file_hashes if file_hash]
+    if file_hashes:
+        transaction.on_commit(lambda: document_hash_filter.add_many(file_hashes))
+
+
+def warm_up():
+    """Builds and maps the filter at process startup (called from wsgi.py/asgi.py)."""
+    try:
+        document_hash_filter.load(max_age=getattr(settings, "HASH_FILTER_STARTUP_MAX_AGE", 300))
+    except (DatabaseError, OSError):
+        # Not migrated yet, read-only disk...: it is built on first use instead.
+        logger.exception("Could not build the document hash filter at startup")
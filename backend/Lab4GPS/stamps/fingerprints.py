@@ -0,0 +1,131 @@
+# stamps/fingerprints.py
+"""
+Per-page fingerprints of issued PDFs, for tamper localisation.
+
+Each page gets two fingerprints when the document is ingested:
+
+  text_hash   SHA-256 of the page text, case-folded with whitespace collapsed
+  image_hash  64-bit difference hash (dHash) of a small grayscale render
+
+Both are indexed (see PageFingerprint), so finding the issued document
+closest to an unknown upload is an index lookup on its page hashes rather
+than a scan, and comparing page by page says which pages were changed.
+"""
+import hashlib
+import re
+
+import fitz  # PyMuPDF
+from django.db.models import Count, Q
+from PIL import Image
+
+from . import models  # module reference: models imports this module via pipeline
+
+THUMBNAIL_ZOOM = 0.25  # 18 dpi; plenty for a 9x8 dHash
+# Fingerprints shared by every blank page; they say nothing about identity.
+BLANK_IMAGE_HASH = "0" * 16
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def page_text_hash(page):
+    text = normalize_text(page.get_text())
+    if not text:
+        return None
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def page_image_hash(page):
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(THUMBNAIL_ZOOM, THUMBNAIL_ZOOM), colorspace=fitz.csGRAY, alpha=False)
+    image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+    pixels = list(image.resize((9, 8), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+
+def fingerprint_pdf(data=None, path=None, max_pages=None):
+    """
+    Returns [(page_number, text_hash, image_hash), ...] for a PDF given as
+    bytes or a file path, or [] if it cannot be read as a PDF or has more
+    than `max_pages` pages.
+    """
+    try:
+        pdf = fitz.open(path) if path else fitz.open(stream=data, filetype="pdf")
+    except Exception:
+        return []
+    with pdf:
+        if not pdf.is_pdf or (max_pages is not None and pdf.page_count > max_pages):
+            return []
+        return [
+            (index + 1, page_text_hash(page), page_image_hash(page))
+            for index, page in enumerate(pdf)
+        ]
+
+
+def fingerprint_upload(uploaded_file, max_pages=None):
+    """Fingerprints an UploadedFile/File without writing it anywhere."""
+    if hasattr(uploaded_file, "temporary_file_path"):
+        return fingerprint_pdf(path=uploaded_file.temporary_file_path(), max_pages=max_pages)
+    uploaded_file.seek(0)
+    data = uploaded_file.read()
+    uploaded_file.seek(0)
+    return fingerprint_pdf(data=data, max_pages=max_pages)
+
+
+def replace_fingerprints(document, fingerprints):
+    """Stores `fingerprints` as the document's page index, replacing any old rows."""
+    models.PageFingerprint.objects.filter(document=document).delete()
+    models.PageFingerprint.objects.bulk_create([
+        models.PageFingerprint(document=document, page_number=page, text_hash=text_hash, image_hash=image_hash)
+        for page, text_hash, image_hash in fingerprints
+    ])
+
+
+def differing_pages(fingerprints, document):
+    """1-based page numbers where the upload and `document` disagree."""
+    stored = {
+        row.page_number: row
+        for row in models.PageFingerprint.objects.filter(document=document)
+    }
+    uploaded = {page: (text_hash, image_hash) for page, text_hash, image_hash in fingerprints}
+    pages = []
+    for page in sorted(set(stored) | set(uploaded)):
+        row = stored.get(page)
+        if row is None or page not in uploaded or uploaded[page] != (row.text_hash, row.image_hash):
+            pages.append(page)
+    return pages
+
+
+def closest_document(fingerprints):
+    """
+    The document sharing the most page fingerprints with the upload, found
+    through the text_hash/image_hash indexes. Returns (document_id, matches)
+    or (None, 0).
+    """
+    text_hashes = {text_hash for _, text_hash, _ in fingerprints if text_hash}
+    image_hashes = {image_hash for _, _, image_hash in fingerprints if image_hash != BLANK_IMAGE_HASH}
+    if not text_hashes and not image_hashes:
+        return None, 0
+    best = (
+        models.PageFingerprint.objects.filter(Q(text_hash__in=text_hashes) | Q(image_hash__in=image_hashes))
+        .values("document_id")
+        .annotate(matches=Count("id"))
+        .order_by("-matches", "document_id")
+        .first()
+    )
+    if best is None:
+        return None, 0
+    return best["document_id"], best["matches"]
+
+
+def describe_pages(pages):
+    """[3] -> 'page 3', [3, 7] -> 'pages 3 and 7', [1, 2, 5] -> 'pages 1, 2 and 5'."""
+    if len(pages) == 1:
+        return f"page {pages[0]}"
+    return "pages " + ", ".join(str(page) for page in pages[:-1]) + f" and {pages[-1]}"
@@ -0,0 +1,84 @@
+# stamps/jobs.py
+"""
+Background processing of StampJobs.
+
+Creating a job only writes the StampJob, one StampJobItem per document and
+one queued task per item (stamps.tasks.stamp_job_item), all in the same
+transaction. Task workers each stamp one document (stamp_document, one save,
+so the hash and QR are refreshed through the save pipeline), record the
+item's outcome in the same transaction and bump the job's counters with
+F() updates, so concurrent workers never lose an increment and a retried
+item is never stamped twice. The last item to finish marks
+the job completed (or failed, when no document could be stamped).
+
+The stamp is rendered once per size through the render cache and reused for
+every document in the job.
+"""
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Document, StampJob, StampJobItem
+from .stamping import stamp_document
+
+
+def create_job(user, stamp, documents, placements):
+    """Creates a job with one pending item per document and queues it."""
+    with transaction.atomic():
+        job = StampJob.objects.create(user=user, stamp=stamp, placements=placements, total=len(documents))
+        StampJobItem.objects.bulk_create([StampJobItem(job=job, document=document) for document in documents])
+        start_job(job)
+    return job
+
+
+def start_job(job):
+    """Queues a task for every pending item of `job`."""
+    from .tasks import stamp_job_item  # stamps.tasks imports this module
+
+    item_ids = job.items.filter(status="pending").values_list("id", flat=True)
+    stamp_job_item.defer_many((item_id,) for item_id in item_ids)
+
+
+def process_item(item_id):
+    """
+    Stamps one document and records the outcome; runs on a task worker.
+
+    The item is claimed with a conditional UPDATE (pending -> running) in the
+    same transaction as the stamped document and the recorded outcome, so
+    no other transaction sees it as running. A run retried after its lease
+    expired blocks on that write until the first one commits, and then finds
+    the item finished, or still pending if the first run died and rolled back.
+    """
+    item = StampJobItem.objects.filter(pk=item_id, status="pending").only("job_id").first()
+    if item is None:
+        return
+    StampJob.objects.filter(pk=item.job_id, status="pending").update(status="running", started_at=timezone.now())
+
+    with transaction.atomic():
+        if not StampJobItem.objects.filter(pk=item_id, status="pending").update(status="running"):
+            return  # finished by another run
+        item = StampJobItem.objects.select_related("job__stamp").get(pk=item_id)
+        job = item.job
+        start = time.perf_counter()
+        try:
+            document = Document.objects.get(pk=item.document_id)
+            stamp_document(document, job.stamp, job.placements)  # a savepoint: rolled back alone on failure
+        except Exception as e:
+            item.status, item.error = "failed", str(e)
+        else:
+            item.status = "succeeded"
+        item.duration_ms = round((time.perf_counter() - start) * 1000, 3)
+        item.finished_at = timezone.now()
+        item.save(update_fields=["status", "error", "duration_ms", "finished_at"])
+        counter = item.status  # 'succeeded' or 'failed'
+        StampJob.objects.filter(pk=job.pk).update(**{counter: F(counter) + 1})
+        _finish_if_done(job.pk)
+
+
+def _finish_if_done(job_id):
+    now = timezone.now()
+    done = StampJob.objects.filter(pk=job_id, status="running", total=F("succeeded") + F("failed"))
+    done.filter(succeeded=0).update(status="failed", finished_at=now)
+    done.update(status="completed", finished_at=now)
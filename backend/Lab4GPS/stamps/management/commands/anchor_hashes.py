@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stamps.anchoring import anchor_pending, resign_legacy_batches
+from stamps.signing import SigningKeyMissing
+
+
+class Command(BaseCommand):
+    help = (
+        "Anchors every document hash not anchored yet: builds one Merkle tree "
+        "over them, signs its root and stores each document's inclusion proof. "
+        "Run it on a schedule (nightly, say); each run is one signing operation."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-leaves", type=int, default=None,
+            help="Documents per batch (default HASH_ANCHOR_MAX_LEAVES); run again for the rest.",
+        )
+        parser.add_argument(
+            "--resign-legacy", action="store_true",
+            help="Re-sign batches signed with SECRET_KEY (before DOCUMENT_SIGNING_KEY) with the current key.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options["resign_legacy"]:
+                resigned, skipped = resign_legacy_batches()
+                self.stdout.write(self.style.SUCCESS(
+                    f"Re-signed {resigned} batch(es); {skipped} were not signed with SECRET_KEY."
+                ))
+                return
+            batch = anchor_pending(options["max_leaves"])
+        except SigningKeyMissing as e:
+            raise CommandError(str(e))
+        if batch is None:
+            self.stdout.write("No document hashes to anchor.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Anchored {batch.leaf_count} document hash(es) in batch {batch.pk} (root {batch.root})."
+        ))
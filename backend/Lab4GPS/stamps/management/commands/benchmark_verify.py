@@ -0,0 +1,105 @@
+import os
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from stamps.bloom import BloomFilter, optimal_parameters
+from stamps.models import Document
+
+
+class Rollback(Exception):
+    pass
+
+
+def _random_hash():
+    return os.urandom(32).hex()
+
+
+def _timed(fn, items):
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        samples.append((time.perf_counter() - start) * 1_000_000)
+    samples.sort()
+    return {
+        "p50": statistics.median(samples),
+        "p99": samples[int(len(samples) * 0.99) - 1],
+        "mean": statistics.fmean(samples),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks verify-document hash lookups: Bloom filter negatives versus "
+        "indexed Document.file_hash queries. Synthetic documents are inserted in "
+        "a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=1_000_000)
+        parser.add_argument("--lookups", type=int, default=10_000)
+        parser.add_argument("--error-rate", type=float, default=0.001)
+        parser.add_argument(
+            "--skip-db", action="store_true",
+            help="Only benchmark the in-memory filter; do not insert rows.",
+        )
+
+    def report(self, label, stats):
+        self.stdout.write(
+            f"{label:<34} p50 {stats['p50']:9.2f} us   p99 {stats['p99']:9.2f} us   mean {stats['mean']:9.2f} us"
+        )
+
+    def handle(self, *args, **options):
+        count = options["documents"]
+        lookups = options["lookups"]
+        bits, hashes = optimal_parameters(count, options["error_rate"])
+        bloom = BloomFilter(bits, hashes)
+
+        self.stdout.write(f"Generating {count} hashes ({bits / 8 / 1024 / 1024:.1f} MiB filter, k={hashes})...")
+        issued = [_random_hash() for _ in range(count)]
+        for file_hash in issued:
+            bloom.add(file_hash)
+        unknown = [_random_hash() for _ in range(lookups)]
+        known = issued[:: max(1, count // lookups)][:lookups]
+
+        false_positives = sum(1 for file_hash in unknown if file_hash in bloom)
+        self.report("bloom, unknown hash", _timed(bloom.__contains__, unknown))
+        self.report("bloom, issued hash", _timed(bloom.__contains__, known))
+        self.stdout.write(f"measured false-positive rate: {false_positives / lookups:.5f}")
+
+        if options["skip_db"]:
+            return
+
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create(
+                    username="benchmark-verify", email="benchmark-verify@example.invalid"
+                )
+                self.stdout.write(f"Inserting {count} documents...")
+                batch = 10_000
+                for start in range(0, count, batch):
+                    Document.objects.bulk_create([
+                        Document(user=user, file=f"documents/bench-{i}.pdf", file_hash=issued[i],
+                                 serial_number=f"B{i:011d}")
+                        for i in range(start, min(start + batch, count))
+                    ])
+
+                def lookup(file_hash):
+                    return Document.objects.filter(file_hash=file_hash).first()
+
+                def bloom_then_lookup(file_hash):
+                    if file_hash in bloom:
+                        return lookup(file_hash)
+                    return None
+
+                self.report("db index, unknown hash", _timed(lookup, unknown))
+                self.report("db index, issued hash", _timed(lookup, known))
+                self.report("bloom + db, unknown hash", _timed(bloom_then_lookup, unknown))
+                self.report("bloom + db, issued hash", _timed(bloom_then_lookup, known))
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Rolled back synthetic documents.")
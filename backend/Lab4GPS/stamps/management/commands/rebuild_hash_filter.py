@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from stamps.bloom import document_hash_filter
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the verify-document Bloom filter from Document.file_hash and DocumentRevision.file_hash. "
+        "Safe while workers are saving documents: their additions wait for the new filter."
+    )
+
+    def handle(self, *args, **options):
+        bits, hashes = document_hash_filter.parameters()
+        document_hash_filter.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {document_hash_filter.path} ({bits} bits, {hashes} hashes)."
+        ))
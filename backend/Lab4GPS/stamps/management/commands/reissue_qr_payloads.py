@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stamps.models import Document
+from stamps.signing import SigningKeyMissing, signing_key
+from stamps.tasks import render_document_qr
+
+
+class Command(BaseCommand):
+    help = (
+        "Queues a new QR payload for every document, signed with the current "
+        "DOCUMENT_SIGNING_KEY. Run it after setting or rotating the key: payloads "
+        "signed with a key that is no longer accepted stop verifying."
+    )
+
+    def handle(self, *args, **options):
+        try:
+            signing_key()
+        except SigningKeyMissing as e:
+            raise CommandError(str(e))
+        ids = list(Document.objects.exclude(file="").values_list("id", flat=True))
+        render_document_qr.defer_many((document_id,) for document_id in ids)
+        self.stdout.write(self.style.SUCCESS(f"Queued new QR payloads for {len(ids)} document(s)."))
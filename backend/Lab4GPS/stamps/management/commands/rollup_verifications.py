@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from stamps.verify_log import prune_events, rollup_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Rolls verification events up into hourly and daily counts per document, "
+        "then deletes events older than VERIFY_LOG_RETENTION_DAYS. Run it hourly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Recompute every period, not just recent ones.")
+
+    def handle(self, *args, **options):
+        written = rollup_events(full=options["full"])
+        pruned = prune_events()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup row(s); pruned {pruned} old event(s)."))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stamps', '0006_document_file_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='file_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='Stores SHA256 hash of the file for authenticity checks.', max_length=64, null=True),
+        ),
+    ]
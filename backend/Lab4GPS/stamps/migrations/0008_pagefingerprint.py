@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stamps', '0007_alter_document_file_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('text_hash', models.CharField(blank=True, db_index=True, help_text='SHA256 of the normalized page text; empty for pages without text.', max_length=64, null=True)),
+                ('image_hash', models.CharField(db_index=True, help_text='64-bit perceptual (difference) hash of the rendered page, as hex.', max_length=16)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='page_fingerprints', to='stamps.document')),
+            ],
+            options={
+                'ordering': ['document', 'page_number'],
+                'constraints': [models.UniqueConstraint(fields=('document', 'page_number'), name='unique_document_page')],
+            },
+        ),
+    ]
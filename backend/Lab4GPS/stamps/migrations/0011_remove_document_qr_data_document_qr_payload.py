@@ -0,0 +1,22 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stamps', '0010_serialcounter'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='document',
+            name='qr_data',
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='qr_payload',
+            field=models.CharField(blank=True, help_text='Signed text encoded in the QR code; images are rendered on demand.', max_length=128, null=True),
+        ),
+    ]
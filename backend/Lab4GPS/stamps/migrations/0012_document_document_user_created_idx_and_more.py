@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stamps', '0011_remove_document_qr_data_document_qr_payload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='document_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stamp',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='stamp_user_created_idx'),
+        ),
+    ]
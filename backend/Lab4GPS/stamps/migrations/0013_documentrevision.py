@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stamps', '0012_document_document_user_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('file_hash', models.CharField(db_index=True, max_length=64)),
+                ('size', models.BigIntegerField(help_text='File size in bytes at this revision.')),
+                ('incremental', models.BooleanField(default=True, help_text='Appended to the previous revision rather than rewritten (an unrepairable PDF is rewritten).')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='stamps.document')),
+                ('stamp', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revisions', to='stamps.stamp')),
+            ],
+            options={
+                'ordering': ['document', 'number'],
+                'constraints': [models.UniqueConstraint(fields=('document', 'number'), name='unique_document_revision')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stamps', '0013_documentrevision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HashBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('root', models.CharField(max_length=64, unique=True)),
+                ('signature', models.CharField(help_text='HMAC-SHA256 of the root.', max_length=64)),
+                ('leaf_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='anchor_proof',
+            field=models.JSONField(blank=True, help_text="Sibling hashes from file_hash's leaf up to the batch root.", null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='anchor_batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='documents', to='stamps.hashbatch'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stamps', '0014_hashbatch_document_anchor_proof_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VerificationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=10)),
+                ('endpoint', models.CharField(choices=[('document', 'verify-document'), ('batch', 'verify-batch')], default='document', max_length=10)),
+                ('cached', models.BooleanField(default=False)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('user_agent', models.CharField(blank=True, default='', max_length=200)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('document', models.ForeignKey(blank=True, help_text='The document the result named; empty for unknown files.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='verification_events', to='stamps.document')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VerificationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('period_start', models.DateTimeField()),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('valid', models.PositiveIntegerField(default=0)),
+                ('invalid', models.PositiveIntegerField(default=0)),
+                ('sources', models.PositiveIntegerField(default=0, help_text='Distinct client IP addresses.')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='verification_rollups', to='stamps.document')),
+            ],
+            options={
+                'ordering': ['document', 'period', '-period_start'],
+                'constraints': [models.UniqueConstraint(fields=('document', 'period', 'period_start'), name='unique_verification_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stamps', '0015_verificationevent_verificationrollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stampjobitem',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20),
+        ),
+    ]
@@ -1,12 +1,45 @@
 from django.db import models
 from django.conf import settings
-from django.utils.crypto import get_random_string
 from django.utils import timezone
-import qrcode
-import base64
-from io import BytesIO
 import hashlib
 
+from Lab4GPS.uploadhandlers import uploaded_sha256
+from .pipeline import DocumentSavePipeline
+from . import serials
+from .qr_payload import encode_qr_payload
+
+
+class DocumentQuerySet(models.QuerySet):
+    """
+    Bulk writes skip post_save, so they put their hashes into the
+    verify-document Bloom filter themselves (see stamps/bloom.py).
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from .bloom import add_hashes_on_commit  # imports this module
+
+        objs = super().bulk_create(objs, *args, **kwargs)
+        add_hashes_on_commit(obj.file_hash for obj in objs)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from .bloom import add_hashes_on_commit
+
+        objs = list(objs)
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if "file_hash" in fields:
+            add_hashes_on_commit(obj.file_hash for obj in objs)
+        return rows
+
+    def update(self, **kwargs):
+        from .bloom import add_hashes_on_commit
+
+        rows = super().update(**kwargs)
+        # An expression cannot be known here; rebuild_hash_filter covers that case.
+        if rows and isinstance(kwargs.get("file_hash"), str):
+            add_hashes_on_commit([kwargs["file_hash"]])
+        return rows
+
 
 # Stamp Model
 class Stamp(models.Model):
@@ -31,6 +64,12 @@ class Stamp(models.Model):
     bottom_text = models.CharField(max_length=100, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's stamps (Lab4GPS/listing.py).
+            models.Index(fields=["user", "created_at", "id"], name="stamp_user_created_idx"),
+        ]
+
     def __str__(self):
         return f"{self.shape} Stamp - {self.user.username}"
 
@@ -54,11 +93,34 @@ class Document(models.Model):
         unique=True,
         help_text="Unique serial number for each stamped doc."
     )
-    qr_data = models.TextField(
+    qr_payload = models.CharField(
+        max_length=128,
+        blank=True,
+        null=True,
+        help_text="Signed text encoded in the QR code; images are rendered on demand."
+    )
+
+    # Merkle batch attestation of file_hash (stamps/anchoring.py); reset when the hash changes.
+    anchor_batch = models.ForeignKey(
+        "HashBatch",
+        on_delete=models.SET_NULL,
         blank=True,
         null=True,
-        help_text="Stores QR code data as base64 string."
+        related_name="documents"
     )
+    anchor_proof = models.JSONField(
+        blank=True,
+        null=True,
+        help_text="Sibling hashes from file_hash's leaf up to the batch root."
+    )
+
+    objects = DocumentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's documents (Lab4GPS/listing.py).
+            models.Index(fields=["user", "created_at", "id"], name="document_user_created_idx"),
+        ]
 
     def __str__(self):
         return f"Document by {self.user.username}"
@@ -67,57 +129,296 @@ class Document(models.Model):
         max_length=64,
         blank=True,
         null=True,
+        db_index=True,
         help_text="Stores SHA256 hash of the file for authenticity checks."
     )
 
     def __str__(self):
         return f"Document by {self.user.username}"
 
+    # Values as loaded from the database; the save pipeline diffs against them.
+    _loaded_values = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance.snapshot_loaded_values()
+        return instance
+
+    def snapshot_loaded_values(self):
+        """
+        Captures the fields that decide whether hashing or QR rendering is needed
+        (and the hash, so caches keyed by it can be invalidated).
+        Reads __dict__ directly so deferred fields are not fetched.
+        """
+        values = {}
+        for field in ("file", "serial_number", "user_id", "file_hash"):
+            if field in self.__dict__:
+                value = self.__dict__[field]
+                values[field] = getattr(value, "name", value)
+        return values
+
     def save(self, *args, **kwargs):
-        # If there's no serial_number yet, create one
-        if not self.serial_number:
-            self.serial_number = get_random_string(length=8).upper()
-
-        # If the file changed, compute or update the hash
-        super().save(*args, **kwargs)  # Save first so 'file' is accessible
-        if self.file:
-            self.compute_hash()
-            # Also ensure QR is generated
-            self.generate_qr_code()
-            super().save(update_fields=['file_hash', 'qr_data'])
+        """
+        Persists the document through DocumentSavePipeline: the file is hashed
+        and the QR rendered only when needed, and the row is written once.
+        Stage timings (ms) are left on `self.save_timings`.
+        """
+        pipeline = DocumentSavePipeline(self, write=super().save)
+        self.save_timings = pipeline.run(*args, **kwargs)
 
     def compute_hash(self):
         """
-        Reads the file from storage and computes a SHA256 hash, storing it in file_hash.
+        Computes a SHA256 hash of the file, storing it in file_hash.
+        A file that has not been written to storage yet is hashed from the
+        pending upload (or takes the digest computed while it was received),
+        so the bytes are not read back after the write.
         """
+        if not self.file._committed:
+            self.file_hash = uploaded_sha256(self.file.file)
+            return
         sha = hashlib.sha256()
         with self.file.open('rb') as f:
-            for chunk in f:
+            for chunk in f.chunks():
                 sha.update(chunk)
         self.file_hash = sha.hexdigest()
 
 
     def _generate_unique_serial(self):
         """
-        Loops until it finds an 8-char uppercase string not in use.
-        If you want a longer or shorter serial, just change length=.
+        Returns the next serial from the block allocator (stamps/serials.py);
+        serials are unique by construction, so no lookup is needed.
         """
-        while True:
-            candidate = get_random_string(length=8).upper()
-            if not Document.objects.filter(serial_number=candidate).exists():
-                return candidate
+        return serials.allocate_serial()
 
     def generate_qr_code(self):
-        """Generate a QR code with serial_number, user info, etc."""
-        data_to_encode = {
-            "document_id": self.id,
-            "serial_number": self.serial_number,
-            "user": self.user.username
-        }
-        qr = qrcode.QRCode(version=1, box_size=5, border=2)
-        qr.add_data(str(data_to_encode))
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        self.qr_data = base64.b64encode(buffer.getvalue()).decode("utf-8")
\ No newline at end of file
+        """
+        Issues the signed QR payload (id, serial, hash prefix, issue time).
+        The image itself is rendered on request (see stamps/qr_images.py).
+        """
+        self.qr_payload = encode_qr_payload(self)
+        self._qr_identity = (self.id, self.serial_number, self.user_id, self.file_hash)
+
+
+class HashBatch(models.Model):
+    """
+    A Merkle tree over the document hashes anchored in one run of
+    `manage.py anchor_hashes`. Only the root is signed; each Document keeps
+    its own inclusion proof (see stamps/anchoring.py).
+    """
+    root = models.CharField(max_length=64, unique=True)
+    signature = models.CharField(max_length=64, help_text="HMAC-SHA256 of the root.")
+    leaf_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Hash batch {self.pk} ({self.leaf_count} documents)"
+
+
+class DocumentRevision(models.Model):
+    """
+    One stored state of a Document's file. Stamping appends an incremental
+    update to the PDF (see stamps/stamping.py), so each revision is a
+    byte-for-byte prefix of the next one and keeps verifying by its hash.
+    Revision 1 is the file as uploaded; Document.version is "<number>.0"
+    of the latest revision.
+    """
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name="revisions"
+    )
+    number = models.PositiveIntegerField()
+    file_hash = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField(help_text="File size in bytes at this revision.")
+    incremental = models.BooleanField(
+        default=True,
+        help_text="Appended to the previous revision rather than rewritten (an unrepairable PDF is rewritten)."
+    )
+    stamp = models.ForeignKey(
+        Stamp,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="revisions"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["document", "number"]
+        constraints = [
+            models.UniqueConstraint(fields=["document", "number"], name="unique_document_revision"),
+        ]
+
+    def __str__(self):
+        return f"Revision {self.number} of document {self.document_id}"
+
+
+class SerialCounter(models.Model):
+    """
+    Next unreserved counter value for a serial sequence. Workers reserve
+    blocks of values from it (see stamps/serials.py).
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+class PageFingerprint(models.Model):
+    """
+    Fingerprints of one page of a Document's PDF, computed at ingest
+    (see stamps/fingerprints.py). Both hashes are indexed so an unknown
+    upload can be matched to its closest issued document.
+    """
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name="page_fingerprints"
+    )
+    page_number = models.PositiveIntegerField()  # 1-based
+    text_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        db_index=True,
+        help_text="SHA256 of the normalized page text; empty for pages without text."
+    )
+    image_hash = models.CharField(
+        max_length=16,
+        db_index=True,
+        help_text="64-bit perceptual (difference) hash of the rendered page, as hex."
+    )
+
+    class Meta:
+        ordering = ["document", "page_number"]
+        constraints = [
+            models.UniqueConstraint(fields=["document", "page_number"], name="unique_document_page"),
+        ]
+
+    def __str__(self):
+        return f"Page {self.page_number} of document {self.document_id}"
+
+
+class StampJob(models.Model):
+    """
+    One Stamp applied to many Documents in the background (see stamps/jobs.py).
+    Counters are updated as items finish so the job can be polled for progress.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="stamp_jobs"
+    )
+    stamp = models.ForeignKey(Stamp, on_delete=models.CASCADE, related_name="jobs")
+    placements = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total = models.PositiveIntegerField(default=0)
+    succeeded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Stamp job {self.pk} ({self.status}) - {self.user.username}"
+
+    @property
+    def processed(self):
+        return self.succeeded + self.failed
+
+
+class StampJobItem(models.Model):
+    """The outcome of stamping one Document within a StampJob."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),  # claimed; only ever seen inside the claiming transaction
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    job = models.ForeignKey(StampJob, on_delete=models.CASCADE, related_name="items")
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="stamp_job_items")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    error = models.TextField(blank=True, default="")
+    duration_ms = models.FloatField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"Document {self.document_id} in stamp job {self.job_id}: {self.status}"
+
+
+class VerificationEvent(models.Model):
+    """
+    One verify-document / verify-batch result. Append-only; rows are
+    buffered in memory and bulk-inserted off the request path (see
+    stamps/verify_log.py), then summarised into VerificationRollup.
+    """
+    ENDPOINT_CHOICES = [
+        ('document', 'verify-document'),
+        ('batch', 'verify-batch'),
+    ]
+
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="verification_events",
+        help_text="The document the result named; empty for unknown files."
+    )
+    status = models.CharField(max_length=10)  # valid / invalid / modified / error
+    endpoint = models.CharField(max_length=10, choices=ENDPOINT_CHOICES, default='document')
+    cached = models.BooleanField(default=False)
+    ip_address = models.GenericIPAddressField(blank=True, null=True)
+    user_agent = models.CharField(max_length=200, blank=True, default="")
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"Verification ({self.status}) of document {self.document_id} at {self.created_at}"
+
+
+class VerificationRollup(models.Model):
+    """Verification counts of one Document over one hour or day."""
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name="verification_rollups"
+    )
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    period_start = models.DateTimeField()
+    total = models.PositiveIntegerField(default=0)
+    valid = models.PositiveIntegerField(default=0)
+    invalid = models.PositiveIntegerField(default=0)
+    sources = models.PositiveIntegerField(default=0, help_text="Distinct client IP addresses.")
+
+    class Meta:
+        ordering = ["document", "period", "-period_start"]
+        constraints = [
+            models.UniqueConstraint(fields=["document", "period", "period_start"], name="unique_verification_rollup"),
+        ]
+
+    def __str__(self):
+        return f"Verifications of document {self.document_id}, {self.period} from {self.period_start}"
@@ -0,0 +1,156 @@
+# stamps/pdf_scan.py
+"""
+Finds our QR code inside a PDF by rendering its pages.
+
+A stamped PDF that was re-saved, printed to PDF or had its metadata touched
+no longer matches its stored hash, but the QR drawn on it still identifies
+it. Pages are rendered with PyMuPDF and scanned with zbar:
+
+  - pages in the order stamps usually land: first, last, then the rest
+  - on each page the bottom band, then the top band, then the whole page
+  - at a low resolution first, escalating only if nothing was found
+
+Pages are scanned in a process pool (rendering and decoding are CPU bound)
+and the scan stops as soon as a page yields a payload the caller accepts.
+Workers open the PDF from a file path, so large files are not pickled.
+"""
+import multiprocessing
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+
+import fitz  # PyMuPDF
+from django.conf import settings
+from PIL import Image
+from pyzbar.pyzbar import ZBarSymbol, decode as zbar_decode
+
+from .qr import qr_decode_stats
+
+# Fractions of the page height (top, bottom).
+REGIONS = (
+    ("bottom", 0.6, 1.0),
+    ("top", 0.0, 0.4),
+    ("page", 0.0, 1.0),
+)
+
+
+@dataclass
+class PDFScanResult:
+    payload: str = None
+    page: int = None  # 1-based
+    dpi: int = None
+    region: str = None
+    pages_scanned: int = 0
+    elapsed_ms: float = 0.0
+
+    @property
+    def stage(self):
+        return f"pdf/{self.dpi}dpi/{self.region}" if self.payload else None
+
+
+def page_order(page_count):
+    """First page, last page, then the rest front to back."""
+    order = [0]
+    if page_count > 1:
+        order.append(page_count - 1)
+    order.extend(range(1, page_count - 1))
+    return order
+
+
+def _scan_page(path, page_index, dpi):
+    """
+    Worker: renders each region of one page and returns the QR payloads found
+    in the first region that has any, as (region, [payloads]).
+    """
+    with fitz.open(path) as pdf:
+        page = pdf[page_index]
+        rect = page.rect
+        for region, top, bottom in REGIONS:
+            clip = fitz.Rect(rect.x0, rect.y0 + rect.height * top, rect.x1, rect.y0 + rect.height * bottom)
+            pixmap = page.get_pixmap(dpi=dpi, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+            image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+            symbols = zbar_decode(image, symbols=[ZBarSymbol.QRCODE])
+            if symbols:
+                return region, [symbol.data.decode("utf-8", errors="replace") for symbol in symbols]
+    return None, []
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded web worker is unsafe.
+            _pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, "PDF_SCAN_WORKERS", 2),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _scan_path(path, is_valid, deadline):
+    with fitz.open(path) as pdf:
+        page_count = pdf.page_count
+    max_pages = getattr(settings, "PDF_SCAN_MAX_PAGES", 50)
+    pages = page_order(page_count)[:max_pages]
+    pool = _get_pool()
+    result = PDFScanResult()
+
+    for dpi in getattr(settings, "PDF_SCAN_DPI_LEVELS", (72, 150, 300)):
+        pending = {pool.submit(_scan_page, path, index, dpi): index for index in pages}
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    result.pages_scanned += 1
+                    region, payloads = future.result()
+                    for payload in payloads:
+                        if is_valid(payload):
+                            result.payload = payload
+                            result.page = index + 1
+                            result.dpi = dpi
+                            result.region = region
+                            return result
+        finally:
+            # Early exit: drop pages that have not started yet.
+            for future in pending:
+                future.cancel()
+    return result
+
+
+def scan_pdf_for_qr(uploaded_file, is_valid=bool, timeout=None):
+    """
+    Scans an uploaded PDF for a QR payload accepted by `is_valid`.
+    Returns a PDFScanResult (payload None when nothing matched), or None if
+    the deadline passed first.
+    """
+    if timeout is None:
+        timeout = getattr(settings, "PDF_SCAN_TIMEOUT", 4.0)
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+
+    if hasattr(uploaded_file, "temporary_file_path"):
+        result = _scan_path(uploaded_file.temporary_file_path(), is_valid, deadline)
+    else:
+        # In-memory upload: give the workers a file they can open.
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            for chunk in uploaded_file.chunks():
+                tmp.write(chunk)
+            tmp.flush()
+            result = _scan_path(tmp.name, is_valid, deadline)
+
+    if result is None:
+        qr_decode_stats.record(timed_out=True)
+        return None
+    result.elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+    qr_decode_stats.record(result)
+    return result
@@ -0,0 +1,204 @@
+# stamps/pipeline.py
+"""
+Explicit persistence pipeline for Document.
+
+Document.save() used to write the row, reopen the stored file to hash it,
+render the QR code and write the row a second time. The pipeline runs the
+same steps once, in order, and skips whatever the change does not require:
+
+  serial  -> assign a serial number from the block allocator if the document has none
+  detect  -> work out whether the file or the QR identity changed
+  hash    -> hash the pending file before it is written to storage
+  qr      -> issue the QR payload when the identity or file it encodes changed
+  pages   -> fingerprint each PDF page from the pending file
+  write   -> INSERT/UPDATE the row once
+  index   -> replace the document's PageFingerprint rows
+  revision-> record the stamping revision apply_stamp appended (stamps/stamping.py)
+  tiles   -> queue pre-rendering of the page tile pyramid (always a task)
+
+A brand-new document has no id until its INSERT, so its QR payload is issued
+right after the write and stored with a single-column UPDATE.
+
+Stages listed in DOCUMENT_DEFERRED_STAGES ("qr", "pages") are not run inline:
+they are queued as tasks (stamps/tasks.py) in the save's transaction and a
+worker fills qr_payload / the page index shortly afterwards.
+
+Each stage's wall time (ms) is kept in `timings` and exposed on the document
+as `save_timings`, so views can report it (see DocumentViewSet).
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import fingerprints, serials
+from .signing import SigningKeyMissing
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentSavePipeline:
+    """Runs the save stages for one Document instance."""
+
+    def __init__(self, document, write):
+        self.document = document
+        self.write = write  # Model.save bound to the document
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round((time.perf_counter() - start) * 1000, 3)
+
+    def file_changed(self):
+        document = self.document
+        if not document.file:
+            return False
+        if document._state.adding or not document.file._committed:
+            return True
+        return document.file.name != document._loaded_values.get("file")
+
+    def qr_identity_changed(self):
+        """
+        The QR is issued for the id, serial and owner; re-issue it only when one
+        of those moves. (A new file re-issues it too: see run().)
+        """
+        document = self.document
+        rendered = getattr(document, "_qr_identity", None)
+        if rendered is not None:
+            return rendered != (document.pk, document.serial_number, document.user_id, document.file_hash)
+        if not document.qr_payload or document._state.adding:
+            return True
+        loaded = document._loaded_values
+        return (
+            document.serial_number != loaded.get("serial_number")
+            or document.user_id != loaded.get("user_id")
+        )
+
+    def issue_qr(self):
+        """Issues the QR payload; without a signing key the document is saved without one."""
+        try:
+            self.document.generate_qr_code()
+        except SigningKeyMissing as e:
+            logger.warning("Document %s saved without a QR payload: %s", self.document.pk, e)
+            self.document.qr_payload = None
+
+    def fingerprint_pages(self):
+        """Per-page fingerprints of the file about to be written ([] if not a PDF)."""
+        file = self.document.file
+        if not file._committed:
+            return fingerprints.fingerprint_upload(file.file)
+        with file.open("rb") as f:
+            return fingerprints.fingerprint_pdf(data=f.read())
+
+    def record_revision(self, revision):
+        """Stores the DocumentRevision for the file just written (and revision 1 if it was never recorded)."""
+        from .models import DocumentRevision  # imports this module
+
+        document = self.document
+        rows = []
+        if revision["base"] is not None:
+            base_hash, base_size = revision["base"]
+            rows.append(DocumentRevision(document=document, number=revision["number"] - 1,
+                                         file_hash=base_hash, size=base_size))
+        rows.append(DocumentRevision(
+            document=document, number=revision["number"], file_hash=document.file_hash,
+            size=document.file.size, incremental=revision["incremental"], stamp=revision["stamp"],
+        ))
+        DocumentRevision.objects.bulk_create(rows)
+
+    def defer(self, qr, pages, tiles=False):
+        from .tasks import index_document_pages, render_document_qr, render_document_tiles  # imports models
+
+        if qr:
+            render_document_qr.defer(self.document.pk)
+        if pages:
+            index_document_pages.defer(self.document.pk)
+        if tiles:
+            render_document_tiles.defer(self.document.pk)
+
+    def run(self, *args, **kwargs):
+        document = self.document
+        update_fields = kwargs.get("update_fields")
+        updating = set(update_fields) if update_fields is not None else None
+
+        with self.stage("serial"):
+            if not document.serial_number:
+                document.serial_number = serials.allocate_serial()
+                if updating is not None:
+                    updating.add("serial_number")
+
+        with self.stage("detect"):
+            hash_needed = (updating is None or "file" in updating) and self.file_changed()
+            # The payload carries the file's hash prefix, so a new file gets a new payload.
+            qr_needed = bool(document.file) and (hash_needed or self.qr_identity_changed())
+
+        if hash_needed:
+            with self.stage("hash"):
+                document.compute_hash()
+                # A proof anchors the old hash; the next anchoring run covers the new one.
+                document.anchor_batch = None
+                document.anchor_proof = None
+                if updating is not None:
+                    updating.update(("file_hash", "anchor_batch", "anchor_proof"))
+
+        deferred = set(getattr(settings, "DOCUMENT_DEFERRED_STAGES", ()))
+        defer_qr = qr_needed and "qr" in deferred
+        defer_pages = hash_needed and "pages" in deferred
+        qr_needed = qr_needed and not defer_qr
+        pages_needed = hash_needed and not defer_pages
+        queue_tiles = hash_needed and getattr(settings, "DOCUMENT_TILE_PRERENDER", True)
+
+        qr_before_write = qr_needed and not document._state.adding
+        if qr_before_write:
+            with self.stage("qr"):
+                self.issue_qr()
+                if updating is not None:
+                    updating.add("qr_payload")
+
+        if pages_needed:
+            with self.stage("pages"):
+                page_fingerprints = self.fingerprint_pages()
+
+        if updating is None and not hash_needed and not document._state.adding and not kwargs.get("force_insert"):
+            # The anchor fields may have been set by an anchoring run since this instance was
+            # loaded; only the hash stage above may clear them, so a full save leaves them out.
+            updating = {
+                field.name for field in document._meta.concrete_fields if not field.primary_key
+            } - {"anchor_batch", "anchor_proof"}
+        if updating is not None:
+            kwargs["update_fields"] = updating
+        with self.stage("write"):
+            self.write(*args, **kwargs)
+
+        if pages_needed:
+            with self.stage("index"):
+                fingerprints.replace_fingerprints(document, page_fingerprints)
+
+        revision = getattr(document, "_pending_revision", None)
+        if revision is not None and hash_needed:
+            with self.stage("revision"):
+                self.record_revision(revision)
+            document._pending_revision = None
+
+        if qr_needed and not qr_before_write:
+            with self.stage("qr"):
+                self.issue_qr()
+                type(document).objects.filter(pk=document.pk).update(qr_payload=document.qr_payload)
+
+        if defer_qr or defer_pages or queue_tiles:
+            with self.stage("defer"):
+                self.defer(qr=defer_qr, pages=defer_pages, tiles=queue_tiles)
+
+        document._loaded_values = document.snapshot_loaded_values()
+        logger.debug("Saved document %s: %s", document.pk, self.timings)
+        return self.timings
+
+
+def server_timing_header(timings):
+    """Formats stage timings as an HTTP Server-Timing header value."""
+    return ", ".join(f"{name};dur={duration}" for name, duration in timings.items())
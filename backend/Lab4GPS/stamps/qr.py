@@ -0,0 +1,202 @@
+# stamps/qr.py
+"""
+QR decoding for document verification.
+
+Phone photos are large, and the QR is often small, off-centre or tilted, so
+decoding runs as a sequence of increasingly expensive attempts and stops at
+the first payload the caller accepts:
+
+  1. grayscale, downscaled whole image at each pyramid level (smallest first)
+  2. overlapping regions of interest, cut from the next level up
+  3. a few rotations, for codes tilted away from the axes
+
+JPEGs are decoded at reduced size with Pillow's draft mode, so the small
+levels never pay for a full-resolution decode. zbar already handles 90 degree
+rotations; the extra rotations cover skew.
+
+Work runs on a bounded, process-wide thread pool with a per-request
+deadline. `qr_decode_stats` counts which stage found the code (or that none
+did) so the stage order and limits can be tuned.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image
+from pyzbar.pyzbar import ZBarSymbol, decode as zbar_decode
+
+from .qr_payload import parse_qr_payload  # noqa: F401 (moved; kept importable from here)
+
+PYRAMID_LEVELS = (800, 1600, None)  # longest side in pixels; None = full resolution
+ROTATIONS = (45, -30, 30)
+# (left, top, right, bottom) as fractions of the image; overlapping so a code
+# on a boundary is whole in at least one region.
+REGIONS = {
+    "bottom-right": (0.4, 0.4, 1.0, 1.0),
+    "bottom-left": (0.0, 0.4, 0.6, 1.0),
+    "top-right": (0.4, 0.0, 1.0, 0.6),
+    "top-left": (0.0, 0.0, 0.6, 0.6),
+    "center": (0.2, 0.2, 0.8, 0.8),
+}
+
+
+class QRDecodeTimeout(Exception):
+    """The decode did not finish (or could not start) before its deadline."""
+
+
+@dataclass
+class QRDecodeResult:
+    payload: str = None
+    stage: str = None
+    attempts: int = 0
+    elapsed_ms: float = 0.0
+
+
+class QRDecodeStats:
+    """Thread-safe counters of which stage succeeded."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.by_stage = {}
+            self.misses = 0
+            self.timeouts = 0
+            self.total_ms = 0.0
+            self.requests = 0
+
+    def record(self, result=None, timed_out=False):
+        with self._lock:
+            self.requests += 1
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.total_ms += result.elapsed_ms
+            if result.stage:
+                self.by_stage[result.stage] = self.by_stage.get(result.stage, 0) + 1
+            else:
+                self.misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            completed = self.requests - self.timeouts
+            return {
+                "requests": self.requests,
+                "by_stage": dict(sorted(self.by_stage.items(), key=lambda item: -item[1])),
+                "misses": self.misses,
+                "timeouts": self.timeouts,
+                "mean_ms": round(self.total_ms / completed, 3) if completed else None,
+            }
+
+
+qr_decode_stats = QRDecodeStats()
+
+
+def _load(image_bytes, max_side):
+    """Opens the image as grayscale, using JPEG draft mode to skip full-size decoding."""
+    image = Image.open(BytesIO(image_bytes))
+    if max_side:
+        image.draft("L", (max_side, max_side))
+    image = image.convert("L")
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side))
+    return image
+
+
+def _scaled(image, max_side):
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side))
+    return image
+
+
+def _attempts(image_bytes):
+    """Yields (stage name, grayscale image) from cheapest to most expensive."""
+    loaded = {}
+
+    def load(max_side):
+        if max_side not in loaded:
+            loaded[max_side] = _load(image_bytes, max_side)
+        return loaded[max_side]
+
+    previous_size = None
+    for index, max_side in enumerate(PYRAMID_LEVELS):
+        image = load(max_side)
+        if image.size == previous_size:
+            continue  # the source is smaller than this level; nothing new to try
+        previous_size = image.size
+        level = f"{max_side}px" if max_side else "full"
+        yield f"{level}/whole", image
+
+        # Regions are cut from the next level up, so each crop is about this
+        # level's size but a small code covers more pixels.
+        detail = load(PYRAMID_LEVELS[index + 1]) if index + 1 < len(PYRAMID_LEVELS) else image
+        width, height = detail.size
+        for name, (left, top, right, bottom) in REGIONS.items():
+            crop = detail.crop((int(left * width), int(top * height), int(right * width), int(bottom * height)))
+            yield f"{level}/roi-{name}", _scaled(crop, max_side)
+
+        for angle in ROTATIONS:
+            yield f"{level}/rotate-{angle}", image.rotate(angle, expand=True, fillcolor=255)
+
+
+def _decode(image_bytes, is_valid, cancelled):
+    result = QRDecodeResult()
+    start = time.perf_counter()
+    for stage, image in _attempts(image_bytes):
+        if cancelled.is_set():
+            break
+        result.attempts += 1
+        for symbol in zbar_decode(image, symbols=[ZBarSymbol.QRCODE]):
+            payload = symbol.data.decode("utf-8", errors="replace")
+            if is_valid(payload):
+                result.payload = payload
+                result.stage = stage
+                result.elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+                return result
+    result.elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+    return result
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "QR_DECODE_WORKERS", 4),
+    thread_name_prefix="qr-decode",
+)
+# Caps queued + running decodes so a burst of uploads cannot pile up unbounded work.
+_slots = threading.BoundedSemaphore(getattr(settings, "QR_DECODE_MAX_PENDING", 16))
+
+
+def decode_qr(image_bytes, is_valid=bool, timeout=None):
+    """
+    Decodes the first QR code in `image_bytes` for which `is_valid(payload)`
+    is true. Returns a QRDecodeResult (payload is None when nothing matched)
+    or raises QRDecodeTimeout once `timeout` seconds have passed.
+    """
+    if timeout is None:
+        timeout = getattr(settings, "QR_DECODE_TIMEOUT", 5.0)
+    deadline = time.monotonic() + timeout
+    if not _slots.acquire(timeout=timeout):
+        qr_decode_stats.record(timed_out=True)
+        raise QRDecodeTimeout("QR decoder is busy.")
+
+    cancelled = threading.Event()
+    try:
+        future = _executor.submit(_decode, image_bytes, is_valid, cancelled)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+
+    try:
+        result = future.result(timeout=max(0, deadline - time.monotonic()))
+    except FutureTimeoutError:
+        cancelled.set()  # the worker stops at its next stage boundary
+        qr_decode_stats.record(timed_out=True)
+        raise QRDecodeTimeout("QR decoding took too long.")
+    qr_decode_stats.record(result)
+    return result
@@ -0,0 +1,69 @@
+# stamps/qr_images.py
+"""
+QR code images, rendered on demand from a document's stored payload.
+
+Documents keep only the short signed payload (Document.qr_payload); the PNG
+or SVG is drawn when /stamps/documents/<id>/qr.png|.svg is first requested
+and then kept in the QR_IMAGE_CACHE_ALIAS cache. Entries are keyed by a
+digest of the payload, so a document whose serial or owner changes gets a
+new payload, a new key and a new ETag; stale images simply age out.
+"""
+import hashlib
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+from django.conf import settings
+from django.core.cache import caches
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+# Bump when the drawing parameters change so cached images are not served.
+RENDER_VERSION = 1
+
+
+def image_etag(payload, fmt):
+    """Strong validator for the image of `payload` in `fmt`."""
+    digest = hashlib.sha256(f"{RENDER_VERSION}:{fmt}:{payload}".encode("utf-8")).hexdigest()
+    return digest[:32]
+
+
+def _render(payload, fmt):
+    qr = qrcode.QRCode(version=1, box_size=5, border=2)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    buffer = BytesIO()
+    if fmt == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_qr_image(payload, fmt="png"):
+    """The QR image bytes for `payload`, rendered at most once per cache lifetime."""
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported QR image format: {fmt}")
+    cache = caches[getattr(settings, "QR_IMAGE_CACHE_ALIAS", "default")]
+    key = f"qr-image:{image_etag(payload, fmt)}"
+    data = cache.get(key)
+    if data is None:
+        data = _render(payload, fmt)
+        cache.set(key, data, getattr(settings, "QR_IMAGE_CACHE_TIMEOUT", 24 * 3600))
+    return data
+
+
+def qr_image_url(document, fmt="png", request=None):
+    """
+    URL of the document's QR image. It carries the image's ETag as `v`, so the
+    URL changes whenever the image does and can be cached indefinitely.
+    """
+    from django.urls import reverse
+
+    url = reverse("document-qr-image", kwargs={"pk": document.pk, "fmt": fmt})
+    if document.qr_payload:
+        url = f"{url}?v={image_etag(document.qr_payload, fmt)}"
+    return request.build_absolute_uri(url) if request is not None else url
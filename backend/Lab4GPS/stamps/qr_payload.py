@@ -0,0 +1,142 @@
+# stamps/qr_payload.py
+"""
+What a document's QR code says, and how to check it.
+
+Current QRs carry a compact, HMAC-signed payload:
+
+    CSV1.<id>.<serial>.<hash prefix>.<issued>.<signature>
+
+  id           document id, base 36
+  serial       the document's serial number
+  hash prefix  first 16 hex digits of file_hash when the QR was issued
+  issued       Unix time the QR was issued, base 36
+  signature    HMAC-SHA256 of everything before it, truncated to 128 bits,
+               base32 without padding
+
+Everything is upper case, digits, '.' or '-', so the QR is encoded in
+alphanumeric mode and stays small. The signature is keyed with
+DOCUMENT_SIGNING_KEY (see stamps/signing.py; its fallbacks are accepted too,
+so keys can be rotated), which means authenticity is checked in CPU alone.
+The database is needed only to see whether the document has since been
+revoked, and whether the hash prefix still names its file (or one of its
+earlier revisions): the payload is re-issued whenever the file changes.
+
+Documents issued before this format carry the Python repr of a dict with
+document_id, serial_number and user. They are still read (unsigned).
+"""
+import ast
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .signing import signing_key, verification_keys
+
+PREFIX = "CSV1."
+KEY_SALT = "stamps.qr-payload"
+HASH_PREFIX_LENGTH = 16
+SIGNATURE_BYTES = 16
+
+
+class QRSignatureError(Exception):
+    """The payload claims to be ours but its signature does not match."""
+
+
+@dataclass
+class QRPayload:
+    document_id: int
+    serial_number: str
+    signed: bool
+    hash_prefix: str = ""
+    issued_at: datetime = None
+    user: str = None  # legacy payloads only
+
+
+def parse_qr_payload(text):
+    """
+    Returns a legacy QR payload as a dict, or None if it is not one of ours.
+    Accepts JSON and the Python-repr form older documents were issued with.
+    """
+    for parser in (json.loads, ast.literal_eval):
+        try:
+            data = parser(text)
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def looks_like_qr_payload(text):
+    """Cheap check used while scanning: is this QR one of ours (either format)?"""
+    return text.startswith(PREFIX) or parse_qr_payload(text) is not None
+
+
+def _to_base36(number):
+    digits = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    encoded = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        encoded = digits[remainder] + encoded
+        if not number:
+            return encoded
+
+
+def _signature(message, secret):
+    digest = salted_hmac(KEY_SALT, message, secret=secret, algorithm="sha256").digest()
+    return base64.b32encode(digest[:SIGNATURE_BYTES]).decode().rstrip("=")
+
+
+def encode_qr_payload(document, issued_at=None):
+    """
+    The signed payload for `document`'s current id, serial and file hash.
+    Raises SigningKeyMissing when no signing key is configured.
+    """
+    issued_at = issued_at or datetime.now(dt_timezone.utc)
+    message = ".".join([
+        PREFIX.rstrip("."),
+        _to_base36(document.pk),
+        document.serial_number.upper(),
+        (document.file_hash or "")[:HASH_PREFIX_LENGTH].upper(),
+        _to_base36(int(issued_at.timestamp())),
+    ])
+    return f"{message}.{_signature(message, signing_key())}"
+
+
+def _verify_signed(text):
+    message, _, signature = text.rpartition(".")
+    if not any(constant_time_compare(signature, _signature(message, key)) for key in verification_keys()):
+        raise QRSignatureError("QR signature does not match.")
+    try:
+        _, document_id, serial_number, hash_prefix, issued = message.split(".")
+        return QRPayload(
+            document_id=int(document_id, 36),
+            serial_number=serial_number,
+            signed=True,
+            hash_prefix=hash_prefix.lower(),
+            issued_at=datetime.fromtimestamp(int(issued, 36), dt_timezone.utc),
+        )
+    except ValueError:
+        # Correctly signed but unreadable: only possible if we issued a bad payload.
+        raise QRSignatureError("QR payload is malformed.")
+
+
+def decode_qr_payload(text):
+    """
+    Reads a QR payload of either format. Returns a QRPayload, None if the
+    text is not one of ours, or raises QRSignatureError for a signed payload
+    that fails verification.
+    """
+    if text.startswith(PREFIX):
+        return _verify_signed(text)
+    data = parse_qr_payload(text)
+    if data is None:
+        return None
+    return QRPayload(
+        document_id=data.get("document_id"),
+        serial_number=data.get("serial_number"),
+        signed=False,
+        user=data.get("user"),
+    )
@@ -0,0 +1,193 @@
+# stamps/render_cache.py
+"""
+Content-addressed cache of rendered stamps.
+
+A Stamp's appearance is fully described by a handful of fields, so renders are
+keyed by a digest of those fields rather than by the row id. Two tiers:
+
+  1. an in-process LRU of recently used renders
+  2. files under MEDIA_ROOT/stamp_renders/<digest>/<size>.<format>
+
+The PDF format is the single-page vector form that stamping embeds as an
+XObject; PNG and SVG are derived from it.
+
+A sprite sheet packs the PNG renders of many stamps (a user's library) into
+one image, with an atlas of where each stamp is. Sheets are keyed by the
+digests of the stamps in them and kept in memory only: they are cheap to
+rebuild from the cached renders.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import fitz  # PyMuPDF
+from django.conf import settings
+from PIL import Image
+
+from . import stamping
+
+# Bump when the drawing code changes so stale renders are not served.
+RENDER_VERSION = 1
+
+APPEARANCE_FIELDS = (
+    "shape", "shape_color", "text_color", "date_color", "date", "top_text", "bottom_text",
+)
+
+FORMATS = ("pdf", "png", "svg")
+
+SPRITE_MAX_WIDTH = 2048  # pixels; stamps wrap onto a new row beyond this
+SPRITE_PADDING = 2
+
+
+def appearance_digest(stamp):
+    """SHA-256 over the fields that determine what a stamp looks like."""
+    appearance = {field: str(getattr(stamp, field) or "") for field in APPEARANCE_FIELDS}
+    appearance["version"] = RENDER_VERSION
+    encoded = json.dumps(appearance, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def sprite_digest(stamps, size):
+    """Changes whenever a stamp is added, removed, reordered or restyled."""
+    parts = ",".join(f"{stamp.pk}:{appearance_digest(stamp)}" for stamp in stamps)
+    return hashlib.sha256(f"{RENDER_VERSION}:{size}:{parts}".encode("utf-8")).hexdigest()
+
+
+def _render(stamp, fmt, size):
+    pdf_bytes = stamping.render_stamp_pdf(stamp, size)
+    if fmt == "pdf":
+        return pdf_bytes
+
+    pdf = fitz.open("pdf", pdf_bytes)
+    try:
+        page = pdf[0]
+        if fmt == "svg":
+            return page.get_svg_image(text_as_path=True).encode("utf-8")
+        # PNG is `size` pixels high regardless of the page's point size.
+        zoom = size / page.rect.height
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=True)
+        return pixmap.tobytes("png")
+    finally:
+        pdf.close()
+
+
+class RenderedStampCache:
+    """Two-tier (memory LRU + disk) cache of stamp renders."""
+
+    def __init__(self, max_entries=256, directory=None):
+        self.max_entries = max_entries
+        self._directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def directory(self):
+        # Resolved lazily so MEDIA_ROOT overrides (tests, deployments) are honoured.
+        return self._directory or getattr(
+            settings, "STAMP_RENDER_CACHE_DIR", os.path.join(settings.MEDIA_ROOT, "stamp_renders")
+        )
+
+    def _path(self, digest, fmt, size):
+        return os.path.join(self.directory, digest, f"{size}.{fmt}")
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, stamp, fmt="pdf", size=None):
+        """Returns the rendered bytes for `stamp`, rendering at most once per appearance."""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported stamp render format: {fmt}")
+        size = int(round(size or stamping.STAMP_SIZE))
+        digest = appearance_digest(stamp)
+        key = (digest, fmt, size)
+
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+
+        path = self._path(digest, fmt, size)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            self.disk_hits += 1
+        except FileNotFoundError:
+            data = _render(stamp, fmt, size)
+            self.misses += 1
+            self._write(path, data)
+
+        self._remember(key, data)
+        return data
+
+    def sprite(self, stamps, size=None):
+        """
+        Returns (png bytes, atlas) with every stamp in `stamps` packed in rows.
+        The atlas maps each stamp id to its {x, y, w, h} in the sheet.
+        """
+        size = int(round(size or stamping.STAMP_SIZE))
+        digest = sprite_digest(stamps, size)
+        key = ("sprite", digest, size)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        renders = [(stamp.pk, Image.open(BytesIO(self.get(stamp, "png", size)))) for stamp in stamps]
+        frames, x, y, row_height, width = {}, 0, 0, 0, 1
+        for stamp_id, image in renders:
+            if x and x + image.width > SPRITE_MAX_WIDTH:
+                x, y, row_height = 0, y + row_height + SPRITE_PADDING, 0
+            frames[str(stamp_id)] = {"x": x, "y": y, "w": image.width, "h": image.height}
+            x += image.width + SPRITE_PADDING
+            row_height = max(row_height, image.height)
+            width = max(width, x - SPRITE_PADDING)
+        sheet = Image.new("RGBA", (width, max(y + row_height, 1)), (0, 0, 0, 0))
+        for stamp_id, image in renders:
+            frame = frames[str(stamp_id)]
+            sheet.paste(image, (frame["x"], frame["y"]))
+        buffer = BytesIO()
+        sheet.save(buffer, format="PNG", optimize=True)
+
+        atlas = {"size": size, "width": sheet.width, "height": sheet.height, "frames": frames}
+        result = (buffer.getvalue(), atlas)
+        self._remember(key, result)
+        return result
+
+    def _write(self, path, data):
+        # Write to a temp file and rename so readers never see a partial render.
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, stamp):
+        """Drops every cached render of `stamp`'s current appearance."""
+        digest = appearance_digest(stamp)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == digest]:
+                del self._entries[key]
+        shutil.rmtree(os.path.join(self.directory, digest), ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+stamp_render_cache = RenderedStampCache(max_entries=getattr(settings, "STAMP_RENDER_CACHE_SIZE", 256))
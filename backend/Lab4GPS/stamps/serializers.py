@@ -1,12 +1,111 @@
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Stamp, Document
+from Lab4GPS.listing import ProjectableSerializerMixin
+from .models import Stamp, Document, DocumentRevision, StampJob, StampJobItem
+from .qr_images import qr_image_url
+from .render_cache import APPEARANCE_FIELDS, appearance_digest
+
+class StampSerializer(ProjectableSerializerMixin, serializers.ModelSerializer):
+    # Server-rendered preview, versioned by the stamp's appearance digest.
+    preview_url = serializers.SerializerMethodField()
 
-class StampSerializer(serializers.ModelSerializer):
     class Meta:
         model = Stamp
         exclude = ['user']  
+        projection_sources = {'preview_url': APPEARANCE_FIELDS}
+
+    def get_preview_url(self, stamp):
+        url = reverse('stamp-preview', kwargs={'pk': stamp.pk, 'fmt': 'png'})
+        url = f"{url}?v={appearance_digest(stamp)[:16]}"
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+class DocumentSerializer(ProjectableSerializerMixin, serializers.ModelSerializer):
+    # The QR image is served by /stamps/documents/<id>/qr.png, not inlined.
+    qr_url = serializers.SerializerMethodField()
 
-class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
-        exclude = ['user']  
+        exclude = ['user', 'qr_payload', 'anchor_batch', 'anchor_proof']
+        projection_sources = {'qr_url': ('file', 'qr_payload')}
+
+    def get_qr_url(self, document):
+        if not document.file:
+            return None
+        return qr_image_url(document, request=self.context.get('request'))
+
+class DocumentRevisionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DocumentRevision
+        exclude = ['document']
+
+class StampPlacementSerializer(serializers.Serializer):
+    """
+    Where to put a stamp: 1-based page number and top-left corner in PDF points.
+    `size` is the stamp height in points (defaults to the canvas stamp size).
+    """
+    page = serializers.IntegerField(min_value=1)
+    x = serializers.FloatField(min_value=0)
+    y = serializers.FloatField(min_value=0)
+    size = serializers.FloatField(min_value=10, max_value=1000, required=False)
+
+class ApplyStampSerializer(serializers.Serializer):
+    """
+    Payload for server-side stamping: a Stamp owned by the user plus placements.
+    """
+    stamp = serializers.PrimaryKeyRelatedField(queryset=Stamp.objects.none())
+    placements = StampPlacementSerializer(many=True, allow_empty=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None:
+            self.fields['stamp'].queryset = Stamp.objects.filter(user=request.user)
+
+class CreateStampJobSerializer(serializers.Serializer):
+    """
+    Payload for a bulk stamping job: one of the user's Stamps, the user's
+    Documents to stamp and the placements applied to each of them.
+    """
+    stamp = serializers.PrimaryKeyRelatedField(queryset=Stamp.objects.none())
+    documents = serializers.PrimaryKeyRelatedField(queryset=Document.objects.none(), many=True, allow_empty=False)
+    placements = StampPlacementSerializer(many=True, allow_empty=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None:
+            self.fields['stamp'].queryset = Stamp.objects.filter(user=request.user)
+            self.fields['documents'].child_relation.queryset = Document.objects.filter(user=request.user)
+
+    def validate_documents(self, documents):
+        limit = getattr(settings, 'STAMP_JOB_MAX_DOCUMENTS', 1000)
+        if len(documents) > limit:
+            raise serializers.ValidationError(f"A job can stamp at most {limit} documents.")
+        return list({document.pk: document for document in documents}.values())
+
+class StampJobItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StampJobItem
+        exclude = ['job']
+
+class StampJobSerializer(serializers.ModelSerializer):
+    """A job's state plus derived progress (0..1) and throughput (documents/second)."""
+    processed = serializers.IntegerField(read_only=True)
+    progress = serializers.SerializerMethodField()
+    throughput = serializers.SerializerMethodField()
+
+    class Meta:
+        model = StampJob
+        exclude = ['user']
+
+    def get_progress(self, job):
+        return round(job.processed / job.total, 4) if job.total else 1.0
+
+    def get_throughput(self, job):
+        if not job.started_at or not job.processed:
+            return None
+        elapsed = ((job.finished_at or timezone.now()) - job.started_at).total_seconds()
+        return round(job.processed / elapsed, 3) if elapsed > 0 else None
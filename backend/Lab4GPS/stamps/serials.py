@@ -0,0 +1,237 @@
+# stamps/serials.py
+"""
+Collision-free document serial numbers.
+
+Serials come from a database counter (SerialCounter) that each thread
+reserves in blocks of SERIAL_BLOCK_SIZE with one UPDATE, then hands out from
+memory, so issuing a serial needs no uniqueness query at all. Each counter
+value is encoded as:
+
+  - a keyed permutation of the 35-bit value (a small Feistel network), so
+    consecutive documents don't get guessable, consecutive serials
+  - 7 Crockford base32 symbols (no I, L, O or U), plus
+  - 1 check symbol (a weighted sum in GF(32)) that catches any single
+    mistyped symbol and any swap of two different payload symbols
+
+shown as XXXX-XXXX. A typo is rejected by is_valid_serial() before any
+database lookup. Serials issued before this scheme are 8 characters with no
+hyphen; they are still accepted as-is (see is_legacy_serial).
+
+SERIAL_PERMUTATION_KEY must never change once serials have been issued:
+the same counter value would then encode differently and could collide.
+"""
+import hashlib
+import re
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from . import models  # module reference: models imports this module via pipeline
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"  # Crockford base32
+DECODE = {symbol: value for value, symbol in enumerate(ALPHABET)}
+DECODE.update({"O": 0, "I": 1, "L": 1})  # common misreadings
+PAYLOAD_SYMBOLS = 7
+PAYLOAD_BITS = 5 * PAYLOAD_SYMBOLS  # 35 bits: ~34 billion serials
+GF32_POLYNOMIAL = 0b100101  # x^5 + x^2 + 1, primitive
+FEISTEL_HALF_BITS = 18  # the network permutes 36 bits; values >= 2**35 are cycle-walked
+FEISTEL_ROUNDS = 4
+
+LEGACY_SERIAL = re.compile(r"[A-Z0-9]{8}")
+
+
+class SerialError(Exception):
+    """The serial space is exhausted or a value is out of range."""
+
+
+# ---------------- encoding ----------------
+
+def _round_function(key, round_number, half):
+    digest = hashlib.blake2b(
+        f"{round_number}:{half}".encode(), key=key, digest_size=4
+    ).digest()
+    return int.from_bytes(digest, "big") & ((1 << FEISTEL_HALF_BITS) - 1)
+
+
+def _feistel(value, key):
+    mask = (1 << FEISTEL_HALF_BITS) - 1
+    left, right = value >> FEISTEL_HALF_BITS, value & mask
+    for round_number in range(FEISTEL_ROUNDS):
+        left, right = right, left ^ _round_function(key, round_number, right)
+    return (left << FEISTEL_HALF_BITS) | right
+
+
+def _unfeistel(value, key):
+    mask = (1 << FEISTEL_HALF_BITS) - 1
+    left, right = value >> FEISTEL_HALF_BITS, value & mask
+    for round_number in reversed(range(FEISTEL_ROUNDS)):
+        left, right = right ^ _round_function(key, round_number, left), left
+    return (left << FEISTEL_HALF_BITS) | right
+
+
+def _permutation_key():
+    key = getattr(settings, "SERIAL_PERMUTATION_KEY", "cs&v-document-serials")
+    return hashlib.blake2b(key.encode(), digest_size=32).digest()
+
+
+def permute(value):
+    """Bijection on [0, 2**35): the Feistel network, cycle-walked back into range."""
+    if not 0 <= value < 1 << PAYLOAD_BITS:
+        raise SerialError(f"Serial counter value {value} is out of range.")
+    key = _permutation_key()
+    value = _feistel(value, key)
+    while value >= 1 << PAYLOAD_BITS:
+        value = _feistel(value, key)
+    return value
+
+
+def unpermute(value):
+    key = _permutation_key()
+    value = _unfeistel(value, key)
+    while value >= 1 << PAYLOAD_BITS:
+        value = _unfeistel(value, key)
+    return value
+
+
+def _gf32_multiply(a, b):
+    product = 0
+    while b:
+        if b & 1:
+            product ^= a
+        b >>= 1
+        a <<= 1
+        if a & 32:
+            a ^= GF32_POLYNOMIAL
+    return product
+
+
+# Distinct non-zero weights x^1..x^7: a changed symbol or two swapped symbols
+# always change the sum, since GF(32) has no zero divisors.
+CHECK_WEIGHTS = []
+_weight = 1
+for _ in range(PAYLOAD_SYMBOLS):
+    _weight = _gf32_multiply(_weight, 2)
+    CHECK_WEIGHTS.append(_weight)
+
+
+def check_symbol(values):
+    total = 0
+    for value, weight in zip(values, CHECK_WEIGHTS):
+        total ^= _gf32_multiply(value, weight)
+    return ALPHABET[total]
+
+
+def encode_serial(counter_value):
+    """Counter value -> 'XXXX-XXXX'."""
+    value = permute(counter_value)
+    values = [(value >> (5 * shift)) & 31 for shift in reversed(range(PAYLOAD_SYMBOLS))]
+    symbols = "".join(ALPHABET[v] for v in values) + check_symbol(values)
+    return f"{symbols[:4]}-{symbols[4:]}"
+
+
+def normalize_serial(text):
+    """
+    Canonical 'XXXX-XXXX' form of a serial typed or scanned in any case, with
+    or without the hyphen, or None if it is not a well-formed serial.
+    """
+    symbols = re.sub(r"[\s-]", "", str(text or "")).upper()
+    if len(symbols) != PAYLOAD_SYMBOLS + 1:
+        return None
+    try:
+        values = [DECODE[symbol] for symbol in symbols]
+    except KeyError:
+        return None
+    if ALPHABET[values[-1]] != check_symbol(values[:-1]):
+        return None
+    canonical = "".join(ALPHABET[v] for v in values)
+    return f"{canonical[:4]}-{canonical[4:]}"
+
+
+def is_valid_serial(text):
+    return normalize_serial(text) is not None
+
+
+def is_legacy_serial(text):
+    """Random 8-character serials issued before the allocator; they carry no check symbol."""
+    return bool(LEGACY_SERIAL.fullmatch(str(text or "")))
+
+
+def decode_serial(text):
+    """The counter value a valid serial was issued for (for audits), or None."""
+    canonical = normalize_serial(text)
+    if canonical is None:
+        return None
+    value = 0
+    for symbol in canonical.replace("-", "")[:PAYLOAD_SYMBOLS]:
+        value = (value << 5) | DECODE[symbol]
+    return unpermute(value)
+
+
+# ---------------- allocation ----------------
+
+class SerialAllocator(threading.local):
+    """
+    Hands out serials from a block of counter values reserved by this thread.
+
+    A block reserved inside a transaction only becomes ours for good when that
+    transaction commits; if it rolls back, the counter update is undone and
+    the block is dropped on the next call (its on_commit hook is gone).
+    """
+
+    def __init__(self, name="document"):
+        self.name = name
+        self.next = self.end = 0
+        self.pending = None  # on_commit hook of an uncommitted reservation
+
+    def _block_usable(self):
+        if self.next >= self.end:
+            return False
+        if self.pending is None:
+            return True
+        return any(entry[1] is self.pending for entry in connection.run_on_commit)
+
+    def _reserve(self, size):
+        with transaction.atomic():
+            models.SerialCounter.objects.get_or_create(name=self.name)
+            models.SerialCounter.objects.filter(name=self.name).update(next_value=F("next_value") + size)
+            end = models.SerialCounter.objects.values_list("next_value", flat=True).get(name=self.name)
+        if end > 1 << PAYLOAD_BITS:
+            raise SerialError("The serial number space is exhausted.")
+        self.next, self.end = end - size, end
+
+        if connection.in_atomic_block:
+            def committed():
+                if self.pending is committed:
+                    self.pending = None
+
+            self.pending = committed
+            transaction.on_commit(committed)
+        else:
+            self.pending = None
+
+    def allocate(self):
+        if not self._block_usable():
+            self._reserve(getattr(settings, "SERIAL_BLOCK_SIZE", 100))
+        value = self.next
+        self.next += 1
+        return encode_serial(value)
+
+    def allocate_many(self, count):
+        """`count` serials for bulk ingestion, reserving at most one extra block."""
+        serials = []
+        while len(serials) < count:
+            if not self._block_usable():
+                self._reserve(max(count - len(serials), getattr(settings, "SERIAL_BLOCK_SIZE", 100)))
+            take = min(count - len(serials), self.end - self.next)
+            serials.extend(encode_serial(value) for value in range(self.next, self.next + take))
+            self.next += take
+        return serials
+
+
+document_serials = SerialAllocator("document")
+
+
+def allocate_serial():
+    return document_serials.allocate()
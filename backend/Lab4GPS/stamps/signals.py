@@ -0,0 +1,53 @@
+# stamps/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .bloom import document_hash_filter
+from .models import Document
+from .tiles import discard_tiles
+from .verify_cache import verification_cache
+
+
+@receiver(post_save, sender=Document)
+def add_hash_to_filter(sender, instance, raw=False, **kwargs):
+    """Every saved hash goes into the verify-document Bloom filter, once committed (see stamps/bloom.py)."""
+    if raw or not instance.file_hash:
+        return
+    file_hash = instance.file_hash
+    transaction.on_commit(lambda: document_hash_filter.add(file_hash))
+
+
+@receiver(post_save, sender=Document)
+def invalidate_verification_cache(sender, instance, raw=False, **kwargs):
+    """Drop cached verify results for the document's old and new hash/serial."""
+    if raw:
+        return
+    loaded = instance._loaded_values
+    verification_cache.invalidate_document(
+        instance, old_hash=loaded.get("file_hash"), old_serial=loaded.get("serial_number")
+    )
+
+
+@receiver(post_delete, sender=Document)
+def invalidate_verification_cache_on_delete(sender, instance, **kwargs):
+    verification_cache.invalidate_document(instance)
+
+
+def _discard_unused_tiles(file_hash):
+    if file_hash and not Document.objects.filter(file_hash=file_hash).exists():
+        discard_tiles(file_hash)
+
+
+@receiver(post_save, sender=Document)
+def discard_replaced_tiles(sender, instance, raw=False, **kwargs):
+    """A new file gets a new pyramid; drop the old one unless another document shares it."""
+    old_hash = instance._loaded_values.get("file_hash")
+    if raw or old_hash == instance.file_hash:
+        return
+    _discard_unused_tiles(old_hash)
+
+
+@receiver(post_delete, sender=Document)
+def discard_deleted_tiles(sender, instance, **kwargs):
+    _discard_unused_tiles(instance.file_hash)
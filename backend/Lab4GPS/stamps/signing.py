@@ -0,0 +1,58 @@
+# stamps/signing.py
+"""
+The key that signs what the system attests: QR payloads (stamps/qr_payload.py)
+and hash batch roots (stamps/anchoring.py).
+
+It is DOCUMENT_SIGNING_KEY, read from the environment, never SECRET_KEY:
+the settings module is committed, so its SECRET_KEY is known to anyone with
+the repository and would let them mint valid signatures. Nothing is signed
+while the key is unset, shorter than MIN_KEY_LENGTH or still a Django
+"insecure" placeholder; DOCUMENT_SIGNING_KEY_FALLBACKS are still accepted
+when verifying, so keys can be rotated.
+"""
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+
+MIN_KEY_LENGTH = 32
+
+
+class SigningKeyMissing(ImproperlyConfigured):
+    """No usable DOCUMENT_SIGNING_KEY is configured, so nothing can be signed."""
+
+
+def _usable(key):
+    return (
+        bool(key) and len(key) >= MIN_KEY_LENGTH
+        and not key.startswith("django-insecure")
+        and key != settings.SECRET_KEY
+    )
+
+
+def signing_key():
+    """The key new signatures are made with; raises SigningKeyMissing if there is none."""
+    key = getattr(settings, "DOCUMENT_SIGNING_KEY", "")
+    if not _usable(key):
+        raise SigningKeyMissing(
+            f"Set DOCUMENT_SIGNING_KEY in the environment to a random secret of at least "
+            f"{MIN_KEY_LENGTH} characters (not SECRET_KEY) to sign QR payloads and hash batches."
+        )
+    return key
+
+
+def verification_keys():
+    """Every key a signature may have been made with: the current one, then the fallbacks."""
+    keys = [getattr(settings, "DOCUMENT_SIGNING_KEY", ""), *getattr(settings, "DOCUMENT_SIGNING_KEY_FALLBACKS", [])]
+    return [key for key in keys if _usable(key)]
+
+
+@checks.register(checks.Tags.security)
+def check_signing_key(app_configs, **kwargs):
+    try:
+        signing_key()
+    except SigningKeyMissing as e:
+        return [checks.Warning(
+            str(e), hint="Documents are saved without QR payloads and hash batches are not signed.",
+            id="stamps.W001",
+        )]
+    return []
@@ -0,0 +1,313 @@
+# stamps/stamping.py
+"""
+Server-side stamp compositing with PyMuPDF.
+
+A Stamp is drawn once into a small single-page PDF made of vector paths and
+text. That page is then placed on the target pages with show_pdf_page(), which
+embeds it as a Form XObject, so the stored document never gets rasterized.
+Each stamping is appended to the file as a PDF incremental update and
+recorded as a DocumentRevision.
+"""
+import hashlib
+import math
+import os
+import uuid
+
+import fitz  # PyMuPDF
+from django.db import transaction
+from django.db.models import Max
+
+from . import render_cache
+
+# Mirrors the constants used by the Konva canvas so both renderers agree.
+STAMP_SIZE = 120
+BORDER_WIDTH = 1.5
+RING_GAP = 15
+
+TEXT_FONT = "hebo"  # Helvetica-Bold
+TEXT_SIZE = 14
+DATE_SIZE = 12
+
+# (width, height) in PDF points for each shape at the default size.
+SHAPE_DIMENSIONS = {
+    "Circle": (STAMP_SIZE, STAMP_SIZE),
+    "Square": (STAMP_SIZE, STAMP_SIZE),
+    "Oval": (STAMP_SIZE * 1.5, STAMP_SIZE),
+    "Rectangle": (STAMP_SIZE * 1.5, STAMP_SIZE * 0.75),
+}
+
+
+class StampingError(Exception):
+    """Raised when a stamp cannot be applied to a document."""
+
+
+class _RevisionTaken(Exception):
+    """Another stamping saved a revision after this one read the document."""
+
+
+def hex_to_rgb(value):
+    """
+    Converts '#RRGGBB' into the 0..1 float triple PyMuPDF expects.
+    Falls back to black for anything it cannot parse.
+    """
+    value = (value or "").lstrip("#")
+    if len(value) != 6:
+        return (0, 0, 0)
+    try:
+        return tuple(int(value[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    except ValueError:
+        return (0, 0, 0)
+
+
+def stamp_dimensions(stamp, size=STAMP_SIZE):
+    """Returns the (width, height) of the stamp scaled so its height is `size`."""
+    width, height = SHAPE_DIMENSIONS.get(stamp.shape, (STAMP_SIZE, STAMP_SIZE))
+    scale = size / height
+    return width * scale, height * scale
+
+
+def _centered_text(shape, text, center, fontsize, color, rotate=0):
+    """Inserts `text` centred on `center`, optionally rotated around it (degrees)."""
+    width = fitz.get_text_length(text, fontname=TEXT_FONT, fontsize=fontsize)
+    origin = fitz.Point(center.x - width / 2, center.y + fontsize * 0.35)
+    morph = (center, fitz.Matrix(rotate)) if rotate else None
+    shape.insert_text(origin, text, fontname=TEXT_FONT, fontsize=fontsize, color=color, morph=morph)
+
+
+def _arc_text(shape, text, center, rx, ry, start, end, fontsize, color):
+    """
+    Lays `text` out letter by letter along an elliptical arc from `start` to
+    `end` (radians, clockwise from 3 o'clock), the same way the canvas does.
+    """
+    step = (end - start) / len(text)
+    for i, char in enumerate(text):
+        theta = start + (i + 0.5) * step
+        point = fitz.Point(center.x + rx * math.cos(theta), center.y + ry * math.sin(theta))
+        # Upright along the top arc, readable from outside along the bottom arc.
+        degrees = -math.degrees(theta + math.pi / 2)
+        if math.sin(theta) > 0:
+            degrees += 180
+        _centered_text(shape, char, point, fontsize, color, rotate=degrees)
+
+
+def draw_stamp(page, stamp, rect):
+    """Draws `stamp` as vector graphics into `rect` on `page`."""
+    shape_color = hex_to_rgb(stamp.shape_color)
+    text_color = hex_to_rgb(stamp.text_color)
+    date_color = hex_to_rgb(stamp.date_color)
+    scale = rect.height / STAMP_SIZE
+    gap = RING_GAP * scale
+    text_size = TEXT_SIZE * scale
+    date_size = DATE_SIZE * scale
+    center = fitz.Point((rect.x0 + rect.x1) / 2, (rect.y0 + rect.y1) / 2)
+    inset = BORDER_WIDTH * scale
+    outer = fitz.Rect(rect.x0 + inset, rect.y0 + inset, rect.x1 - inset, rect.y1 - inset)
+    inner = fitz.Rect(outer.x0 + gap, outer.y0 + gap, outer.x1 - gap, outer.y1 - gap)
+    top_text = (stamp.top_text or "").upper()
+    bottom_text = (stamp.bottom_text or "").upper()
+
+    shape = page.new_shape()
+    if stamp.shape in ("Circle", "Oval"):
+        shape.draw_oval(outer)
+        shape.draw_oval(inner)
+        shape.finish(color=shape_color, width=BORDER_WIDTH * scale)
+        rx = outer.width / 2 - gap / 2
+        ry = outer.height / 2 - gap / 2
+        if top_text:
+            _arc_text(shape, top_text, center, rx, ry, math.pi, 2 * math.pi, text_size * 0.8, text_color)
+        if bottom_text:
+            _arc_text(shape, bottom_text, center, rx, ry, 0.8 * math.pi, 0.2 * math.pi, text_size * 0.8, text_color)
+    else:
+        shape.draw_rect(outer)
+        shape.draw_rect(inner)
+        shape.finish(color=shape_color, width=BORDER_WIDTH * scale)
+        if top_text:
+            _centered_text(shape, top_text, fitz.Point(center.x, inner.y0 + text_size), text_size, text_color)
+        if bottom_text:
+            _centered_text(shape, bottom_text, fitz.Point(center.x, inner.y1 - text_size), text_size, text_color)
+
+    if stamp.date:
+        _centered_text(shape, str(stamp.date), center, date_size, date_color)
+    shape.commit()
+
+
+def render_stamp_pdf(stamp, size=STAMP_SIZE):
+    """
+    Renders the stamp on its own page and returns the PDF bytes.
+    The page is exactly the stamp's bounding box, so it can be placed as-is.
+    """
+    width, height = stamp_dimensions(stamp, size)
+    pdf = fitz.open()
+    page = pdf.new_page(width=width, height=height)
+    draw_stamp(page, stamp, page.rect)
+    data = pdf.tobytes(garbage=3, deflate=True)
+    pdf.close()
+    return data
+
+
+def _stamp_file(path, stamp, placements):
+    """
+    Places `stamp` on the PDF at `path` and saves it there. Returns True when
+    the change was appended as an incremental update, False when the file had
+    to be rewritten (a PDF repaired on open cannot be appended to).
+    """
+    try:
+        pdf = fitz.open(path, filetype="pdf")
+    except Exception as e:
+        raise StampingError(f"Document is not a readable PDF: {e}")
+
+    stamp_sources = {}
+    try:
+        for placement in placements:
+            page_number = placement["page"]
+            if not 1 <= page_number <= pdf.page_count:
+                raise StampingError(
+                    f"Page {page_number} is out of range; the document has {pdf.page_count} pages."
+                )
+            size = int(round(placement.get("size") or STAMP_SIZE))
+            if size not in stamp_sources:
+                # The same source page is embedded once and referenced on every target page.
+                form = render_cache.stamp_render_cache.get(stamp, "pdf", size)
+                stamp_sources[size] = fitz.open("pdf", form)
+            width, height = stamp_dimensions(stamp, size)
+            x, y = placement["x"], placement["y"]
+            page = pdf[page_number - 1]
+            page.show_pdf_page(fitz.Rect(x, y, x + width, y + height), stamp_sources[size], 0)
+
+        if pdf.can_save_incrementally():
+            pdf.saveIncr()
+            return True
+        rewritten = f"{path}.full"
+        pdf.save(rewritten, garbage=3, deflate=True)
+    finally:
+        for source in stamp_sources.values():
+            source.close()
+        pdf.close()
+    os.replace(rewritten, path)
+    return False
+
+
+def apply_stamp(document, stamp, placements):
+    """
+    Writes `stamp` into the stored PDF of `document` at every placement.
+
+    Each placement is a dict with a 1-based `page`, the top-left `x`/`y` of the
+    stamp in PDF points, and an optional `size` (height in points).
+
+    The stamp is added as a PDF incremental update: the stored bytes are
+    copied unchanged and only the new objects (a few KB) are appended, so the
+    previous revision stays a byte-identical prefix that still verifies by
+    its hash. The copy is hashed while it is written, so hashing the new file
+    only reads the appended bytes.
+
+    The new file is attached to `document.file` and `document.version` moves
+    to the next revision, but nothing is saved; the caller saves the document
+    so hashing, QR generation and the DocumentRevision record run once.
+    The revision number is read here, so the row must be locked until that
+    save: use stamp_document().
+    """
+    from blobs.storage import CHUNK_SIZE
+    from blobs.uploads import AssembledUpload, incoming_path
+
+    if not document.file:
+        raise StampingError("Document has no file to stamp.")
+
+    # fitz only appends to a PDF opened from a path, and stored files may be
+    # shared blobs, so the revision is built on a private copy.
+    path = incoming_path(f"stamp-{uuid.uuid4().hex}.pdf")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sha = hashlib.sha256()
+    try:
+        with document.file.open("rb") as source, open(path, "wb") as target:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+                target.write(chunk)
+        base = (sha.hexdigest(), os.path.getsize(path))
+
+        incremental = _stamp_file(path, stamp, placements)
+        if not incremental:
+            sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            f.seek(base[1] if incremental else 0)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    latest = document.revisions.aggregate(latest=Max("number"))["latest"] if document.pk else None
+    number = (latest or 1) + 1
+    document.version = f"{number}.0"
+    document._pending_revision = {
+        "number": number,
+        "stamp": stamp,
+        "incremental": incremental,
+        # Documents stamped before revisions were recorded get their revision 1 now.
+        "base": None if latest else base,
+    }
+    document.file = AssembledUpload(
+        path, os.path.basename(document.file.name), "application/pdf", os.path.getsize(path), sha.hexdigest()
+    )
+    return document
+
+
+def _discard_stamped_file(document, upload):
+    """Removes what a failed stamping left on disk: the scratch copy, or the stored file whose records rolled back."""
+    upload.close()
+    if os.path.exists(upload.path):
+        os.remove(upload.path)
+        return
+    if document.file._committed and document.file.name:
+        storage = document.file.storage
+        try:
+            os.remove(storage.path(document.file.name))
+        except FileNotFoundError:
+            pass
+        remove_blob = getattr(storage, "_remove_blob", None)  # blobs.storage: only if no Blob row survived
+        if remove_blob is not None:
+            remove_blob(upload.sha256)
+
+
+def _discard_scratch_copy(upload):
+    """After a successful save: the storage moved the scratch copy into a new blob, or left it if the content was stored already."""
+    upload.close()
+    if os.path.exists(upload.path):
+        os.remove(upload.path)
+
+
+def stamp_document(document, stamp, placements, attempts=3):
+    """
+    Stamps `document` and saves it with its row locked from reading the
+    revision number to the save, so concurrent stampings of one document
+    queue up and each builds on the revision the previous one saved.
+    Returns the saved document (re-read under the lock).
+
+    select_for_update() does nothing on SQLite (its IMMEDIATE transactions
+    serialise writers instead), so the revision is also claimed with a
+    conditional UPDATE on `version`: a stamping that read a revision another
+    one has saved since starts over from the new one.
+    """
+    model = type(document)
+    for _ in range(attempts):
+        locked = upload = None
+        try:
+            with transaction.atomic():
+                locked = model.objects.select_for_update().get(pk=document.pk)
+                base_version = locked.version
+                apply_stamp(locked, stamp, placements)
+                upload = locked.file.file
+                if not model.objects.filter(pk=locked.pk, version=base_version).update(version=locked.version):
+                    raise _RevisionTaken
+                locked.stamped = True
+                locked.save()
+        except _RevisionTaken:
+            _discard_stamped_file(locked, upload)
+            continue
+        except BaseException:
+            if upload is not None:
+                _discard_stamped_file(locked, upload)
+            raise
+        _discard_scratch_copy(upload)
+        return locked
+    raise StampingError("The document kept being stamped concurrently; try again.")
@@ -0,0 +1,52 @@
+# stamps/tasks.py
+"""
+Document work that runs on the task queue instead of the request path.
+Each task takes ids and re-reads the current row, so a task that runs late
+(or twice) works on the latest state.
+"""
+from tasks.registry import task
+
+from . import fingerprints
+from .tiles import DocumentTiles
+from .jobs import process_item
+from .models import Document
+from .signing import SigningKeyMissing
+
+
+@task(priority=5)
+def render_document_qr(document_id):
+    """Issues and stores the QR payload for the document's current id/serial/owner/file."""
+    document = Document.objects.select_related("user").filter(pk=document_id).first()
+    if document is None or not document.file:
+        return
+    try:
+        document.generate_qr_code()
+    except SigningKeyMissing:
+        return  # reported by `manage.py check` (stamps.W001)
+    Document.objects.filter(pk=document.pk).update(qr_payload=document.qr_payload)
+
+
+@task(priority=0, concurrency=2)
+def index_document_pages(document_id):
+    """Fingerprints every page of the document's stored file (see stamps/fingerprints.py)."""
+    document = Document.objects.filter(pk=document_id).first()
+    if document is None or not document.file:
+        return
+    with document.file.open("rb") as f:
+        page_fingerprints = fingerprints.fingerprint_pdf(data=f.read())
+    fingerprints.replace_fingerprints(document, page_fingerprints)
+
+
+@task(priority=2, concurrency=2)
+def render_document_tiles(document_id):
+    """Pre-renders the overview tiles of every page and all of page 1 (see stamps/tiles.py)."""
+    document = Document.objects.filter(pk=document_id).only("id", "file", "file_hash").first()
+    if document is None or not document.file or not document.file_hash:
+        return
+    DocumentTiles(document).prerender()
+
+
+@task(priority=3, concurrency=2)
+def stamp_job_item(item_id):
+    """Stamps one document of a StampJob."""
+    process_item(item_id)
@@ -1,3 +1,1109 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import fitz  # PyMuPDF
+from django.core.files.uploadedfile import InMemoryUploadedFile, SimpleUploadedFile, TemporaryUploadedFile
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from Auths.models import CustomUser
+from Lab4GPS.uploadhandlers import hashing_upload_handlers, uploaded_sha256
+from blobs.storage import ContentAddressedStorage
+from . import qr, qr_payload, render_cache, serials
+from .anchoring import (
+    AnchorError, anchor_pending, build_tree, leaf_hash, node_hash, resign_legacy_batches, root_from_proof,
+    sign_root, verify_anchor,
+)
+from .bloom import SharedHashFilter
+from .jobs import create_job, process_item
+from .models import Document, SerialCounter, Stamp, StampJob, StampJobItem, VerificationEvent
+from .pdf_scan import PDFScanResult, page_order
+from .pipeline import DocumentSavePipeline
+from .qr import qr_decode_stats
+from .qr_images import qr_image_url
+from .qr_payload import QRSignatureError, decode_qr_payload, encode_qr_payload
+from .render_cache import APPEARANCE_FIELDS, RenderedStampCache, appearance_digest, stamp_render_cache
+from .signing import SigningKeyMissing
+from .stamping import StampingError, apply_stamp, stamp_document
+from .tiles import DocumentTiles, tile_directory
+from .verify_cache import VerificationCache, verification_cache
+from .verify_log import VerificationEventLog
+from .views import DocumentViewSet
+
+SIGNING_KEY = "test-document-signing-key-0123456789abcdef"
+OLD_SIGNING_KEY = "old-document-signing-key-0123456789abcdef"
+
+
+@override_settings(VERIFY_LOG_FLUSH_INTERVAL=3600, VERIFY_LOG_BATCH_SIZE=1000)
+class VerificationEventLogTests(TransactionTestCase):
+    """Foreign keys are checked at commit, so these run outside a wrapping transaction."""
+
+    def setUp(self):
+        verification_cache.clear()
+        self.request = RequestFactory().post("/stamps/documents/verify-document/", REMOTE_ADDR="10.0.0.1")
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        self.document = Document.objects.bulk_create([
+            Document(user=user, file="documents/a.pdf", file_hash="0" * 64, serial_number="S1"),
+        ])[0]
+
+    def test_unknown_qr_document_is_not_attributed(self):
+        payload = repr({"document_id": 999999, "serial_number": "ABCD1234", "user": "john"})
+        response = DocumentViewSet()._verify_qr_payload(payload)
+        self.assertEqual(response.data["status"], "invalid")
+        self.assertIsNone(getattr(response, "document_id", None))
+
+    def test_events_naming_missing_documents_do_not_block_the_log(self):
+        log = VerificationEventLog()
+        log.record(self.request, "invalid", 999999)  # deleted since it was verified
+        log.record(self.request, "invalid", "not-a-number")
+        log.record(self.request, "valid", self.document.pk)
+        self.assertEqual(log.flush(), 3)
+        self.assertEqual(log.pending(), 0)
+
+        log.record(self.request, "valid", self.document.pk)
+        self.assertEqual(log.flush(), 1)
+        self.assertEqual(
+            sorted(VerificationEvent.objects.values_list("document_id", flat=True), key=str),
+            sorted([None, None, self.document.pk, self.document.pk], key=str),
+        )
+
+
+class StampDocumentTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        overrides = override_settings(
+            MEDIA_ROOT=media, TASKS_EAGER=True, DOCUMENT_TILE_PRERENDER=False, DOCUMENT_SIGNING_KEY=SIGNING_KEY,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        hash_filter = mock.patch("stamps.signals.document_hash_filter")
+        hash_filter.start()
+        self.addCleanup(hash_filter.stop)
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        self.stamp = Stamp.objects.create(
+            user=user, shape="Circle", shape_color="#1144aa", text_color="#aa0000",
+            date_color="#000000", date=date(2026, 10, 18), top_text="Faculty",
+        )
+        pdf = fitz.open()
+        pdf.new_page().insert_text((72, 72), "Hello")
+        self.document = Document(user=user, file=SimpleUploadedFile("a.pdf", pdf.tobytes(), "application/pdf"))
+        self.document.save()
+        self.media = media
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media)
+            for root, _, names in os.walk(self.media) for name in names
+        )
+
+    def test_each_stamping_builds_on_the_saved_revision(self):
+        for _ in range(2):
+            stamp_document(self.document, self.stamp, [{"page": 1, "x": 100, "y": 100}])
+        document = Document.objects.get(pk=self.document.pk)
+        self.assertEqual(document.version, "3.0")
+        self.assertEqual(list(document.revisions.values_list("number", flat=True)), [1, 2, 3])
+
+    def test_failed_save_leaves_no_files_behind(self):
+        before = self.stored_files()
+        with mock.patch.object(DocumentSavePipeline, "record_revision", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                stamp_document(self.document, self.stamp, [{"page": 1, "x": 100, "y": 100}])
+        self.assertEqual(self.stored_files(), before)
+        self.assertEqual(Document.objects.get(pk=self.document.pk).version, "1.0")
+
+    def test_scratch_copy_is_removed_when_the_content_is_already_stored(self):
+        write_blob = ContentAddressedStorage._write_blob
+
+        def already_stored(storage, digest, content):
+            os.makedirs(os.path.dirname(storage.blob_path(digest)), exist_ok=True)
+            shutil.copyfile(content.temporary_file_path(), storage.blob_path(digest))
+            return write_blob(storage, digest, content)
+
+        with mock.patch.object(ContentAddressedStorage, "_write_blob", already_stored):
+            stamp_document(self.document, self.stamp, [{"page": 1, "x": 100, "y": 100}])
+        self.assertEqual([name for name in self.stored_files() if "incoming" in name], [])
+
+    def stamp_with_conflicts(self, conflicts):
+        calls = []
+
+        def stamped_concurrently(document, *args):
+            calls.append(document.version)
+            result = apply_stamp(document, *args)
+            if len(calls) <= conflicts:  # another stamping saved its revision meanwhile
+                Document.objects.filter(pk=document.pk).update(version="9.0")
+            return result
+
+        with mock.patch("stamps.stamping.apply_stamp", stamped_concurrently):
+            try:
+                return stamp_document(self.document, self.stamp, [{"page": 1, "x": 100, "y": 100}])
+            finally:
+                self.attempts = len(calls)
+
+    def test_stamping_that_lost_the_revision_to_another_starts_over(self):
+        stamped = self.stamp_with_conflicts(1)
+        self.assertEqual(self.attempts, 2)
+        self.assertEqual(stamped.version, "2.0")
+        self.assertEqual([name for name in self.stored_files() if "incoming" in name], [])
+
+    def test_stamping_gives_up_after_repeated_conflicts(self):
+        before = self.stored_files()
+        with self.assertRaises(StampingError):
+            self.stamp_with_conflicts(3)
+        self.assertEqual(self.attempts, 3)
+        self.assertEqual(self.stored_files(), before)
+
+    def test_job_item_run_again_after_its_lease_expired_is_not_stamped_twice(self):
+        job = create_job(self.document.user, self.stamp, [self.document], [{"page": 1, "x": 100, "y": 100}])
+        item = job.items.get()
+        process_item(item.pk)  # the retry of an item that already finished
+        job = StampJob.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.succeeded, job.failed), ("completed", 1, 0))
+        self.assertEqual(Document.objects.get(pk=self.document.pk).version, "2.0")
+
+    @override_settings(TASKS_EAGER=False)
+    def test_job_item_claimed_by_another_run_is_skipped(self):
+        job = create_job(self.document.user, self.stamp, [self.document], [{"page": 1, "x": 100, "y": 100}])
+        item = job.items.get()
+        StampJobItem.objects.filter(pk=item.pk).update(status="running")  # inside the other run's transaction
+        process_item(item.pk)
+        self.assertEqual(Document.objects.get(pk=self.document.pk).version, "1.0")
+        StampJobItem.objects.filter(pk=item.pk).update(status="pending")  # ...which rolled back
+        with mock.patch("stamps.jobs.stamp_document", side_effect=RuntimeError("boom")):
+            process_item(item.pk)
+        item.refresh_from_db()
+        job.refresh_from_db()
+        self.assertEqual((item.status, item.error), ("failed", "boom"))
+        self.assertEqual((job.status, job.failed), ("failed", 1))
+
+
+class FingerprintVerificationTests(TestCase):
+    def setUp(self):
+        verification_cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        overrides = override_settings(
+            MEDIA_ROOT=media, TASKS_EAGER=True, DOCUMENT_TILE_PRERENDER=False, DOCUMENT_SIGNING_KEY=SIGNING_KEY,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        for target in ("stamps.signals.document_hash_filter", "stamps.views.document_hash_filter"):
+            patcher = mock.patch(target)
+            patcher.start().might_contain.return_value = True
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("stamps.views.verification_log")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("stamps.views.scan_pdf_for_qr", return_value=None)  # no QR on these pages
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.owner = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        self.document = Document(user=self.owner, file=SimpleUploadedFile("a.pdf", self.pdf(), "application/pdf"))
+        self.document.save()
+        self.document.refresh_from_db()
+
+    @staticmethod
+    def pdf(pages=3, changed=None):
+        pdf = fitz.open()
+        for number in range(1, pages + 1):
+            text = "Forged" if number == changed else f"Certificate page {number}"
+            pdf.new_page().insert_text((72, 72), text)
+        return pdf.tobytes()
+
+    def verify(self, user, data):
+        return self.verify_json(user, data)["message"]
+
+    def verify_json(self, user, data):
+        client = APIClient()
+        client.force_authenticate(user)
+        upload = SimpleUploadedFile("b.pdf", data, "application/pdf")
+        response = client.post("/stamps/documents/verify-document/", {"file": upload}, format="multipart")
+        return response.json()
+
+    def test_only_the_owner_learns_which_document_is_closest(self):
+        tampered = self.pdf(changed=2)
+        other = CustomUser.objects.create_user(username="other", email="other@example.com", password="pw")
+        message = self.verify(other, tampered)
+        self.assertIn("Page 2 differs from an issued document.", message)
+        self.assertNotIn(self.document.serial_number, message)
+        self.assertNotIn("owner", message)
+        message = self.verify(self.owner, tampered)  # not answered from the other user's cached result
+        self.assertIn(f"your document {self.document.serial_number}; page 2 differs from it.", message)
+
+    @override_settings(VERIFY_FINGERPRINT_MAX_PAGES=2)
+    def test_uploads_over_the_page_limit_are_not_compared(self):
+        message = self.verify(self.owner, self.pdf(changed=2))
+        self.assertNotIn("differ", message)
+
+    def verify_with_our_qr(self, data):
+        found = PDFScanResult(payload=self.document.qr_payload, page=1)
+        with mock.patch("stamps.views.scan_pdf_for_qr", return_value=found):
+            return self.verify_json(self.owner, data)
+
+    def test_genuine_qr_on_a_re_saved_copy_verifies(self):
+        pdf = fitz.open(stream=self.pdf())
+        pdf.set_metadata({"title": "Re-saved"})
+        result = self.verify_with_our_qr(pdf.tobytes())
+        self.assertEqual((result["status"], result["isVerified"]), ("valid", True))
+        self.assertIn("every page matches our stored copy", result["message"])
+
+    def test_genuine_qr_copied_onto_an_altered_file_is_not_verified(self):
+        result = self.verify_with_our_qr(self.pdf(changed=2))
+        self.assertEqual((result["status"], result["isVerified"]), ("modified", False))
+        self.assertIn("page 2 differs from the issued document", result["message"])
+
+
+class VerificationCacheTests(TestCase):
+    """Two VerificationCache instances on one file cache stand in for two processes."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        overrides = override_settings(CACHES={"verification": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory,
+        }}, VERIFY_CACHE_ALIAS="verification")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.web, self.worker = VerificationCache(), VerificationCache()
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        self.document, self.other = Document.objects.bulk_create([
+            Document(user=user, file="documents/a.pdf", file_hash="a" * 64, serial_number="S1"),
+            Document(user=user, file="documents/b.pdf", file_hash="b" * 64, serial_number="S2"),
+        ])
+
+    def test_a_save_in_another_process_drops_results_naming_the_document(self):
+        valid = {"status": "valid", "isVerified": True, "message": "..."}
+        for digest in ("a" * 64, "c" * 64, "d" * 64):  # its file, a re-saved copy, a scan matched by QR
+            self.web.set_result(digest, valid, 200, self.document.pk)
+        self.web.set_result("e" * 64, valid, 200, self.other.pk)
+        self.assertEqual(self.worker.get_result("c" * 64), (valid, 200, self.document.pk))
+
+        self.worker.invalidate_document(self.document)
+        for digest in ("a" * 64, "c" * 64, "d" * 64):
+            self.assertIsNone(self.web.get_result(digest))
+        self.assertEqual(self.web.get_result("e" * 64), (valid, 200, self.other.pk))
+
+    def test_a_lost_generation_only_causes_misses(self):
+        self.web.set_result("c" * 64, {"status": "valid"}, 200, self.document.pk)
+        self.web.cache.delete(self.web._generation_key(self.document.pk))  # evicted
+        self.assertIsNone(self.web.get_result("c" * 64))
+
+    def test_errors_are_not_cached(self):
+        self.web.set_result("c" * 64, {"status": "error"}, 400)
+        self.web.set_result("f" * 64, {"status": "invalid"}, 200)
+        self.assertIsNone(self.web.get_result("c" * 64))
+        self.assertEqual(self.web.get_result("f" * 64), ({"status": "invalid"}, 200, None))
+
+    def test_serial_records_are_loaded_once_until_the_document_changes(self):
+        load = mock.Mock(return_value={"file_hash": "a" * 64})
+        for _ in range(2):
+            self.web.get_record(self.document.pk, "S1", "current", load)
+        self.assertEqual(load.call_count, 1)
+        self.worker.invalidate_document(self.document)
+        self.web.get_record(self.document.pk, "S1", "current", load)
+        self.assertEqual(load.call_count, 2)
+
+
+class BatchVerificationTests(TestCase):
+    def setUp(self):
+        verification_cache.clear()
+        for target, value in (
+            ("stamps.views.verification_log", None),
+            ("stamps.views.scan_pdf_for_qr", None),
+            ("stamps.views.closest_document", (None, 0)),  # none of these were issued
+        ):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("stamps.views.document_hash_filter")
+        patcher.start().might_contain.return_value = False
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create_user(username="auditor", email="auditor@example.com", password="pw")
+        )
+
+    @staticmethod
+    def pdf(text):
+        pdf = fitz.open()
+        pdf.new_page().insert_text((72, 72), text)
+        return pdf.tobytes()
+
+    def zip_of(self, entries):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name, data in entries.items():
+                archive.writestr(name, data)
+        return SimpleUploadedFile("batch.zip", buffer.getvalue(), "application/zip")
+
+    def post(self, files):
+        return self.client.post("/stamps/documents/verify-batch/", {"files": files}, format="multipart")
+
+    def results(self, response):
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        return {result["file"]: result for result in map(json.loads, lines)}
+
+    def test_streams_one_result_per_file(self):
+        response = self.post([
+            SimpleUploadedFile("a.pdf", self.pdf("A"), "application/pdf"),
+            SimpleUploadedFile("notes.txt", b"hello", "text/plain"),
+        ])
+        self.assertEqual(response["X-Batch-Size"], "2")
+        results = self.results(response)
+        self.assertEqual(set(results), {"a.pdf", "notes.txt"})
+        self.assertEqual((results["a.pdf"]["status"], results["a.pdf"]["isVerified"]), ("invalid", False))
+        self.assertEqual(results["notes.txt"]["status"], "error")
+
+    def test_zip_archives_are_expanded(self):
+        archive = self.zip_of({
+            "certs/a.pdf": self.pdf("A"), "certs/b.pdf": self.pdf("B"),
+            "certs/.DS_Store": b"", "__MACOSX/certs/._a.pdf": b"",
+        })
+        results = self.results(self.post([archive, SimpleUploadedFile("c.pdf", self.pdf("C"), "application/pdf")]))
+        self.assertEqual(set(results), {"certs/a.pdf", "certs/b.pdf", "c.pdf"})
+
+    @override_settings(BATCH_VERIFY_MAX_FILES=2)
+    def test_files_over_the_batch_limit_are_refused(self):
+        response = self.post([self.zip_of({"a.pdf": b"a", "b.pdf": b"b", "c.pdf": b"c"})])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("at most 2 files", response.json()["message"])
+
+    @override_settings(DATA_UPLOAD_MAX_NUMBER_FILES=2)
+    def test_too_many_parts_are_refused_with_a_hint_to_zip_them(self):
+        response = self.post([SimpleUploadedFile(f"{i}.pdf", b"x", "application/pdf") for i in range(3)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("ZIP archive", response.json()["message"])
+
+    def test_a_broken_archive_is_refused(self):
+        response = self.post([SimpleUploadedFile("batch.zip", b"not a zip", "application/zip")])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("not a valid ZIP archive", response.json()["message"])
+
+
+class SharedHashFilterTests(TestCase):
+    """Two filters on one path stand in for two worker processes."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, "hashes.bloom")
+        self.worker, self.other = self.shared_filter(), self.shared_filter()
+
+    def shared_filter(self):
+        shared = SharedHashFilter(path=self.path, capacity=1000, error_rate=0.001)
+        self.addCleanup(shared.close)
+        return shared
+
+    def test_adds_after_another_process_rebuilt_land_in_the_new_file(self):
+        self.assertFalse(self.worker.might_contain("a" * 64))  # maps the current file
+        self.other.rebuild()
+        self.worker.add("a" * 64)
+        self.assertTrue(self.shared_filter().might_contain("a" * 64))
+
+    def test_a_miss_is_rechecked_against_a_rebuilt_file(self):
+        self.assertFalse(self.worker.might_contain("b" * 64))
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        Document.objects.bulk_create([  # TestCase never commits, so only a rebuild adds it
+            Document(user=user, file="documents/b.pdf", file_hash="b" * 64, serial_number="S2"),
+        ])
+        self.other.rebuild()
+        self.assertTrue(self.worker.might_contain("b" * 64))
+
+    def test_bulk_writes_add_their_hashes_once_committed(self):
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        with mock.patch("stamps.bloom.document_hash_filter", self.worker):
+            with self.captureOnCommitCallbacks(execute=True):
+                document = Document.objects.bulk_create([
+                    Document(user=user, file="documents/c.pdf", file_hash="c" * 64, serial_number="S3"),
+                ])[0]
+            with self.captureOnCommitCallbacks(execute=True):
+                Document.objects.filter(pk=document.pk).update(file_hash="d" * 64)
+            document.file_hash = "e" * 64
+            with self.captureOnCommitCallbacks(execute=True):
+                Document.objects.bulk_update([document], ["file_hash"])
+        for file_hash in ("c" * 64, "d" * 64, "e" * 64):
+            self.assertTrue(self.other.might_contain(file_hash))
+
+    def test_startup_rebuilds_a_file_older_than_max_age(self):
+        self.other.rebuild()
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        Document.objects.bulk_create([  # TestCase never commits, so only a rebuild adds it
+            Document(user=user, file="documents/f.pdf", file_hash="f" * 64, serial_number="S4"),
+        ])
+        self.worker.load(max_age=3600)
+        self.assertFalse(self.worker.might_contain("f" * 64))
+        self.worker.load(max_age=-1)
+        self.assertTrue(self.worker.might_contain("f" * 64))
+
+
+@override_settings(DOCUMENT_SIGNING_KEY=SIGNING_KEY)
+class QRImageTests(TestCase):
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        self.document = Document.objects.bulk_create([  # issued before payloads were stored
+            Document(user=self.owner, file="documents/a.pdf", file_hash="0" * 64, serial_number="S1"),
+        ])[0]
+        self.url = f"/stamps/documents/{self.document.pk}/qr.png"
+
+    def test_only_the_owner_gets_a_missing_payload_issued(self):
+        other = CustomUser.objects.create_user(username="other", email="other@example.com", password="pw")
+        client = APIClient()
+        self.assertEqual(client.get(self.url).status_code, 404)
+        client.force_authenticate(other)
+        self.assertEqual(client.get(self.url).status_code, 404)
+        self.assertIsNone(Document.objects.get(pk=self.document.pk).qr_payload)
+
+        client.force_authenticate(self.owner)
+        response = client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertTrue(Document.objects.get(pk=self.document.pk).qr_payload)
+
+    def test_versioned_url_has_no_slash_before_its_query(self):
+        self.document.generate_qr_code()
+        self.document.save(update_fields=["qr_payload"])
+        url = qr_image_url(self.document)
+        self.assertRegex(url, rf"^{self.url}\?v=[0-9a-f]+$")
+        self.assertEqual(APIClient().get(url).status_code, 200)
+
+
+@override_settings(DOCUMENT_SIGNING_KEY=SIGNING_KEY)
+class AnchorFieldsTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        Document.objects.bulk_create([
+            Document(user=user, file="documents/a.pdf", file_hash="0" * 64, serial_number="S1", qr_payload="x"),
+        ])
+        self.document = Document.objects.get()  # loaded before the anchoring run
+
+    def test_full_save_keeps_an_anchor_set_after_loading(self):
+        batch = anchor_pending()
+        self.document.metadata = {"note": "edited"}
+        self.document.save()
+        document = Document.objects.get(pk=self.document.pk)
+        self.assertEqual(document.metadata, {"note": "edited"})
+        self.assertEqual(document.anchor_batch, batch)
+        self.assertTrue(document.anchor_proof is not None)
+
+
+class SerialTests(TestCase):
+    def test_the_permutation_is_a_bijection(self):
+        # Small enough to enumerate: a 10-bit network cycle-walked into 9 bits.
+        with mock.patch.multiple(serials, FEISTEL_HALF_BITS=5, PAYLOAD_BITS=9):
+            permuted = [serials.permute(value) for value in range(1 << 9)]
+            self.assertEqual(sorted(permuted), list(range(1 << 9)))
+            self.assertNotEqual(permuted, list(range(1 << 9)))
+            self.assertEqual([serials.unpermute(value) for value in permuted], list(range(1 << 9)))
+
+    def test_serials_round_trip(self):
+        for value in (0, 1, 2, 12345, (1 << 35) - 1):
+            serial = serials.encode_serial(value)
+            self.assertRegex(serial, r"^[0-9A-HJKMNP-TV-Z]{4}-[0-9A-HJKMNP-TV-Z]{4}$")
+            for typed in (serial, serial.lower(), serial.replace("-", ""), f" {serial[:4]} {serial[5:]} "):
+                self.assertEqual(serials.normalize_serial(typed), serial)
+            self.assertEqual(serials.decode_serial(serial.lower()), value)
+        misread = serials.encode_serial(0).replace("0", "O").replace("1", "l")
+        self.assertEqual(serials.decode_serial(misread), 0)
+
+    def test_a_single_mistyped_symbol_is_rejected(self):
+        serial = serials.encode_serial(12345).replace("-", "")
+        for position, symbol in enumerate(serial):
+            for typo in serials.ALPHABET:
+                if typo != symbol:
+                    self.assertFalse(serials.is_valid_serial(serial[:position] + typo + serial[position + 1:]))
+        for position in range(serials.PAYLOAD_SYMBOLS - 1):
+            swapped = serial[:position] + serial[position + 1] + serial[position] + serial[position + 2:]
+            if swapped != serial:
+                self.assertFalse(serials.is_valid_serial(swapped))
+
+    @override_settings(SERIAL_BLOCK_SIZE=10)
+    def test_a_block_reserved_by_a_rolled_back_transaction_is_dropped(self):
+        allocator, other = serials.SerialAllocator("test"), serials.SerialAllocator("test")
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                allocator.allocate()  # reserves 0-9, then the reservation is undone
+                raise RuntimeError("boom")
+        taken = {serials.decode_serial(other.allocate())}  # so 0-9 go to another thread
+        taken.update(serials.decode_serial(allocator.allocate()) for _ in range(3))
+        self.assertEqual(len(taken), 4)
+        self.assertEqual(SerialCounter.objects.get(name="test").next_value, 20)
+
+    @override_settings(SERIAL_BLOCK_SIZE=10)
+    def test_a_committed_block_is_used_up_before_the_next(self):
+        allocator = serials.SerialAllocator("test")
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                first = allocator.allocate()
+        self.assertIsNone(allocator.pending)
+        self.assertEqual(
+            [serials.decode_serial(serial) for serial in [first] + allocator.allocate_many(12)], list(range(13)),
+        )
+        self.assertEqual(SerialCounter.objects.get(name="test").next_value, 20)
+
+
+@override_settings(DOCUMENT_SIGNING_KEY=SIGNING_KEY, DOCUMENT_SIGNING_KEY_FALLBACKS=[])
+class QRPayloadTests(TestCase):
+    def setUp(self):
+        verification_cache.clear()
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        self.document = Document.objects.bulk_create([
+            Document(user=user, file="documents/a.pdf", file_hash="ab" * 32, serial_number="S1"),
+        ])[0]
+
+    def verify(self, payload):
+        return DocumentViewSet()._verify_qr_payload(payload).data
+
+    def test_round_trip(self):
+        qr = decode_qr_payload(encode_qr_payload(self.document))
+        self.assertTrue(qr.signed)
+        self.assertEqual((qr.document_id, qr.serial_number, qr.hash_prefix),
+                         (self.document.pk, "S1", "ab" * 8))
+
+    def test_tampered_payload_is_rejected(self):
+        payload = encode_qr_payload(self.document)
+        message, _, signature = payload.rpartition(".")
+        forged = message.replace(".S1.", ".S2.") + "." + signature
+        with self.assertRaises(QRSignatureError):
+            decode_qr_payload(forged)
+        self.assertEqual(self.verify(forged)["status"], "invalid")
+
+    def test_fallback_key_verifies_but_does_not_sign(self):
+        with override_settings(DOCUMENT_SIGNING_KEY=OLD_SIGNING_KEY):
+            payload = encode_qr_payload(self.document)
+        with self.assertRaises(QRSignatureError):
+            decode_qr_payload(payload)
+        with override_settings(DOCUMENT_SIGNING_KEY_FALLBACKS=[OLD_SIGNING_KEY]):
+            self.assertTrue(decode_qr_payload(payload).signed)
+            self.assertNotEqual(encode_qr_payload(self.document), payload)
+
+    def test_committed_or_missing_key_refuses_to_sign(self):
+        from django.conf import settings
+
+        for key in ("", settings.SECRET_KEY, "django-insecure-" + "x" * 40, "short"):
+            with override_settings(DOCUMENT_SIGNING_KEY=key):
+                with self.assertRaises(SigningKeyMissing):
+                    encode_qr_payload(self.document)
+        # A payload signed with the committed SECRET_KEY, as anyone could, is not ours.
+        message = encode_qr_payload(self.document).rpartition(".")[0]
+        forged = f"{message}.{qr_payload._signature(message, settings.SECRET_KEY)}"
+        self.assertEqual(self.verify(forged)["status"], "invalid")
+
+    def test_hash_prefix_must_name_the_current_file_or_a_revision(self):
+        payload = encode_qr_payload(self.document)
+        self.assertEqual(self.verify(payload)["status"], "valid")
+
+        Document.objects.filter(pk=self.document.pk).update(file_hash="cd" * 32)
+        verification_cache.clear()
+        self.assertEqual(self.verify(payload)["status"], "invalid")
+
+        self.document.revisions.create(number=1, file_hash="ab" * 32, size=10)
+        data = self.verify(payload)
+        self.assertEqual(data["status"], "valid")
+        self.assertIn("revision 1", data["message"])
+
+    def test_a_new_file_re_issues_the_payload(self):
+        self.document.generate_qr_code()
+        self.document.save(update_fields=["qr_payload"])
+        self.document.file = SimpleUploadedFile("b.pdf", b"%PDF-1.4 other bytes", "application/pdf")
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media, DOCUMENT_DEFERRED_STAGES=(), DOCUMENT_TILE_PRERENDER=False):
+            self.document.save()
+        document = Document.objects.get(pk=self.document.pk)
+        self.assertEqual(decode_qr_payload(document.qr_payload).hash_prefix, document.file_hash[:16])
+
+
+def sha256_hex(text):
+    import hashlib
+
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class MerkleTreeTests(TestCase):
+    def test_every_proof_leads_to_the_root(self):
+        for count in range(1, 18):
+            hashes = [sha256_hex(str(i)) for i in range(count)]
+            root, proofs = build_tree(hashes)
+            for file_hash, proof in zip(hashes, proofs):
+                self.assertEqual(root_from_proof(file_hash, proof), root)
+            self.assertLessEqual(max(len(proof) for proof in proofs), max(count - 1, 0).bit_length())
+
+    def test_a_node_without_a_sibling_is_carried_up(self):
+        a, b, c = (sha256_hex(x) for x in "abc")
+        root, proofs = build_tree([a, b, c])
+        ab = node_hash(leaf_hash(a), leaf_hash(b))
+        self.assertEqual(root, node_hash(ab, leaf_hash(c)).hex())  # c is not paired with itself
+        self.assertEqual(proofs[2], [["l", ab.hex()]])
+        self.assertEqual(build_tree([a]), (leaf_hash(a).hex(), [[]]))
+
+    def test_a_tampered_proof_or_hash_misses_the_root(self):
+        hashes = [sha256_hex(str(i)) for i in range(5)]
+        root, proofs = build_tree(hashes)
+        side, sibling = proofs[1][0]
+        tampered = [[side, "00" * 32]] + proofs[1][1:]
+        self.assertNotEqual(root_from_proof(hashes[1], tampered), root)
+        self.assertNotEqual(root_from_proof(hashes[2], proofs[1]), root)
+        flipped = [["r" if side == "l" else "l", sibling]] + proofs[1][1:]
+        self.assertNotEqual(root_from_proof(hashes[1], flipped), root)
+
+
+@override_settings(DOCUMENT_SIGNING_KEY=SIGNING_KEY, DOCUMENT_SIGNING_KEY_FALLBACKS=[])
+class AnchorVerificationTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        Document.objects.bulk_create([
+            Document(user=user, file=f"documents/{i}.pdf", file_hash=sha256_hex(str(i)), serial_number=f"S{i}")
+            for i in range(3)
+        ])
+        self.batch = anchor_pending()
+
+    def document(self, serial="S1"):
+        return Document.objects.select_related("anchor_batch").get(serial_number=serial)
+
+    def test_anchored_documents_verify(self):
+        self.assertEqual(self.batch.leaf_count, 3)
+        for serial in ("S0", "S1", "S2"):
+            self.assertEqual(verify_anchor(self.document(serial)), self.batch)
+
+    def test_a_changed_hash_or_proof_fails(self):
+        document = self.document()
+        document.file_hash = sha256_hex("other")
+        with self.assertRaises(AnchorError):
+            verify_anchor(document)
+        document = self.document()
+        document.anchor_proof = [["l", "00" * 32]] + document.anchor_proof[1:]
+        with self.assertRaises(AnchorError):
+            verify_anchor(document)
+
+    def test_a_root_re_signed_without_the_signing_key_fails(self):
+        from django.conf import settings
+
+        # What anyone with the repository and database access could do.
+        self.batch.signature = sign_root(self.batch.root, settings.SECRET_KEY)
+        self.batch.save()
+        with self.assertRaisesMessage(AnchorError, "signature"):
+            verify_anchor(self.document())
+
+    def test_legacy_batches_are_re_signed(self):
+        from django.conf import settings
+
+        self.batch.signature = sign_root(self.batch.root, settings.SECRET_KEY)
+        self.batch.save()
+        self.assertEqual(resign_legacy_batches(), (1, 0))
+        self.assertEqual(verify_anchor(self.document()), self.batch)
+        self.assertEqual(resign_legacy_batches(), (0, 1))
+
+    def test_nothing_is_anchored_without_a_signing_key(self):
+        Document.objects.filter(pk=self.document().pk).update(anchor_batch=None, anchor_proof=None)
+        with override_settings(DOCUMENT_SIGNING_KEY=""):
+            with self.assertRaises(SigningKeyMissing):
+                anchor_pending()
+        self.assertIsNone(self.document().anchor_batch)
+
+
+class RenderCacheTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        stamp_render_cache.clear()
+        self.addCleanup(stamp_render_cache.clear)
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        self.stamp = Stamp.objects.create(
+            user=user, shape="Circle", shape_color="#1144aa", text_color="#aa0000",
+            date_color="#000000", date=date(2026, 10, 18), top_text="Faculty",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def render_dir(self, stamp):
+        return os.path.join(stamp_render_cache.directory, appearance_digest(stamp))
+
+    def test_an_appearance_is_rendered_once(self):
+        cache = RenderedStampCache(directory=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, cache.directory, ignore_errors=True)
+        twin = Stamp(**{field: getattr(self.stamp, field) for field in APPEARANCE_FIELDS})
+        with mock.patch("stamps.render_cache._render", wraps=render_cache._render) as render:
+            first = cache.get(self.stamp, "png", 64)
+            self.assertEqual(cache.get(twin, "png", 64), first)
+            cache.clear()
+            self.assertEqual(cache.get(self.stamp, "png", 64), first)
+            cache.get(self.stamp, "png", 32)
+        self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (1, 1, 2))
+        self.assertEqual(render.call_count, 2)
+
+    def test_only_appearance_fields_change_the_digest(self):
+        digest = appearance_digest(self.stamp)
+        self.stamp.created_at = None
+        self.assertEqual(appearance_digest(self.stamp), digest)
+        self.stamp.top_text = "Registry"
+        self.assertNotEqual(appearance_digest(self.stamp), digest)
+
+    def test_updating_a_stamp_drops_its_old_renders(self):
+        old = stamp_render_cache.get(self.stamp, "png", 64)
+        old_dir = self.render_dir(self.stamp)
+        self.assertTrue(os.path.isdir(old_dir))
+
+        response = self.client.patch(f"/stamps/stamps/{self.stamp.pk}/", {"top_text": "Registry"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(old_dir))
+        self.stamp.refresh_from_db()
+        self.assertNotEqual(stamp_render_cache.get(self.stamp, "png", 64), old)
+
+    def test_deleting_a_stamp_drops_its_renders(self):
+        stamp_render_cache.get(self.stamp, "pdf")
+        render_dir = self.render_dir(self.stamp)
+        self.assertEqual(self.client.delete(f"/stamps/stamps/{self.stamp.pk}/").status_code, 204)
+        self.assertFalse(os.path.exists(render_dir))
+        self.assertFalse(any(key[0] == os.path.basename(render_dir) for key in stamp_render_cache._entries))
+
+
+class UploadDigestTests(TestCase):
+    data = b"%PDF-1.7 " + os.urandom(4096)
+
+    def parse(self, data=None):
+        request = RequestFactory().post(
+            "/", {"file": SimpleUploadedFile("a.pdf", data or self.data, "application/pdf")},
+        )
+        request.upload_handlers = hashing_upload_handlers(request)
+        return request.FILES["file"]
+
+    def test_small_uploads_are_hashed_in_memory(self):
+        uploaded = self.parse()
+        self.assertIsInstance(uploaded, InMemoryUploadedFile)
+        self.assertEqual(uploaded.sha256, hashlib.sha256(self.data).hexdigest())
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024, UPLOAD_DIGEST_ALGORITHMS=["md5", "sha256"])
+    def test_large_uploads_are_hashed_on_their_way_to_disk(self):
+        uploaded = self.parse()
+        self.assertIsInstance(uploaded, TemporaryUploadedFile)
+        self.assertEqual(uploaded.digests, {
+            "sha256": hashlib.sha256(self.data).hexdigest(), "md5": hashlib.md5(self.data).hexdigest(),
+        })
+
+    def test_files_without_a_digest_are_hashed_when_asked(self):
+        uploaded = SimpleUploadedFile("a.pdf", self.data)
+        self.assertEqual(uploaded_sha256(uploaded), hashlib.sha256(self.data).hexdigest())
+        uploaded.sha256 = "f" * 64
+        self.assertEqual(uploaded_sha256(uploaded), "f" * 64)  # trusted, not recomputed
+
+    def test_a_document_upload_is_not_read_again_to_hash_it(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        pdf = fitz.open()
+        pdf.new_page().insert_text((72, 72), "Transcript")
+        data = pdf.tobytes()
+        client = APIClient()
+        client.force_authenticate(
+            CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        )
+        with override_settings(MEDIA_ROOT=media, TASKS_EAGER=True, DOCUMENT_TILE_PRERENDER=False,
+                               DOCUMENT_SIGNING_KEY=SIGNING_KEY), \
+                mock.patch("stamps.signals.document_hash_filter"), \
+                mock.patch.object(ContentAddressedStorage, "content_digest",
+                                  wraps=ContentAddressedStorage.content_digest) as content_digest:
+            response = client.post(
+                "/stamps/documents/", {"file": SimpleUploadedFile("t.pdf", data, "application/pdf")},
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Document.objects.get().file_hash, hashlib.sha256(data).hexdigest())
+        (uploaded,), _ = content_digest.call_args  # the storage got the digest with the file
+        self.assertEqual(uploaded.sha256, hashlib.sha256(data).hexdigest())
+
+
+class QRDecodeTests(TestCase):
+    def setUp(self):
+        qr_decode_stats.reset()
+        self.addCleanup(qr_decode_stats.reset)
+        buffer = io.BytesIO()
+        Image.new("RGB", (2000, 1500), "white").save(buffer, format="JPEG")
+        self.photo = buffer.getvalue()
+
+    def zbar_finding(self, payloads_by_attempt):
+        """zbar that reads payloads_by_attempt[n] (a list of strings) on its n-th call, nothing otherwise."""
+        calls = iter(range(10 ** 6))
+
+        def decode(image, symbols=None):
+            return [mock.Mock(data=payload.encode()) for payload in payloads_by_attempt.get(next(calls), [])]
+
+        return mock.patch("stamps.qr.zbar_decode", side_effect=decode)
+
+    def test_stages_run_cheapest_first(self):
+        stages = [stage for stage, _ in qr._attempts(self.photo)]
+        per_level = 1 + len(qr.REGIONS) + len(qr.ROTATIONS)
+        self.assertEqual(len(stages), per_level * 3)
+        self.assertEqual(stages[0], "800px/whole")
+        self.assertEqual(stages[per_level], "1600px/whole")
+        self.assertEqual(stages[-1], f"full/rotate-{qr.ROTATIONS[-1]}")
+        # A photo smaller than a level is not tried again at it.
+        small = io.BytesIO()
+        Image.new("L", (600, 400), 255).save(small, format="PNG")
+        self.assertEqual(len(list(qr._attempts(small.getvalue()))), per_level)
+
+    def test_the_first_accepted_payload_wins(self):
+        with self.zbar_finding({0: ["someone else's QR"], 2: ["ours", "ours too"]}):
+            result = qr.decode_qr(self.photo, is_valid=lambda payload: payload.startswith("ours"))
+        self.assertEqual((result.payload, result.stage, result.attempts), ("ours", "800px/roi-bottom-left", 3))
+        self.assertEqual(qr_decode_stats.snapshot()["by_stage"], {"800px/roi-bottom-left": 1})
+
+    def test_a_rotated_code_is_found_by_the_rotation_stage(self):
+        with self.zbar_finding({1 + len(qr.REGIONS): ["ours"]}):
+            result = qr.decode_qr(self.photo)
+        self.assertEqual(result.stage, f"800px/rotate-{qr.ROTATIONS[0]}")
+
+    def test_a_photo_without_a_code_tries_every_stage(self):
+        with self.zbar_finding({}):
+            result = qr.decode_qr(self.photo)
+        self.assertIsNone(result.payload)
+        self.assertEqual(result.attempts, 3 * (1 + len(qr.REGIONS) + len(qr.ROTATIONS)))
+        self.assertEqual(qr_decode_stats.snapshot()["misses"], 1)
+
+    def test_a_slow_decode_times_out_and_stops(self):
+        started, stopped = threading.Event(), threading.Event()
+
+        def slow(image_bytes, is_valid, cancelled):
+            started.set()
+            if cancelled.wait(5):
+                stopped.set()
+
+        with mock.patch("stamps.qr._decode", side_effect=slow):
+            with self.assertRaises(qr.QRDecodeTimeout):
+                qr.decode_qr(self.photo, timeout=0.05)
+        self.assertTrue(started.is_set())
+        self.assertTrue(stopped.wait(5))
+        self.assertEqual(qr_decode_stats.snapshot()["timeouts"], 1)
+
+    def test_a_busy_decoder_refuses_more_work(self):
+        with mock.patch("stamps.qr._slots", threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            with self.assertRaisesMessage(qr.QRDecodeTimeout, "busy"):
+                qr.decode_qr(self.photo, timeout=0.01)
+
+    def test_pdf_pages_are_scanned_first_last_then_the_rest(self):
+        self.assertEqual(page_order(1), [0])
+        self.assertEqual(page_order(4), [0, 3, 1, 2])
+
+
+class DocumentListingTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        other = CustomUser.objects.create_user(username="other", email="other@example.com", password="pw")
+        Document.objects.bulk_create([
+            Document(user=user, file=f"documents/{user.username}{i}.pdf", file_hash=f"{i:x}{user.pk}".ljust(64, "0"),
+                     serial_number=f"{user.username}-{i}")
+            for user in (self.user, other) for i in range(7)
+        ])
+        # Two share a timestamp, so ties are broken by id.
+        base = timezone.now()
+        for i, document in enumerate(Document.objects.filter(user=self.user).order_by("id")):
+            Document.objects.filter(pk=document.pk).update(created_at=base + timedelta(minutes=min(i, 5)))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def expected_order(self):
+        return list(Document.objects.filter(user=self.user).order_by("-created_at", "-id").values_list("id", flat=True))
+
+    def test_pages_follow_the_cursor_newest_first(self):
+        ids, url, pages = [], "/stamps/documents/?page_size=3", 0
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn("count", data)
+            ids += [document["id"] for document in data["results"]]
+            url, pages = data["next"], pages + 1
+        self.assertEqual(ids, self.expected_order())
+        self.assertEqual(pages, 3)
+
+    def test_a_page_costs_the_same_deep_in_the_list(self):
+        first = self.client.get("/stamps/documents/?page_size=2").json()
+        with CaptureQueriesContext(connection) as shallow:
+            self.client.get("/stamps/documents/?page_size=2")
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get(first["next"])
+        self.assertEqual(len(deep), len(shallow))
+        self.assertFalse(any("COUNT(" in query["sql"] or "OFFSET" in query["sql"] for query in deep))
+
+    def test_fields_limits_the_output_and_the_columns_loaded(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get("/stamps/documents/?fields=id,serial_number&page_size=3").json()
+        self.assertEqual([set(document) for document in data["results"]], [{"id", "serial_number"}] * 3)
+        listing = next(query["sql"] for query in queries if '"stamps_document"' in query["sql"])
+        self.assertNotIn("file_hash", listing)
+        self.assertIn("created_at", listing)  # the cursor still needs it
+        following = self.client.get(data["next"]).json()["results"]
+        self.assertEqual([d["id"] for d in data["results"] + following], self.expected_order()[:6])
+
+    def test_computed_fields_load_what_they_read(self):
+        data = self.client.get("/stamps/documents/?fields=qr_url").json()
+        self.assertTrue(all(document["qr_url"].endswith("/qr.png") for document in data["results"]))
+
+    def test_unknown_fields_are_refused(self):
+        response = self.client.get("/stamps/documents/?fields=id,owner_password")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["fields"], ["Unknown field: owner_password"])
+
+
+class DocumentTileTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        overrides = override_settings(
+            MEDIA_ROOT=media, DOCUMENT_TILE_DIR=os.path.join(media, "tiles"), TASKS_EAGER=True,
+            DOCUMENT_TILE_PRERENDER=False, DOCUMENT_TILE_MAX_ZOOM=2.0, DOCUMENT_SIGNING_KEY=SIGNING_KEY,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        hash_filter = mock.patch("stamps.signals.document_hash_filter")
+        hash_filter.start()
+        self.addCleanup(hash_filter.stop)
+        user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        pdf = fitz.open()
+        pdf.new_page(width=595, height=842).insert_text((72, 72), "Portrait")
+        pdf.new_page(width=842, height=595).insert_text((72, 72), "Landscape")
+        self.document = Document(user=user, file=SimpleUploadedFile("a.pdf", pdf.tobytes(), "application/pdf"))
+        self.document.save()
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def get_tile(self, page, level, col, row, version=None):
+        version = version or self.document.file_hash[:16]
+        return self.client.get(f"/stamps/documents/{self.document.pk}/tiles/{version}/{page}/{level}/{col}_{row}.png/")
+
+    def tile_size(self, response):
+        return Image.open(io.BytesIO(response.content)).size
+
+    def test_the_manifest_describes_every_page_and_level(self):
+        data = self.client.get(f"/stamps/documents/{self.document.pk}/tiles/").json()
+        # 842 pt at 2x is 1684 px: one 256 px tile at level 0 (x0.25), up to 7 rows at level 3.
+        self.assertEqual([level["zoom"] for level in data["levels"]], [0.25, 0.5, 1.0, 2.0])
+        self.assertEqual(data["pages"], [{"number": 1, "width": 595, "height": 842},
+                                         {"number": 2, "width": 842, "height": 595}])
+        url = data["url"].format(page=1, level=0, col=0, row=0).replace("http://testserver", "")
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_edge_tiles_are_cut_to_the_page(self):
+        self.assertEqual(self.tile_size(self.get_tile(1, 3, 0, 0)), (256, 256))
+        self.assertEqual(self.tile_size(self.get_tile(1, 3, 4, 6)), (1190 - 4 * 256, 1684 - 6 * 256))
+        self.assertEqual(self.tile_size(self.get_tile(2, 0, 0, 0)), (211, 149))
+
+    def test_tiles_outside_the_pyramid_are_not_found(self):
+        for page, level, col, row in ((1, 3, 5, 0), (1, 3, 0, 7), (2, 3, 0, 5), (1, 4, 0, 0), (3, 0, 0, 0), (0, 0, 0, 0)):
+            with self.subTest(page=page, level=level, col=col, row=row):
+                self.assertEqual(self.get_tile(page, level, col, row).status_code, 404)
+        self.assertFalse(os.path.exists(os.path.join(tile_directory(self.document.file_hash), "1", "3", "5_0.png")))
+
+    def test_a_tile_url_names_one_version_of_the_file(self):
+        response = self.get_tile(1, 0, 0, 0)
+        self.assertEqual(response["Cache-Control"], "private, max-age=31536000, immutable")
+        self.assertEqual(self.get_tile(1, 0, 0, 0, version="0" * 16).status_code, 404)
+
+    def test_a_tile_is_rendered_once(self):
+        first = self.get_tile(1, 2, 1, 1).content
+        with mock.patch.object(DocumentTiles, "_open") as open_pdf:
+            self.assertEqual(self.get_tile(1, 2, 1, 1).content, first)
+        open_pdf.assert_not_called()
+
+    @override_settings(DOCUMENT_TILE_PRERENDER_MAX_TILES=4)
+    def test_prerendering_covers_page_one_and_the_overview_of_the_rest(self):
+        # Page 1 at every level (1 + 2x2 + 3x4 + 5x7 tiles); page 2 stops at the first level over 4 tiles.
+        written = DocumentTiles(self.document).prerender()
+        self.assertEqual(written, (1 + 2 * 2 + 3 * 4 + 5 * 7) + (1 + 2 * 2))
+        self.assertEqual(DocumentTiles(self.document).prerender(), 0)
+
+
+class StampPreviewTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        stamp_render_cache.clear()
+        self.addCleanup(stamp_render_cache.clear)
+        self.user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="pw")
+        self.stamps = [
+            Stamp.objects.create(
+                user=self.user, shape=shape, shape_color="#1144aa", text_color="#aa0000",
+                date_color="#000000", date=date(2026, 10, 18), top_text=shape,
+            )
+            for shape in ("Circle", "Rectangle", "Oval")
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def preview_url(self, stamp):
+        """The versioned URL the stamp list hands out."""
+        data = self.client.get(f"/stamps/stamps/{stamp.pk}/").json()
+        return data["preview_url"].replace("http://testserver", "")
+
+    def test_a_preview_is_the_stamp_at_the_requested_height(self):
+        stamp = self.stamps[0]
+        response = self.client.get(f"/stamps/stamps/{stamp.pk}/preview.png/?size=64")
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(Image.open(io.BytesIO(response.content)).height, 64)
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+        svg = self.client.get(f"/stamps/stamps/{stamp.pk}/preview.svg/")
+        self.assertEqual(svg["Content-Type"], "image/svg+xml")
+        self.assertIn(b"<svg", svg.content)
+
+    def test_versioned_previews_are_immutable_and_revalidate(self):
+        response = self.client.get(self.preview_url(self.stamps[0]))
+        self.assertEqual(response["Cache-Control"], "private, max-age=31536000, immutable")
+        again = self.client.get(self.preview_url(self.stamps[0]), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        old = self.preview_url(self.stamps[0])
+        self.client.patch(f"/stamps/stamps/{self.stamps[0].pk}/", {"top_text": "Registry"}, format="json")
+        self.assertNotEqual(self.preview_url(self.stamps[0]), old)
+        self.assertEqual(self.client.get(old)["Cache-Control"], "private, no-cache")  # no longer current
+
+    def test_previews_are_refused_outside_the_size_bounds(self):
+        for size in (8, 2048, "big"):
+            with self.subTest(size=size):
+                response = self.client.get(f"/stamps/stamps/{self.stamps[0].pk}/preview.png/?size={size}")
+                self.assertEqual(response.status_code, 400)
+
+    def test_other_users_stamps_have_no_preview(self):
+        other = CustomUser.objects.create_user(username="other", email="other@example.com", password="pw")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(f"/stamps/stamps/{self.stamps[0].pk}/preview.png/").status_code, 404)
+
+    def test_the_sprite_sheet_matches_its_atlas(self):
+        atlas = self.client.get("/stamps/stamps/sprite.json/?size=64").json()
+        self.assertEqual(set(atlas["frames"]), {str(stamp.pk) for stamp in self.stamps})
+        sheet = self.client.get(atlas["image"].replace("http://testserver", ""))
+        self.assertEqual(sheet["Cache-Control"], "private, max-age=31536000, immutable")
+        image = Image.open(io.BytesIO(sheet.content))
+        self.assertEqual(image.size, (atlas["width"], atlas["height"]))
+        for stamp in self.stamps:
+            frame = atlas["frames"][str(stamp.pk)]
+            self.assertEqual(frame["h"], 64)
+            self.assertLessEqual(frame["x"] + frame["w"], atlas["width"])
+            alone = Image.open(io.BytesIO(stamp_render_cache.get(stamp, "png", 64)))
+            crop = image.crop((frame["x"], frame["y"], frame["x"] + frame["w"], frame["y"] + frame["h"]))
+            self.assertEqual(crop.tobytes(), alone.convert(image.mode).tobytes())
+
+    def test_the_sprite_wraps_and_changes_with_the_library(self):
+        with mock.patch("stamps.render_cache.SPRITE_MAX_WIDTH", 100):
+            atlas = self.client.get("/stamps/stamps/sprite.json/?size=64").json()
+        self.assertEqual(sorted({frame["y"] for frame in atlas["frames"].values()}), [0, 66, 132])
+        self.stamps[-1].delete()
+        changed = self.client.get("/stamps/stamps/sprite.json/?size=64").json()
+        self.assertNotEqual(changed["image"], atlas["image"])
+        self.assertEqual(len(changed["frames"]), 2)
@@ -0,0 +1,195 @@
+# stamps/tiles.py
+"""
+Deep-zoom tile pyramid of a Document's pages, so the stamping canvas shows
+page 1 at once and fetches only the tiles in view instead of the whole PDF.
+
+Each page is rendered at a series of zoom levels, every level twice the
+previous one, from level 0 (the whole page fits in one tile) up to
+DOCUMENT_TILE_MAX_ZOOM. Level L is cut into TILE_SIZE x TILE_SIZE PNG tiles,
+column by row; tiles at the right and bottom edges are smaller.
+
+Tiles are cached on disk by the file's SHA-256, so they never change for a
+given key and are served as immutable:
+
+    DOCUMENT_TILE_DIR/<file_hash>/manifest.json
+    DOCUMENT_TILE_DIR/<file_hash>/<page>/<level>/<col>_<row>.png
+
+Uploading a document queues a task that pre-renders the overview levels of
+every page (DOCUMENT_TILE_PRERENDER_MAX_TILES tiles or fewer) and all of
+page 1; any other tile is rendered the first time it is asked for.
+"""
+import json
+import math
+import os
+import shutil
+import tempfile
+
+import fitz  # PyMuPDF
+from django.conf import settings
+
+TILE_SIZE = 256
+
+
+class TileError(Exception):
+    """The requested page, level or tile does not exist."""
+
+
+def tile_directory(file_hash):
+    root = getattr(settings, "DOCUMENT_TILE_DIR", None) or os.path.join(settings.BASE_DIR, "var", "document_tiles")
+    return os.path.join(root, file_hash)
+
+
+def _write(path, data):
+    # Write to a temp file and rename so readers never see a partial tile.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _level_count(pdf):
+    """Levels needed for the largest page to go from one tile to DOCUMENT_TILE_MAX_ZOOM."""
+    max_zoom = getattr(settings, "DOCUMENT_TILE_MAX_ZOOM", 2.0)
+    largest = max((max(page.rect.width, page.rect.height) for page in pdf), default=TILE_SIZE)
+    return max(1, math.ceil(math.log2(max(largest * max_zoom / TILE_SIZE, 1))) + 1)
+
+
+def level_zoom(level, levels):
+    max_zoom = getattr(settings, "DOCUMENT_TILE_MAX_ZOOM", 2.0)
+    return max_zoom / 2 ** (levels - 1 - level)
+
+
+def grid(width, height, zoom):
+    """(columns, rows) of a page of `width` x `height` points at `zoom`."""
+    return (
+        max(1, math.ceil(width * zoom / TILE_SIZE)),
+        max(1, math.ceil(height * zoom / TILE_SIZE)),
+    )
+
+
+class DocumentTiles:
+    """Tile pyramid of one document file (identified by its hash)."""
+
+    def __init__(self, document):
+        if not document.file or not document.file_hash:
+            raise TileError("The document has no file to render.")
+        self.document = document
+        self.directory = tile_directory(document.file_hash)
+
+    def _open(self):
+        # By path, so MuPDF reads the objects a tile needs rather than the whole file.
+        try:
+            path = self.document.file.path
+        except NotImplementedError:  # a storage without local files
+            with self.document.file.open("rb") as f:
+                return fitz.open("pdf", f.read())
+        return fitz.open(path, filetype="pdf")
+
+    # ---------------- manifest ----------------
+
+    def manifest(self):
+        """Page sizes (points) and zoom levels; computed once per file, then read from disk."""
+        path = os.path.join(self.directory, "manifest.json")
+        try:
+            with open(path, "rb") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        pdf = self._open()
+        try:
+            manifest = self._build_manifest(pdf)
+        finally:
+            pdf.close()
+        _write(path, json.dumps(manifest).encode("utf-8"))
+        return manifest
+
+    def _build_manifest(self, pdf):
+        levels = _level_count(pdf)
+        return {
+            "tile_size": TILE_SIZE,
+            "format": "png",
+            "levels": [{"level": level, "zoom": level_zoom(level, levels)} for level in range(levels)],
+            "pages": [
+                {"number": page.number + 1, "width": round(page.rect.width, 2), "height": round(page.rect.height, 2)}
+                for page in pdf
+            ],
+        }
+
+    # ---------------- tiles ----------------
+
+    def _tile_path(self, page, level, col, row):
+        return os.path.join(self.directory, str(page), str(level), f"{col}_{row}.png")
+
+    def _check(self, manifest, page, level, col, row):
+        if not 1 <= page <= len(manifest["pages"]):
+            raise TileError(f"Page {page} does not exist.")
+        if not 0 <= level < len(manifest["levels"]):
+            raise TileError(f"Level {level} does not exist.")
+        size = manifest["pages"][page - 1]
+        columns, rows = grid(size["width"], size["height"], manifest["levels"][level]["zoom"])
+        if not (0 <= col < columns and 0 <= row < rows):
+            raise TileError(f"Tile {col}_{row} is outside level {level} of page {page}.")
+
+    def _render(self, pdf_page, zoom, col, row):
+        rect = pdf_page.rect
+        span = TILE_SIZE / zoom  # points covered by one tile
+        clip = fitz.Rect(
+            rect.x0 + col * span,
+            rect.y0 + row * span,
+            min(rect.x0 + (col + 1) * span, rect.x1),
+            min(rect.y0 + (row + 1) * span, rect.y1),
+        )
+        pixmap = pdf_page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+        return pixmap.tobytes("png")
+
+    def tile(self, page, level, col, row):
+        """PNG bytes of one tile, rendered and stored on the first request."""
+        manifest = self.manifest()
+        self._check(manifest, page, level, col, row)
+        path = self._tile_path(page, level, col, row)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        pdf = self._open()
+        try:
+            data = self._render(pdf[page - 1], manifest["levels"][level]["zoom"], col, row)
+        finally:
+            pdf.close()
+        _write(path, data)
+        return data
+
+    def prerender(self):
+        """
+        Renders the overview levels of every page and every level of page 1,
+        opening the PDF once. Returns the number of tiles written.
+        """
+        budget = getattr(settings, "DOCUMENT_TILE_PRERENDER_MAX_TILES", 4)
+        pdf = self._open()
+        written = 0
+        try:
+            manifest = self._build_manifest(pdf)
+            _write(os.path.join(self.directory, "manifest.json"), json.dumps(manifest).encode("utf-8"))
+            for pdf_page in pdf:
+                number = pdf_page.number + 1
+                for level in manifest["levels"]:
+                    columns, rows = grid(pdf_page.rect.width, pdf_page.rect.height, level["zoom"])
+                    if number != 1 and columns * rows > budget:
+                        break  # deeper levels only grow
+                    for col in range(columns):
+                        for row in range(rows):
+                            path = self._tile_path(number, level["level"], col, row)
+                            if not os.path.exists(path):
+                                _write(path, self._render(pdf_page, level["zoom"], col, row))
+                                written += 1
+        finally:
+            pdf.close()
+        return written
+
+
+def discard_tiles(file_hash):
+    """Removes the cached pyramid of a file no document uses any more."""
+    if file_hash:
+        shutil.rmtree(tile_directory(file_hash), ignore_errors=True)
@@ -1,11 +1,19 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
+from rest_framework.permissions import AllowAny
 from rest_framework.routers import DefaultRouter
-from .views import StampViewSet, DocumentViewSet
+from .views import StampViewSet, DocumentViewSet, StampJobViewSet
 
 router = DefaultRouter()
 router.register('stamps', StampViewSet, basename='stamp')
 router.register('documents', DocumentViewSet, basename='document')
+router.register('jobs', StampJobViewSet, basename='stamp-job')
 
 urlpatterns = [
+    # An image URL, so no trailing slash (the router would add one).
+    re_path(
+        r'^documents/(?P<pk>[^/.]+)/qr\.(?P<fmt>png|svg)$',
+        DocumentViewSet.as_view({'get': 'qr_image'}, permission_classes=[AllowAny]),
+        name='document-qr-image',
+    ),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,138 @@
+# stamps/verify_cache.py
+"""
+Cache of verify-document results, so the same certificate verified over and
+over is answered from memory.
+
+Two layers, both in the VERIFY_CACHE_ALIAS cache:
+
+  digest  SHA-256 of the upload -> the full {status, isVerified, message}
+          response, so a repeated file skips hashing, QR decoding and queries
+  serial  (document id, serial) -> what the database said about it, shared
+          by every photo or scan of the same certificate's QR code
+
+Invalidation is driven by Document post_save/post_delete (stamps/signals.py)
+and must reach every process, so the cache has to be shared: by default a
+file-based cache under var/, which all web and task worker processes on the
+host use (point it at Redis or Memcached across hosts). The document's
+current and previous hash and serial are dropped, and its generation token
+is replaced: a digest entry whose result named the document carries the
+token it was cached under and is ignored once that changes. Replacing the
+token is a single write, so concurrent verifies cannot lose an invalidation
+the way a shared list of dependent keys could. Results that named no
+document (unknown file) use a shorter timeout, since a later upload could
+change them in ways no single key captures.
+"""
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+PREFIX = "verify"
+
+
+class VerificationCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "VERIFY_CACHE_ALIAS", "verification")]
+
+    def _timeout(self, positive):
+        if positive:
+            return getattr(settings, "VERIFY_CACHE_TIMEOUT", 300)
+        return getattr(settings, "VERIFY_CACHE_NEGATIVE_TIMEOUT", 60)
+
+    # ---------------- stats ----------------
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"digest": {"hits": 0, "misses": 0}, "serial": {"hits": 0, "misses": 0}}
+
+    def _count(self, layer, hit):
+        with self._lock:
+            self.stats[layer]["hits" if hit else "misses"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for layer, counts in self.stats.items():
+                total = counts["hits"] + counts["misses"]
+                snapshot[layer] = {**counts, "hit_rate": round(counts["hits"] / total, 4) if total else None}
+            return snapshot
+
+    # ---------------- digest layer ----------------
+
+    def _digest_key(self, digest):
+        return f"{PREFIX}:digest:{digest}"
+
+    def _generation_key(self, document_id):
+        return f"{PREFIX}:generation:{document_id}"
+
+    def _generation(self, document_id):
+        key = self._generation_key(document_id)
+        generation = self.cache.get(key)
+        if generation is None:
+            # Evicted or never set: a new token only turns older entries into misses.
+            self.cache.add(key, uuid.uuid4().hex, None)
+            generation = self.cache.get(key)
+        return generation
+
+    def get_result(self, digest):
+        """Returns (data, status_code, document_id) cached for an upload digest, or None."""
+        entry = self.cache.get(self._digest_key(digest))
+        if entry is not None:
+            data, status_code, document_id, generation = entry
+            if document_id is not None and generation != self.cache.get(self._generation_key(document_id)):
+                entry = None  # the document changed since
+        self._count("digest", entry is not None)
+        return entry[:3] if entry is not None else None
+
+    def set_result(self, digest, data, status_code, document_id=None):
+        """Caches a response; error responses are not cached."""
+        if data.get("status") == "error":
+            return
+        generation = self._generation(document_id) if document_id is not None else None
+        self.cache.set(
+            self._digest_key(digest), (data, status_code, document_id, generation),
+            self._timeout(positive=document_id is not None),
+        )
+
+    # ---------------- serial layer ----------------
+
+    def _serial_key(self, document_id, serial_number, kind):
+        return f"{PREFIX}:serial:{document_id}:{serial_number}:{kind}"
+
+    def get_record(self, document_id, serial_number, kind, load):
+        """
+        What the database says about (document_id, serial_number), from the
+        cache or else from `load()`. `kind` names what `load` returns.
+        """
+        key = self._serial_key(document_id, serial_number, kind)
+        missing = object()
+        record = self.cache.get(key, missing)
+        self._count("serial", record is not missing)
+        if record is missing:
+            record = load()
+            self.cache.set(key, record, self._timeout(positive=bool(record)))
+        return record
+
+    # ---------------- invalidation ----------------
+
+    def invalidate_document(self, document, old_hash=None, old_serial=None):
+        self.cache.set(self._generation_key(document.pk), uuid.uuid4().hex, None)
+        keys = set()
+        for file_hash in {document.file_hash, old_hash} - {None, ""}:
+            keys.add(self._digest_key(file_hash))
+        for serial_number in {document.serial_number, old_serial} - {None, ""}:
+            for kind in ("current", "record"):
+                keys.add(self._serial_key(document.pk, serial_number, kind))
+        self.cache.delete_many(list(keys))
+
+    def clear(self):
+        self.cache.clear()
+
+
+verification_cache = VerificationCache()
@@ -0,0 +1,193 @@
+# stamps/verify_log.py
+"""
+Append-only log of verify-document results, and hourly/daily rollups of it.
+
+Recording an event never touches the database on the request path: the
+event is appended to an in-memory buffer, and a background thread per
+process bulk-inserts the buffer every VERIFY_LOG_FLUSH_INTERVAL seconds,
+or as soon as VERIFY_LOG_BATCH_SIZE events are waiting. If the database
+is unavailable the events stay buffered for the next flush; beyond
+VERIFY_LOG_MAX_PENDING new events are dropped (and counted) rather than
+growing without bound. Events naming a document deleted before the flush
+are written without it. Whatever is buffered is flushed at exit, but a
+crash loses up to one interval of events.
+
+`manage.py rollup_verifications` (hourly) turns events into one
+VerificationRollup row per document and hour/day, and prunes events older
+than VERIFY_LOG_RETENTION_DAYS, which the rollups already summarise.
+"""
+import atexit
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.db.models import Count, Max, Q
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import VerificationEvent, VerificationRollup
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"hour": TruncHour, "day": TruncDay}
+
+
+def client_address(request):
+    """The client IP; taken from X-Forwarded-For only when VERIFY_LOG_FORWARDED_FOR says a proxy sets it."""
+    if getattr(settings, "VERIFY_LOG_FORWARDED_FOR", False):
+        forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "")
+        if forwarded:
+            return forwarded.split(",")[0].strip() or None
+    return request.META.get("REMOTE_ADDR") or None
+
+
+class VerificationEventLog:
+    """Per-process buffer of VerificationEvent rows, bulk-inserted by a background thread."""
+
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.dropped = 0
+
+    def record(self, request, status, document_id=None, endpoint="document", cached=False):
+        if not getattr(settings, "VERIFY_LOG_ENABLED", True):
+            return
+        try:
+            document_id = int(document_id) if document_id is not None else None
+        except (TypeError, ValueError):
+            document_id = None
+        event = VerificationEvent(
+            document_id=document_id, status=status, endpoint=endpoint, cached=cached,
+            ip_address=client_address(request),
+            user_agent=request.META.get("HTTP_USER_AGENT", "")[:200],
+            created_at=timezone.now(),
+        )
+        with self._lock:
+            if len(self._events) >= getattr(settings, "VERIFY_LOG_MAX_PENDING", 100_000):
+                self.dropped += 1
+                return
+            self._events.append(event)
+            full = len(self._events) >= getattr(settings, "VERIFY_LOG_BATCH_SIZE", 500)
+        self._start()
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._events)
+
+    def flush(self):
+        """Inserts whatever is buffered; returns the number of events written."""
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        try:
+            VerificationEvent.objects.bulk_create(events, batch_size=getattr(settings, "VERIFY_LOG_BATCH_SIZE", 500))
+        except IntegrityError:
+            # A document deleted since its event was recorded; re-buffering would fail forever.
+            return self._insert_each(events)
+        except DatabaseError:
+            with self._lock:
+                # Keep them for the next flush, oldest first, within the cap.
+                room = max(getattr(settings, "VERIFY_LOG_MAX_PENDING", 100_000) - len(self._events), 0)
+                self.dropped += max(len(events) - room, 0)
+                self._events = events[:room] + self._events
+            raise
+        return len(events)
+
+    def _insert_each(self, events):
+        for event in events:
+            try:
+                with transaction.atomic():
+                    event.save(force_insert=True)
+            except IntegrityError:
+                event.pk = event.document_id = None
+                with transaction.atomic():
+                    event.save(force_insert=True)
+        return len(events)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="verification-log", daemon=True)
+            self._thread.start()
+        atexit.register(self._flush_quietly)
+
+    def _run(self):
+        while True:
+            self._wake.wait(getattr(settings, "VERIFY_LOG_FLUSH_INTERVAL", 5.0))
+            self._wake.clear()
+            close_old_connections()
+            self._flush_quietly()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except DatabaseError:
+            logger.exception("Could not write %d verification event(s); will retry", self.pending())
+        except Exception:
+            # Never let one bad batch stop the flushing thread; those events are lost.
+            logger.exception("Dropped a batch of verification events")
+
+
+verification_log = VerificationEventLog()
+
+
+# ---------------- rollups ----------------
+
+def rollup_events(since=None, full=False):
+    """
+    Recomputes the hourly and daily rollups of every period from `since` on
+    (every period with `full`). By default that is one hour before the
+    latest hourly rollup, so events flushed late are still counted.
+    Returns the number of rollup rows written.
+    """
+    if since is None and not full:
+        latest = VerificationRollup.objects.filter(period="hour").aggregate(latest=Max("period_start"))["latest"]
+        since = latest - timedelta(hours=1) if latest else None
+
+    written = 0
+    for period, trunc in PERIODS.items():
+        events = VerificationEvent.objects.filter(document__isnull=False)
+        if since is not None:
+            # Whole periods only: start at the beginning of the one `since` falls in.
+            start = since.replace(minute=0, second=0, microsecond=0)
+            if period == "day":
+                start = timezone.localtime(start).replace(hour=0)
+            events = events.filter(created_at__gte=start)
+        counts = (
+            events.annotate(period_start=trunc("created_at"))
+            .values("document_id", "period_start")
+            .annotate(
+                total=Count("id"),
+                valid=Count("id", filter=Q(status="valid")),
+                invalid=Count("id", filter=Q(status__in=("invalid", "modified"))),
+                sources=Count("ip_address", distinct=True),
+            )
+            .order_by()
+        )
+        rows = [VerificationRollup(period=period, **row) for row in counts]
+        VerificationRollup.objects.bulk_create(
+            rows, batch_size=500, update_conflicts=True,
+            unique_fields=["document", "period", "period_start"],
+            update_fields=["total", "valid", "invalid", "sources"],
+        )
+        written += len(rows)
+    return written
+
+
+def prune_events(days=None):
+    """Deletes events older than `days` (VERIFY_LOG_RETENTION_DAYS); returns how many."""
+    days = days if days is not None else getattr(settings, "VERIFY_LOG_RETENTION_DAYS", 90)
+    if not days:
+        return 0
+    deleted, _ = VerificationEvent.objects.filter(created_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
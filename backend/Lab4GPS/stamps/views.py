@@ -1,14 +1,38 @@
 # views.py
-from rest_framework import viewsets, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework import mixins, viewsets, status
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.decorators import action, parser_classes
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from django.conf import settings
 from django.core.files.temp import NamedTemporaryFile
-from pyzbar.pyzbar import decode as qr_decode
-from .models import Stamp, Document
-from .serializers import StampSerializer, DocumentSerializer
-from django.utils.crypto import get_random_string
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from .models import Stamp, Document, DocumentRevision, StampJob
+from .serializers import (
+    StampSerializer, DocumentSerializer, DocumentRevisionSerializer, ApplyStampSerializer,
+    CreateStampJobSerializer, StampJobSerializer, StampJobItemSerializer,
+)
+from .jobs import create_job
+from .stamping import STAMP_SIZE, stamp_document, StampingError
+from .render_cache import appearance_digest, sprite_digest, stamp_render_cache
+from .pipeline import server_timing_header
+from .bloom import document_hash_filter
+from .qr import decode_qr, qr_decode_stats, QRDecodeTimeout
+from .qr_images import CONTENT_TYPES, image_etag, qr_image_url, render_qr_image
+from .qr_payload import QRSignatureError, decode_qr_payload, looks_like_qr_payload
+from .signing import SigningKeyMissing
+from .pdf_scan import scan_pdf_for_qr
+from .tiles import DocumentTiles, TileError
+from .batch import BatchError, BatchMultiPartParser, count_batch_files, iter_batch_files, verify_concurrently
+from .verify_cache import verification_cache
+from .verify_log import verification_log
+from .anchoring import AnchorError, verify_anchor
+from .serials import allocate_serial, is_legacy_serial, normalize_serial
+from .fingerprints import closest_document, describe_pages, differing_pages, fingerprint_upload
+from Lab4GPS.listing import CreatedAtCursorPagination, FieldProjectionMixin
+from Lab4GPS.uploadhandlers import HashingUploadMixin, uploaded_sha256
 import json
 import qrcode
 import base64
@@ -17,10 +41,15 @@ from PIL import Image
 import hashlib
 import fitz  # PyMuPDF
 
-class StampViewSet(viewsets.ModelViewSet):
+# Stamp previews: pixel height bounds for ?size=
+MIN_RENDER_SIZE = 16
+MAX_RENDER_SIZE = 1024
+
+class StampViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     serializer_class = StampSerializer
     queryset = Stamp.objects.all()
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user)
@@ -28,17 +57,135 @@ class StampViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class DocumentViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        # Drop renders of the old appearance before the new values are saved.
+        stamp_render_cache.invalidate(serializer.instance)
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        stamp_render_cache.invalidate(instance)
+        instance.delete()
+
+    def _render_size(self, request):
+        try:
+            size = int(request.query_params.get("size") or STAMP_SIZE)
+        except ValueError:
+            size = 0
+        return size if MIN_RENDER_SIZE <= size <= MAX_RENDER_SIZE else None
+
+    def _image_response(self, request, data, content_type, etag, versioned):
+        """Serves a render; versioned URLs (?v= the current digest) never change and are immutable."""
+        cache_control = "private, max-age=31536000, immutable" if versioned else "private, no-cache"
+        response = get_conditional_response(request._request, etag=f'"{etag}"')
+        if response is None:
+            response = HttpResponse(data, content_type=content_type)
+            response["ETag"] = f'"{etag}"'
+        response["Cache-Control"] = cache_control
+        return response
+
+    @action(detail=True, methods=["get"], url_path=r"preview\.(?P<fmt>png|svg)", url_name="preview")
+    def preview(self, request, pk=None, fmt="png"):
+        """
+        GET /stamps/stamps/<pk>/preview.png?size=120 (or preview.svg)
+        The stamp as the server draws it onto documents, `size` pixels high.
+        Rendered once per appearance and size (see stamps/render_cache.py).
+        """
+        stamp = self.get_object()
+        size = self._render_size(request)
+        if size is None:
+            return Response({"error": f"size must be between {MIN_RENDER_SIZE} and {MAX_RENDER_SIZE}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        digest = appearance_digest(stamp)
+        return self._image_response(
+            request, stamp_render_cache.get(stamp, fmt, size), CONTENT_TYPES[fmt],
+            etag=f"{digest[:32]}-{size}-{fmt}",
+            versioned=request.query_params.get("v") == digest[:16],
+        )
+
+    @action(detail=False, methods=["get"], url_path=r"sprite\.(?P<fmt>png|json)", url_name="sprite")
+    def sprite(self, request, fmt="json"):
+        """
+        GET /stamps/stamps/sprite.json?size=96
+        GET /stamps/stamps/sprite.png?size=96&v=<version>
+        The user's whole stamp library in one image, and its atlas: where each
+        stamp (by id) sits in the sheet, plus the sheet's versioned URL.
+        """
+        size = self._render_size(request)
+        if size is None:
+            return Response({"error": f"size must be between {MIN_RENDER_SIZE} and {MAX_RENDER_SIZE}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        stamps = list(self.get_queryset().order_by("created_at", "id"))
+        data, atlas = stamp_render_cache.sprite(stamps, size)
+        digest = sprite_digest(stamps, size)
+        if fmt == "json":
+            image = request.build_absolute_uri(reverse("stamp-sprite", kwargs={"fmt": "png"}))
+            return Response({**atlas, "image": f"{image}?size={size}&v={digest[:16]}"}, status=status.HTTP_200_OK)
+        return self._image_response(
+            request, data, "image/png", etag=digest[:32],
+            versioned=request.query_params.get("v") == digest[:16],
+        )
+
+class StampJobViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Bulk stamping: POST /stamps/jobs/ with
+        {"stamp": <id>, "documents": [<id>, ...], "placements": [{"page": 1, "x": 400, "y": 700}, ...]}
+    queues the job and returns 202; GET /stamps/jobs/<pk>/ reports progress.
+    """
+    serializer_class = StampJobSerializer
+    queryset = StampJob.objects.all()
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser]
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = CreateStampJobSerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+        job = create_job(
+            request.user,
+            serializer.validated_data["stamp"],
+            serializer.validated_data["documents"],
+            serializer.validated_data["placements"],
+        )
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=["get"])
+    def items(self, request, pk=None):
+        """
+        GET /stamps/jobs/<pk>/items/?status=failed
+        Per-document outcomes, optionally filtered by status.
+        """
+        items = self.get_object().items.all()
+        item_status = request.query_params.get("status")
+        if item_status:
+            items = items.filter(status=item_status)
+        page = self.paginate_queryset(items)
+        if page is not None:
+            return self.get_paginated_response(StampJobItemSerializer(page, many=True).data)
+        return Response(StampJobItemSerializer(items, many=True).data, status=status.HTTP_200_OK)
+
+class DocumentViewSet(FieldProjectionMixin, HashingUploadMixin, viewsets.ModelViewSet):
     serializer_class = DocumentSerializer
     queryset = Document.objects.all()
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
     parser_classes = [MultiPartParser, FormParser]  # so we can handle multipart form data
 
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user)
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # Expose the save pipeline's stage timings to clients and profilers.
+        timings = getattr(self, "save_timings", None)
+        if timings:
+            response["Server-Timing"] = server_timing_header(timings)
+        return response
+
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user, stamped=False)
+        document = serializer.save(user=self.request.user, stamped=False)
+        self.save_timings = document.save_timings
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -47,11 +194,9 @@ class DocumentViewSet(viewsets.ModelViewSet):
             instance.file = new_file
 
         instance.stamped = True
-        if not instance.serial_number:
-            instance.serial_number = get_random_string(length=8).upper()
-
-        instance.generate_qr_code()
+        # The save pipeline assigns a serial, hashes the new file and renders the QR as needed.
         instance.save()
+        self.save_timings = instance.save_timings
         serializer = self.get_serializer(instance)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -66,13 +211,185 @@ class DocumentViewSet(viewsets.ModelViewSet):
 
         # If needed, ensure it has a serial number:
         if not document.serial_number:
-            document.serial_number = get_random_string(length=8).upper()
+            document.serial_number = allocate_serial()
 
-        # Now generate the QR code.
-        document.generate_qr_code()
+        # Now generate the QR code; the save pipeline sees it is current and won't redo it.
+        try:
+            document.generate_qr_code()
+        except SigningKeyMissing as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         document.save()
+        self.save_timings = document.save_timings
 
-        return Response({"qr_base64": document.qr_data}, status=status.HTTP_200_OK)
+        png = render_qr_image(document.qr_payload, "png")
+        return Response({
+            "qr_base64": base64.b64encode(png).decode("utf-8"),
+            "qr_url": qr_image_url(document, request=request),
+        }, status=status.HTTP_200_OK)
+
+    def qr_image(self, request, pk=None, fmt="png"):
+        """
+        GET /stamps/documents/<pk>/qr.png (or qr.svg); routed in stamps/urls.py
+        (no trailing slash, it is a file). The document's QR code, rendered on
+        first request and then cached. The owner can fetch it directly; anyone
+        else needs the versioned URL from `qr_url` (its `v` is derived from the
+        signed payload, so it cannot be guessed). Versioned URLs never change
+        content and are cached for a year; plain ones revalidate with the ETag.
+        """
+        try:
+            document = (
+                Document.objects.filter(pk=pk)
+                .only("id", "user_id", "serial_number", "file_hash", "qr_payload")
+                .first()
+            )
+        except ValueError:
+            document = None
+        if document is None:
+            return Response({"error": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        is_owner = request.user.is_authenticated and request.user.id == document.user_id
+        if not document.qr_payload:
+            # Issued before payloads were stored (or still queued). Without one there is
+            # no versioned URL either, so only the owner gets it, issued now.
+            if not is_owner:
+                return Response({"error": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+            try:
+                document.generate_qr_code()
+            except SigningKeyMissing as e:
+                return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            Document.objects.filter(pk=document.pk).update(qr_payload=document.qr_payload)
+
+        etag = image_etag(document.qr_payload, fmt)
+        versioned = request.query_params.get("v") == etag
+        if not (versioned or is_owner):
+            return Response({"error": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        cache_control = "public, max-age=31536000, immutable" if versioned else "private, no-cache"
+        not_modified = get_conditional_response(request._request, etag=f'"{etag}"')
+        if not_modified is not None:
+            not_modified["Cache-Control"] = cache_control
+            return not_modified
+        response = HttpResponse(render_qr_image(document.qr_payload, fmt), content_type=CONTENT_TYPES[fmt])
+        response["ETag"] = f'"{etag}"'
+        response["Cache-Control"] = cache_control
+        return response
+
+    @action(detail=True, methods=["get"], url_path="tiles")
+    def tiles(self, request, pk=None):
+        """
+        GET /stamps/documents/<pk>/tiles/
+        Page sizes, zoom levels and the URL template of the document's tiles.
+        """
+        document = self.get_object()
+        try:
+            manifest = DocumentTiles(document).manifest()
+        except TileError as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        base = request.build_absolute_uri(reverse("document-tiles", kwargs={"pk": document.pk}))
+        template = f"{base}{document.file_hash[:16]}/{{page}}/{{level}}/{{col}}_{{row}}.png/"
+        return Response({**manifest, "url": template}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"], url_name="tile",
+            url_path=r"tiles/(?P<version>[0-9a-f]{16})/(?P<page>\d+)/(?P<level>\d+)/(?P<col>\d+)_(?P<row>\d+)\.png")
+    def tile(self, request, pk=None, version=None, page=None, level=None, col=None, row=None):
+        """
+        GET /stamps/documents/<pk>/tiles/<version>/<page>/<level>/<col>_<row>.png
+        One tile, rendered on first request. `version` is the file hash prefix,
+        so a URL always names the same bytes and is cached as immutable.
+        """
+        document = self.get_object()
+        if not document.file_hash or document.file_hash[:16] != version:
+            return Response({"error": "The document has changed; reload its tiles."},
+                            status=status.HTTP_404_NOT_FOUND)
+        try:
+            data = DocumentTiles(document).tile(int(page), int(level), int(col), int(row))
+        except TileError as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        response = HttpResponse(data, content_type="image/png")
+        response["Cache-Control"] = "private, max-age=31536000, immutable"
+        return response
+
+    @action(detail=True, methods=["get"], url_path="verification-stats")
+    def verification_stats(self, request, pk=None):
+        """
+        GET /stamps/documents/<pk>/verification-stats/?period=day&limit=30
+        How often and from how many addresses the document was verified, per
+        hour or day, newest first (rolled up by `manage.py rollup_verifications`).
+        """
+        document = self.get_object()
+        period = request.query_params.get("period", "day")
+        if period not in ("hour", "day"):
+            return Response({"error": "period must be 'hour' or 'day'."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get("limit", 30)), 1), 1000)
+        except ValueError:
+            return Response({"error": "limit must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+        rollups = list(
+            document.verification_rollups.filter(period=period)
+            .order_by("-period_start")
+            .values("period_start", "total", "valid", "invalid", "sources")[:limit]
+        )
+        return Response({
+            "document": document.pk,
+            "period": period,
+            "total": sum(rollup["total"] for rollup in rollups),
+            "rollups": rollups,
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"], url_path="anchor")
+    def anchor(self, request, pk=None):
+        """
+        GET /stamps/documents/<pk>/anchor/
+        The signed batch root covering the document's current hash and the
+        inclusion proof leading to it (see stamps/anchoring.py).
+        """
+        document = self.get_object()
+        if document.anchor_batch is None:
+            return Response({"error": "The document's current hash has not been anchored yet."},
+                            status=status.HTTP_404_NOT_FOUND)
+        batch = document.anchor_batch
+        return Response({
+            "file_hash": document.file_hash,
+            "batch": batch.pk,
+            "root": batch.root,
+            "signature": batch.signature,
+            "leaf_count": batch.leaf_count,
+            "anchored_at": batch.created_at,
+            "proof": document.anchor_proof,
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"], url_path="revisions")
+    def revisions(self, request, pk=None):
+        """
+        GET /stamps/documents/<pk>/revisions/
+        Every recorded state of the file, oldest first. Revision n of an
+        incrementally stamped PDF is its first `size` bytes.
+        """
+        document = self.get_object()
+        revisions = document.revisions.order_by("number")
+        return Response(DocumentRevisionSerializer(revisions, many=True).data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["post"], url_path="apply-stamp", parser_classes=[JSONParser])
+    def apply_stamp(self, request, pk=None):
+        """
+        POST /stamps/documents/<pk>/apply-stamp/
+        Body: {"stamp": <stamp id>, "placements": [{"page": 1, "x": 400, "y": 700, "size": 120}, ...]}
+        Appends the stamp to the stored PDF as vector graphics in an incremental
+        update (a new revision), then saves the document once so the hash, QR
+        code and revision record are refreshed.
+        """
+        document = self.get_object()
+        serializer = ApplyStampSerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            document = stamp_document(
+                document, serializer.validated_data["stamp"], serializer.validated_data["placements"]
+            )
+        except StampingError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        self.save_timings = document.save_timings
+        return Response(self.get_serializer(document).data, status=status.HTTP_200_OK)
     @action(detail=False, methods=["post"], url_path="verify-document")
     def verify_document(self, request):
         """
@@ -108,15 +425,33 @@ class DocumentViewSet(viewsets.ModelViewSet):
 
 
 
+    @action(detail=False, methods=["get"], url_path="verify-cache-stats", permission_classes=[IsAdminUser])
+    def verify_cache_stats(self, request):
+        """
+        GET /stamps/documents/verify-cache-stats/
+        Hits and misses of the verification result cache, per layer.
+        """
+        return Response(verification_cache.snapshot(), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"], url_path="qr-stats", permission_classes=[IsAdminUser])
+    def qr_stats(self, request):
+        """
+        GET /stamps/documents/qr-stats/
+        Which QR decoding stage succeeded, misses and timeouts, for tuning.
+        """
+        return Response(qr_decode_stats.snapshot(), status=status.HTTP_200_OK)
+
     @action(detail=False, methods=["post"], url_path="verify-document")
     def verify_document(self, request):
         """
         POST /stamps/documents/verify-document/
         Accepts 'file' in form-data. 
         - If image => decode QR.
-        - If PDF => compute hash => see if doc recognized.
+        - If PDF => compute hash => see if doc recognized; if not, look for our QR
+          on its pages, then compare page fingerprints to say which pages differ.
         Returns a JSON with {status, isVerified, message}.
-        status => 'valid' or 'invalid' or 'error'
+        status => 'valid' or 'invalid' or 'error', or 'modified' for a PDF
+        carrying a genuine QR whose pages differ from the issued document
         """
         file_obj = request.FILES.get("file")
         if not file_obj:
@@ -125,15 +460,97 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 "isVerified": False,
                 "message": "No file provided for verification."
             }, status=status.HTTP_400_BAD_REQUEST)
+        return self._verify_file(file_obj)
 
-        content_type = file_obj.content_type.lower()
+    @action(detail=False, methods=["post"], url_path="verify-batch", parser_classes=[BatchMultiPartParser])
+    def verify_batch(self, request):
+        """
+        POST /stamps/documents/verify-batch/
+        Accepts many 'files' in form-data, ZIP archives among them are unpacked.
+        Files are verified concurrently and the response streams one JSON line
+        (NDJSON) per file as it finishes, in completion order:
+            {"file": "a.pdf", "status": ..., "isVerified": ..., "message": ...}
+        """
+        try:
+            uploaded_files = request.FILES.getlist("files") or request.FILES.getlist("file")
+            if not uploaded_files:
+                return Response({
+                    "status": "error",
+                    "isVerified": False,
+                    "message": "No files provided for verification."
+                }, status=status.HTTP_400_BAD_REQUEST)
+            total = count_batch_files(uploaded_files)
+        except BatchError as e:
+            return Response({
+                "status": "error",
+                "isVerified": False,
+                "message": str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        def verify(file_obj):
+            return self._verify_file(file_obj, endpoint="batch").data
+
+        def lines():
+            results = verify_concurrently(iter_batch_files(uploaded_files), verify)
+            for name, result in results:
+                if isinstance(result, Exception):
+                    result = {
+                        "status": "error",
+                        "isVerified": False,
+                        "message": f"Failed to verify file: {str(result)}"
+                    }
+                yield json.dumps({"file": name, **result}) + "\n"
+
+        response = StreamingHttpResponse(lines(), content_type="application/x-ndjson")
+        response["X-Batch-Size"] = str(total)
+        return response
+
+    def _verify_file(self, file_obj, endpoint="document"):
+        """
+        Verifies one uploaded file; returns a {status, isVerified, message} Response.
+        Results are cached by the upload's digest (see stamps/verify_cache.py)
+        and every result is logged without waiting on the database (stamps/verify_log.py).
+        """
+        digest = uploaded_sha256(file_obj)
+        file_obj.sha256 = digest  # so the hash check below does not hash it again
+        cached = verification_cache.get_result(digest)
+        if cached is not None and not self._owner_sees_more(cached):
+            data, status_code, document_id = cached
+            verification_log.record(self.request, data.get("status"), document_id, endpoint, cached=True)
+            return Response(data, status=status_code)
+
+        response = self._verify_file_uncached(file_obj)
+        document_id = getattr(response, "document_id", None)
+        if getattr(response, "cacheable", True):
+            verification_cache.set_result(digest, response.data, response.status_code, document_id)
+        verification_log.record(self.request, response.data.get("status"), document_id, endpoint)
+        return response
+
+    def _owner_sees_more(self, cached):
+        """
+        An invalid result naming a document is worded for everyone else; its
+        owner gets the full answer instead (see _verify_by_fingerprints).
+        """
+        data, _, document_id = cached
+        return (
+            document_id is not None and data.get("status") == "invalid"
+            and Document.objects.filter(pk=document_id, user_id=self.request.user.id).exists()
+        )
+
+    def _verify_file_uncached(self, file_obj):
+        file_obj.seek(0)
+        content_type = (file_obj.content_type or "").lower()
 
         # If it's an image, try to decode a QR
         if "image" in content_type:
             return self._verify_by_qr(file_obj)
-        # If it's PDF, do a hash check
+        # If it's PDF, do a hash check; if the bytes differ, look for our QR on its pages
         elif "pdf" in content_type:
-            return self._verify_by_hash(file_obj)
+            response = self._verify_by_hash(file_obj)
+            # An invalid result naming a document (failed batch attestation) is final.
+            if response.data.get("status") == "invalid" and getattr(response, "document_id", None) is None:
+                return self._verify_by_rendered_qr(file_obj, fallback=response)
+            return response
         else:
             return Response({
                 "status": "error",
@@ -147,32 +564,167 @@ class DocumentViewSet(viewsets.ModelViewSet):
         Distinguish between no QR found, or doc not recognized.
         """
         try:
-            image_bytes = image_file.read()
-            pil_image = Image.open(BytesIO(image_bytes))
-            results = qr_decode(pil_image)  # list of detected QR codes
+            # Decoding stops at the first QR whose content parses as one of ours.
+            result = decode_qr(image_file.read(), is_valid=looks_like_qr_payload)
 
-            if not results:
+            if not result.payload:
                 return Response({
                     "status": "invalid",
                     "isVerified": False,
                     "message": "No QR code recognized in the image. The document might be altered or not stamped with a QR."
                 }, status=status.HTTP_200_OK)
 
-            # parse the first recognized QR
-            qr_content = results[0].data.decode("utf-8")
-            # e.g. {"document_id": 5, "serial_number": "XYZ123", "user": "john"}
+            return self._verify_qr_payload(result.payload)
+
+        except QRDecodeTimeout as e:
+            return Response({
+                "status": "error",
+                "isVerified": False,
+                "message": f"{e} Please try again with a smaller or clearer image."
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            return Response({
+                "status": "error",
+                "isVerified": False,
+                "message": f"Failed to analyze QR. Error: {str(e)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+    def _verify_by_rendered_qr(self, pdf_file, fallback):
+        """
+        Render the PDF's pages and look for our QR code, so a stamped PDF that
+        was re-saved or printed still verifies. Returns `fallback` (the hash
+        miss) when no QR is found.
+
+        A genuine QR only vouches for the document it names, and anyone can
+        copy one onto another file: the upload verifies only if every page
+        matches that document's page fingerprints. Otherwise the answer is
+        'modified' (isVerified false), naming the pages that differ.
+        """
+        try:
+            pdf_file.seek(0)
+            result = scan_pdf_for_qr(pdf_file, is_valid=looks_like_qr_payload)
+        except Exception:
+            return fallback
+        if result is None or not result.payload:
+            return self._verify_by_fingerprints(pdf_file, fallback)
+
+        try:
+            qr = decode_qr_payload(result.payload)
+        except QRSignatureError:
+            qr = None
+        document, pages = (None, [])
+        if qr is not None and qr.document_id:
+            document, pages = self._page_differences(pdf_file, document_id=qr.document_id)
+        if document is not None and not pages:
+            note = (f" Matched by the QR code on page {result.page}; every page matches our stored copy, "
+                    f"though the file itself was re-saved.")
+            return self._verify_qr_payload(result.payload, note=note)
+
+        response = self._verify_qr_payload(result.payload)
+        if response.data.get("status") != "valid":
+            return response
+        if pages:
+            detail = f"{self._pages_differ(pages)} from the issued document"
+        else:
+            detail = "its pages could not be compared with the issued document"
+        modified = Response({
+            "status": "modified",
+            "isVerified": False,
+            "message": (f"The QR code on page {result.page} was issued by CS&V, but this file is not the "
+                        f"document it was issued for: {detail}. It was altered, or the QR was copied "
+                        f"onto another file.")
+        }, status=status.HTTP_200_OK)
+        modified.document_id = response.document_id
+        return modified
+
+    def _verify_by_fingerprints(self, pdf_file, fallback):
+        """
+        Last resort for a PDF with no hash match and no QR: find the issued
+        document sharing the most page fingerprints and report which pages
+        differ from it. Only its owner is told which document that is; the
+        answer is then personal and not cached. Returns `fallback` when
+        nothing is close.
+        """
+        document, pages = self._page_differences(pdf_file)
+        if document is None:
+            return fallback
+        owner = document.user_id == self.request.user.id
+        if owner:
+            closest = f"The closest issued document is your document {document.serial_number}; "
+            if pages:
+                detail = closest + f"{self._pages_differ(pages)} from it."
+            else:
+                detail = closest + "every page matches it, but the file itself was modified."
+        elif pages:
+            detail = f"{self._pages_differ(pages).capitalize()} from an issued document."
+        else:
+            detail = "Every page matches an issued document, but the file itself was modified."
+        response = Response({
+            "status": "invalid",
+            "isVerified": False,
+            "message": f"No matching document found for this PDF hash. {detail}"
+        }, status=status.HTTP_200_OK)
+        response.document_id = document.id
+        response.cacheable = not owner
+        return response
+
+    def _page_differences(self, pdf_file, document_id=None):
+        """
+        Compares the upload's page fingerprints with a stored document's
+        (`document_id`, or the closest one found through the fingerprint
+        indexes). Returns (document, differing page numbers), or (None, []).
+        """
+        try:
+            fingerprints = fingerprint_upload(
+                pdf_file, max_pages=getattr(settings, "VERIFY_FINGERPRINT_MAX_PAGES", 50)
+            )
+            if not fingerprints:
+                return None, []
+            searching = document_id is None
+            if searching:
+                document_id, _ = closest_document(fingerprints)
+            document = Document.objects.filter(pk=document_id).first()
+            if document is None:
+                return None, []
+            pages = differing_pages(fingerprints, document)
+            if searching and len(pages) >= len(fingerprints):
+                # Only near-identical layouts in common (e.g. blank pages); not the same document.
+                return None, []
+            return document, pages
+        except Exception:
+            return None, []
+
+    @staticmethod
+    def _pages_differ(pages):
+        return f"{describe_pages(pages)} {'differs' if len(pages) == 1 else 'differ'}"
+
+    def _verify_qr_payload(self, payload, note=""):
+        """
+        Checks a decoded QR payload against our records.
+        `note` is appended to the success message.
+        """
+        try:
             try:
-                data = json.loads(qr_content)
-            except Exception:
+                qr = decode_qr_payload(payload)
+            except QRSignatureError:
+                return Response({
+                    "status": "invalid",
+                    "isVerified": False,
+                    "message": "The QR code's signature is not ours. The document is forged or altered."
+                }, status=status.HTTP_200_OK)
+            if qr is None:
                 return Response({
                     "status": "invalid",
                     "isVerified": False,
                     "message": "QR code content is not valid JSON. Possibly corrupted."
                 }, status=status.HTTP_200_OK)
+            if qr.signed:
+                return self._verify_signed_qr(qr, note)
 
-            doc_id = data.get("document_id")
-            serial_num = data.get("serial_number")
-            user_name = data.get("user")
+            # Legacy unsigned payload, e.g. {"document_id": 5, "serial_number": "XYZ123", "user": "john"}
+            doc_id = qr.document_id
+            serial_num = qr.serial_number
+            user_name = qr.user
 
             # If any are missing, treat as invalid
             if not doc_id or not serial_num or not user_name:
@@ -182,33 +734,53 @@ class DocumentViewSet(viewsets.ModelViewSet):
                     "message": "QR code missing required fields. Possibly altered."
                 }, status=status.HTTP_200_OK)
 
-            # Attempt to find a doc with that id & serial
-            try:
-                doc = Document.objects.get(id=doc_id, serial_number=serial_num)
-            except Document.DoesNotExist:
-                return Response({
+            # A mistyped or forged serial fails its check symbol; no need to ask the DB.
+            if not is_legacy_serial(serial_num):
+                serial_num = normalize_serial(serial_num)
+                if serial_num is None:
+                    return Response({
+                        "status": "invalid",
+                        "isVerified": False,
+                        "message": "The QR code's serial number is malformed. Possibly altered."
+                    }, status=status.HTTP_200_OK)
+
+            # Attempt to find a doc with that id & serial (owner and date only)
+            record = verification_cache.get_record(
+                doc_id, serial_num, "record",
+                lambda: Document.objects.filter(id=doc_id, serial_number=serial_num)
+                .values("created_at", "user__username").first(),
+            )
+            if record is None:
+                response = Response({
                     "status": "invalid",
                     "isVerified": False,
                     "message": ("The QR code references a non-existent or altered document. "
                                 "No matching doc in our system.")
                 }, status=status.HTTP_200_OK)
+                return response
 
             # If the doc is found, do we confirm user_name?
-            if doc.user.username.lower() != user_name.lower():
-                return Response({
+            doc_id = int(doc_id)  # the row exists, so the id is a real one
+            owner = record["user__username"]
+            if owner.lower() != user_name.lower():
+                response = Response({
                     "status": "invalid",
                     "isVerified": False,
                     "message": (f"This document's QR references user '{user_name}', but in our system "
-                                f"it's owned by '{doc.user.username}'. Possibly altered.")
+                                f"it's owned by '{owner}'. Possibly altered.")
                 }, status=status.HTTP_200_OK)
+                response.document_id = doc_id
+                return response
 
             # If we get here, success
-            created_on = doc.created_at.strftime("%Y-%m-%d %H:%M:%S")
-            return Response({
+            created_on = record["created_at"].strftime("%Y-%m-%d %H:%M:%S")
+            response = Response({
                 "status": "valid",
                 "isVerified": True,
-                "message": f"Authentic document by CS&V. Created on {created_on} by {user_name}."
+                "message": f"Authentic document by CS&V. Created on {created_on} by {user_name}.{note}"
             }, status=status.HTTP_200_OK)
+            response.document_id = doc_id
+            return response
 
         except Exception as e:
             return Response({
@@ -217,23 +789,95 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 "message": f"Failed to analyze QR. Error: {str(e)}"
             }, status=status.HTTP_400_BAD_REQUEST)
 
-    def _verify_by_hash(self, pdf_file):
+    def _verify_signed_qr(self, qr, note=""):
         """
-        1) read all bytes -> compute sha256
-        2) see if a Document has that hash
-        3) if found => valid. else => invalid
+        The signature already proves we issued this QR; what is left is whether
+        the document still exists under that serial (not revoked) and whether
+        the QR was issued for its current file or one of its earlier revisions.
         """
-        import hashlib
-        sha = hashlib.sha256()
+        current = verification_cache.get_record(
+            qr.document_id, qr.serial_number, "current",
+            lambda: Document.objects.filter(id=qr.document_id, serial_number=qr.serial_number)
+            .values("file_hash").first(),
+        )
+        if current is None:
+            # No document_id: the one the QR names may no longer exist.
+            return Response({
+                "status": "invalid",
+                "isVerified": False,
+                "message": ("This QR code was issued by CS&V, but the document has since been "
+                            "revoked or replaced.")
+            }, status=status.HTTP_200_OK)
+        prefix = qr.hash_prefix
+        if prefix and not (current["file_hash"] or "").startswith(prefix):
+            revision = (
+                DocumentRevision.objects.filter(document_id=qr.document_id, file_hash__startswith=prefix)
+                .values_list("number", flat=True).first()
+            )
+            if revision is None:
+                response = Response({
+                    "status": "invalid",
+                    "isVerified": False,
+                    "message": ("This QR code was issued by CS&V for a file this document no longer "
+                                "has; it was replaced since.")
+                }, status=status.HTTP_200_OK)
+                response.document_id = qr.document_id
+                return response
+            note = f" The QR was issued for revision {revision}; the document has been stamped since.{note}"
+        issued_on = qr.issued_at.strftime("%Y-%m-%d %H:%M:%S")
+        response = Response({
+            "status": "valid",
+            "isVerified": True,
+            "message": f"Authentic document by CS&V. Serial {qr.serial_number}, issued on {issued_on} UTC.{note}"
+        }, status=status.HTTP_200_OK)
+        response.document_id = qr.document_id
+        return response
+
+    def _verify_revision(self, uploaded_hash):
+        """
+        An earlier revision of a document stamped since (stamps/stamping.py)
+        is still authentic; returns its response, or None if no revision matches.
+        """
+        revision = (DocumentRevision.objects.filter(file_hash=uploaded_hash)
+                    .select_related("document__user")
+                    .order_by("created_at")
+                    .first())
+        if revision is None:
+            return None
+        doc = revision.document
+        created_on = revision.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        response = Response({
+            "status": "valid",
+            "isVerified": True,
+            "message": (f"Authentic document by CS&V: revision {revision.number} of a document by "
+                        f"{doc.user.username}, recorded on {created_on}. It has been stamped since; "
+                        f"the current version is {doc.version}.")
+        }, status=status.HTTP_200_OK)
+        response.document_id = doc.id
+        return response
 
+    def _verify_by_hash(self, pdf_file):
+        """
+        1) take the sha256 computed during upload (or hash the bytes)
+        2) ask the Bloom filter; a miss means we never issued it, no query needed
+        3) otherwise look the hash up in the (indexed) Document table
+        4) if found and anchored, check its Merkle proof against the signed batch root
+        5) if found => valid. else => invalid
+        """
         try:
-            for chunk in pdf_file.chunks():
-                sha.update(chunk)
-            uploaded_hash = sha.hexdigest()
+            uploaded_hash = uploaded_sha256(pdf_file)
 
+            known = document_hash_filter.might_contain(uploaded_hash)
             try:
-                doc = Document.objects.get(file_hash=uploaded_hash)
+                if not known:
+                    raise Document.DoesNotExist
+                doc = (Document.objects.filter(file_hash=uploaded_hash)
+                       .select_related("user", "anchor_batch")
+                       .earliest("created_at"))
             except Document.DoesNotExist:
+                revision_response = self._verify_revision(uploaded_hash) if known else None
+                if revision_response is not None:
+                    return revision_response
                 # This means the PDF doesn't match any stored doc => altered or unknown
                 return Response({
                     "status": "invalid",
@@ -242,15 +886,33 @@ class DocumentViewSet(viewsets.ModelViewSet):
                                 "The file might be altered or not in our system.")
                 }, status=status.HTTP_200_OK)
 
+            # The record must still match the batch root signed when it was anchored.
+            try:
+                batch = verify_anchor(doc)
+            except AnchorError as e:
+                response = Response({
+                    "status": "invalid",
+                    "isVerified": False,
+                    "message": f"Our record of this document fails its batch attestation: {e}"
+                }, status=status.HTTP_200_OK)
+                response.document_id = doc.id
+                return response
+
             # if found => success
             created_on = doc.created_at.strftime("%Y-%m-%d %H:%M:%S")
             user_name = doc.user.username
-            return Response({
+            anchored = ""
+            if batch is not None:
+                sealed_on = batch.created_at.strftime("%Y-%m-%d %H:%M:%S")
+                anchored = f" Anchored in signed batch {batch.pk} on {sealed_on}."
+            response = Response({
                 "status": "valid",
                 "isVerified": True,
                 "message": (f"Authentic document by CS&V. Created on {created_on} by {user_name}. "
-                            f"All file contents match our records.")
+                            f"All file contents match our records.{anchored}")
             }, status=status.HTTP_200_OK)
+            response.document_id = doc.id
+            return response
 
         except Exception as e:
             return Response({
@@ -0,0 +1,36 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tasks.registry import registry
+from tasks.worker import Worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs deferred tasks from the database queue until interrupted. "
+        "Start as many as needed; SIGINT/SIGTERM finish the tasks in hand, then exit."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=2, help="Tasks run concurrently by this worker.")
+        parser.add_argument("--poll-interval", type=float, default=None,
+                            help="Seconds to sleep when nothing is due (default TASK_POLL_INTERVAL).")
+        parser.add_argument("--only", nargs="+", metavar="TASK", help="Run only these task types.")
+
+    def handle(self, *args, **options):
+        if getattr(settings, "TASKS_EAGER", False):
+            self.stderr.write(self.style.WARNING(
+                "TASKS_EAGER is on, so web processes run tasks inline and queue nothing; "
+                "set TASKS_EAGER=0 in their environment too."
+            ))
+        worker = Worker(threads=options["threads"], poll_interval=options["poll_interval"], names=options["only"])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+
+        self.stdout.write(f"Worker {worker.identity} running {options['threads']} thread(s); task types:")
+        for name in sorted(registry):
+            self.stdout.write(f"  {name}")
+        worker.run()
+        self.stdout.write(self.style.SUCCESS("Worker stopped."))
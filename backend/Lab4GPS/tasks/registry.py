@@ -0,0 +1,110 @@
+# tasks/registry.py
+"""
+Registering functions as tasks and deferring calls to them.
+
+    @task(priority=10, max_attempts=5, concurrency=2)
+    def send_email(subject, message, from_email, recipient_list):
+        ...
+
+    send_email.defer("Hi", "...", "noreply@...", ["a@b.c"])  # runs on a worker
+    send_email("Hi", ...)                                     # still callable inline
+
+Deferring inserts a Task row in the caller's transaction, so work queued by
+a request that rolls back is never run. Arguments must be JSON-serializable;
+pass ids rather than model instances.
+
+Options per task type (TASK_TYPES in settings can override any of them):
+  priority      higher runs first
+  max_attempts  total tries before the task is marked failed
+  concurrency   at most this many running at once across all workers (None: no limit)
+  backoff       seconds before the first retry; doubles on each further retry
+  timeout       seconds a worker may hold the task before it is presumed dead
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+DEFAULTS = {
+    "priority": 0,
+    "max_attempts": 3,
+    "concurrency": None,
+    "backoff": 10,
+    "timeout": 300,
+}
+
+registry = {}
+
+
+class TaskType:
+    def __init__(self, func, name, **options):
+        self.func = func
+        self.name = name
+        self._options = options
+
+    def option(self, key):
+        overrides = getattr(settings, "TASK_TYPES", {}).get(self.name, {})
+        if key in overrides:
+            return overrides[key]
+        return self._options.get(key, DEFAULTS[key])
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def defer(self, *args, priority=None, delay=0, **kwargs):
+        """
+        Queues a call. Returns the Task, or None when TASKS_EAGER runs it inline.
+        """
+        if getattr(settings, "TASKS_EAGER", False):
+            self.func(*args, **kwargs)
+            return None
+        from .models import Task
+
+        return Task.objects.create(
+            name=self.name,
+            args=list(args),
+            kwargs=kwargs,
+            priority=self.option("priority") if priority is None else priority,
+            max_attempts=self.option("max_attempts"),
+            run_at=timezone.now() + timedelta(seconds=delay),
+        )
+
+    def defer_many(self, arg_lists, priority=None):
+        """Queues one call per args tuple with a single bulk INSERT."""
+        if getattr(settings, "TASKS_EAGER", False):
+            for args in arg_lists:
+                self.func(*args)
+            return []
+        from .models import Task
+
+        now = timezone.now()
+        return Task.objects.bulk_create([
+            Task(
+                name=self.name,
+                args=list(args),
+                priority=self.option("priority") if priority is None else priority,
+                max_attempts=self.option("max_attempts"),
+                run_at=now,
+            )
+            for args in arg_lists
+        ])
+
+    def retry_delay(self, attempts):
+        """Seconds to wait after failed attempt number `attempts` (1-based)."""
+        cap = getattr(settings, "TASK_RETRY_BACKOFF_MAX", 3600)
+        return min(self.option("backoff") * 2 ** (attempts - 1), cap)
+
+
+def task(func=None, *, name=None, **options):
+    """Registers `func` as a task; usable bare (@task) or with options (@task(...))."""
+    unknown = set(options) - set(DEFAULTS)
+    if unknown:
+        raise TypeError(f"Unknown task options: {', '.join(sorted(unknown))}")
+
+    def register(func):
+        task_name = name or f"{func.__module__}.{func.__name__}"
+        task_type = TaskType(func, task_name, **options)
+        registry[task_name] = task_type
+        return task_type
+
+    return register(func) if func is not None else register
@@ -0,0 +1,144 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Task
+from .registry import task
+from .worker import Worker
+
+calls = []
+
+
+@task(name="tasks.tests.record")
+def record(value):
+    calls.append(value)
+
+
+@task(name="tasks.tests.fail", backoff=10)
+def fail():
+    raise RuntimeError("boom")
+
+
+@task(name="tasks.tests.limited", concurrency=1)
+def limited():
+    calls.append("limited")
+
+
+@override_settings(TASKS_EAGER=False)
+class WorkerTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        self.worker = self.make_worker("host-a:1")
+        logger = mock.patch("tasks.worker.logger")  # failures are logged with tracebacks
+        logger.start()
+        self.addCleanup(logger.stop)
+
+    def make_worker(self, identity):
+        worker = Worker()
+        worker.identity = identity
+        return worker
+
+    def expire_lease(self, queued):
+        Task.objects.filter(pk=queued.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+    def test_only_one_worker_claims_a_task(self):
+        queued = record.defer("a")
+        self.assertEqual(self.worker.claim().pk, queued.pk)
+        self.assertIsNone(self.make_worker("host-b:1").claim())
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.Status.RUNNING)
+        self.assertEqual(queued.attempts, 1)
+        self.assertTrue(queued.locked_by.startswith("host-a:1:"))
+
+    def test_a_claimed_task_runs_and_succeeds(self):
+        queued = record.defer("a")
+        self.assertTrue(self.worker.run_one())
+        queued.refresh_from_db()
+        self.assertEqual(calls, ["a"])
+        self.assertEqual(queued.status, Task.Status.SUCCEEDED)
+        self.assertEqual(queued.locked_by, "")
+        self.assertFalse(self.worker.run_one())
+
+    def test_failed_attempts_are_retried_with_doubling_backoff(self):
+        queued = fail.defer()
+        with mock.patch("tasks.worker.random.uniform", return_value=1.0):
+            for expected_delay in (10, 20):
+                before = timezone.now()
+                self.worker.run_one()
+                queued.refresh_from_db()
+                self.assertEqual(queued.status, Task.Status.QUEUED)
+                self.assertIn("RuntimeError: boom", queued.last_error)
+                self.assertAlmostEqual((queued.run_at - before).total_seconds(), expected_delay, delta=1)
+                self.assertIsNone(self.worker.claim())  # not due yet
+                Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+
+    def test_the_last_failed_attempt_is_permanent(self):
+        queued = fail.defer()
+        Task.objects.filter(pk=queued.pk).update(max_attempts=1)
+        self.worker.run_one()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.Status.FAILED)
+        self.assertIsNotNone(queued.finished_at)
+        self.assertFalse(self.worker.run_one())
+
+    def test_an_unregistered_task_fails_permanently(self):
+        queued = Task.objects.create(name="tasks.tests.missing")
+        self.worker.run_one()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.Status.FAILED)
+        self.assertIn("No task registered", queued.last_error)
+
+    def test_a_type_at_its_concurrency_limit_is_not_claimed(self):
+        limited.defer()
+        self.assertIsNotNone(self.worker.claim())
+        waiting = limited.defer()
+        other = record.defer("b")
+        self.assertEqual(self.make_worker("host-b:1").claim().pk, other.pk)
+        self.assertIsNone(self.make_worker("host-b:1").claim())
+        waiting.refresh_from_db()
+        self.assertEqual(waiting.status, Task.Status.QUEUED)
+
+    def test_a_claim_that_lost_the_race_for_the_last_slot_is_handed_back(self):
+        limited.defer()
+        self.worker.claim()
+        waiting = limited.defer()
+        second = self.make_worker("host-b:1")
+        with mock.patch.object(second, "_saturated_types", return_value=set()):  # checked before the first claim
+            self.assertIsNone(second.claim())
+        waiting.refresh_from_db()
+        self.assertEqual((waiting.status, waiting.attempts, waiting.locked_by), (Task.Status.QUEUED, 0, ""))
+
+    def test_an_expired_lease_is_retried(self):
+        queued = record.defer("c")
+        self.worker.claim()
+        self.expire_lease(queued)
+        self.make_worker("host-b:1").maintain()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.Status.QUEUED)
+        self.assertIn("expired", queued.last_error)
+
+    def test_a_worker_that_overran_its_lease_leaves_the_retry_alone(self):
+        queued = record.defer("c")
+        overran = self.worker.claim()
+        self.expire_lease(queued)
+        other = self.make_worker("host-b:1")
+        other.maintain()
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        retry = other.claim()
+
+        self.worker.execute(overran)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.Status.RUNNING)
+        self.assertEqual(queued.locked_by, retry.locked_by)
+        other.execute(retry)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.Status.SUCCEEDED)
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_mode_runs_deferred_calls_inline(self):
+        self.assertIsNone(record.defer("d"))
+        self.assertEqual(record.defer_many([("e",), ("f",)]), [])
+        self.assertEqual(calls, ["d", "e", "f"])
+        self.assertFalse(Task.objects.exists())
@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import TaskDashboardView
+
+urlpatterns = [
+    # Endpoint for queue depth and latency
+    path('dashboard/', TaskDashboardView.as_view(), name='task_dashboard'),
+]
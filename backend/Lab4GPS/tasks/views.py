@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .models import Task
+from .registry import registry
+
+LATENCY_SAMPLE = 1000
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "max_ms": None}
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))], 1)
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "max_ms": round(values[-1], 1)}
+
+
+class TaskDashboardView(APIView):
+    """
+    API endpoint reporting queue depth per task type and, for tasks finished
+    in the last hour, how long they waited to start and how long they ran.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        now = timezone.now()
+        hour_ago = now - timedelta(hours=1)
+
+        rows = Task.objects.values("name").annotate(
+            queued=Count("id", filter=Q(status=Task.Status.QUEUED)),
+            due=Count("id", filter=Q(status=Task.Status.QUEUED, run_at__lte=now)),
+            running=Count("id", filter=Q(status=Task.Status.RUNNING)),
+            failed=Count("id", filter=Q(status=Task.Status.FAILED)),
+            succeeded_last_hour=Count("id", filter=Q(status=Task.Status.SUCCEEDED, finished_at__gte=hour_ago)),
+            oldest_due=Min("run_at", filter=Q(status=Task.Status.QUEUED, run_at__lte=now)),
+        )
+        queues = {}
+        for row in rows:
+            oldest_due = row.pop("oldest_due")
+            task_type = registry.get(row["name"])
+            queues[row["name"]] = {
+                **row,
+                "oldest_due_seconds": round((now - oldest_due).total_seconds(), 1) if oldest_due else None,
+                "concurrency": task_type.option("concurrency") if task_type else None,
+            }
+
+        finished = (
+            Task.objects.filter(status=Task.Status.SUCCEEDED, finished_at__gte=hour_ago)
+            .order_by("-finished_at")
+            .values_list("run_at", "started_at", "finished_at")[:LATENCY_SAMPLE]
+        )
+        waits, runs = [], []
+        for run_at, started_at, finished_at in finished:
+            waits.append(max(0.0, (started_at - run_at).total_seconds() * 1000))
+            runs.append((finished_at - started_at).total_seconds() * 1000)
+
+        workers = (
+            Task.objects.filter(status=Task.Status.RUNNING)
+            .exclude(locked_by="")
+            .values_list("locked_by", flat=True)
+            .distinct()
+        )
+        return Response({
+            "queues": queues,
+            "latency": {"wait": _percentiles(waits), "run": _percentiles(runs), "sample": len(waits)},
+            "active_workers": sorted(workers),
+        }, status=status.HTTP_200_OK)
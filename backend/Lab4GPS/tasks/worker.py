@@ -0,0 +1,209 @@
+# tasks/worker.py
+"""
+The task worker: claims due tasks from the database and runs them.
+
+Any number of worker processes (each with several threads) can share the
+queue. A task is claimed with a conditional UPDATE (status still 'queued'),
+so exactly one worker wins it, and it is leased until `locked_until`. If the
+worker dies mid-task the lease expires and the task is retried like any
+other failure. Finishing a task (success or failure) is itself conditional
+on still holding the lease, so a worker that overran its timeout cannot
+overwrite the state of the retry that replaced it.
+
+Per-type concurrency limits are enforced after claiming: a worker that finds
+the type over its limit hands the task straight back. Failed attempts are
+retried with exponential backoff (plus a little jitter) until max_attempts.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Task
+from .registry import DEFAULTS, registry
+
+logger = logging.getLogger(__name__)
+
+CLAIM_BATCH = 10
+MAINTENANCE_SECONDS = 30
+
+
+class Worker:
+    def __init__(self, threads=1, poll_interval=None, names=None):
+        self.threads = threads
+        self.poll_interval = poll_interval or getattr(settings, "TASK_POLL_INTERVAL", 1.0)
+        self.names = set(names) if names else None  # only run these task types
+        self.stopping = threading.Event()
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"
+        self._maintained_at = 0
+        self._maintenance_lock = threading.Lock()
+
+    # ---------------- running ----------------
+
+    def run(self):
+        """Runs worker threads until stop() is called."""
+        logger.info("Task worker %s starting %d thread(s)", self.identity, self.threads)
+        threads = [
+            threading.Thread(target=self._loop, name=f"task-worker-{index}", daemon=True)
+            for index in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=0.5)
+        logger.info("Task worker %s stopped", self.identity)
+
+    def stop(self):
+        """Finishes the tasks in hand, then exits."""
+        self.stopping.set()
+
+    def _loop(self):
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    self.maintain()
+                    busy = self.run_one()
+                except DatabaseError:
+                    # Lost connection, lock timeout...: back off and try again.
+                    logger.exception("Task worker %s database error", self.identity)
+                    connections.close_all()
+                    busy = False
+                if not busy:
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            connections.close_all()
+
+    def run_one(self):
+        """Claims and runs one task; returns False if nothing was due."""
+        claimed = self.claim()
+        if claimed is None:
+            return False
+        self.execute(claimed)
+        return True
+
+    # ---------------- claiming ----------------
+
+    def _limited_types(self):
+        return {
+            name: task_type.option("concurrency")
+            for name, task_type in registry.items()
+            if task_type.option("concurrency")
+        }
+
+    def _saturated_types(self, limits):
+        if not limits:
+            return set()
+        running = (
+            Task.objects.filter(status=Task.Status.RUNNING, name__in=limits)
+            .values("name")
+            .annotate(count=Count("id"))
+        )
+        return {row["name"] for row in running if row["count"] >= limits[row["name"]]}
+
+    def claim(self):
+        now = timezone.now()
+        limits = self._limited_types()
+        candidates = Task.objects.filter(status=Task.Status.QUEUED, run_at__lte=now)
+        if self.names is not None:
+            candidates = candidates.filter(name__in=self.names)
+        saturated = self._saturated_types(limits)
+        if saturated:
+            candidates = candidates.exclude(name__in=saturated)
+
+        for task in candidates.order_by("-priority", "run_at", "id")[:CLAIM_BATCH]:
+            task_type = registry.get(task.name)
+            timeout = task_type.option("timeout") if task_type else DEFAULTS["timeout"]
+            won = Task.objects.filter(pk=task.pk, status=Task.Status.QUEUED).update(
+                status=Task.Status.RUNNING,
+                attempts=F("attempts") + 1,
+                started_at=now,
+                locked_by=f"{self.identity}:{threading.current_thread().name}",
+                locked_until=now + timedelta(seconds=timeout),
+            )
+            if not won:
+                continue  # another worker got there first
+            if task.name in limits and self._over_limit(task.name, limits[task.name]):
+                # Lost a race for the last slot; give the task back untouched.
+                Task.objects.filter(pk=task.pk).update(
+                    status=Task.Status.QUEUED, attempts=F("attempts") - 1,
+                    started_at=None, locked_by="", locked_until=None,
+                )
+                continue
+            task.refresh_from_db()
+            return task
+        return None
+
+    def _over_limit(self, name, limit):
+        return Task.objects.filter(status=Task.Status.RUNNING, name=name).count() > limit
+
+    # ---------------- executing ----------------
+
+    def execute(self, task):
+        task_type = registry.get(task.name)
+        try:
+            if task_type is None:
+                raise LookupError(f"No task registered as '{task.name}'.")
+            task_type.func(*task.args, **task.kwargs)
+        except Exception:
+            self.fail(task, task_type, traceback.format_exc())
+        else:
+            finished = self._leased(task).update(
+                status=Task.Status.SUCCEEDED, finished_at=timezone.now(),
+                locked_by="", locked_until=None,
+            )
+            if not finished:
+                logger.warning("Task %s finished after its lease expired; left to its retry", task)
+
+    def _leased(self, task):
+        """The task's row, as long as this attempt still holds the lease."""
+        return Task.objects.filter(
+            pk=task.pk, status=Task.Status.RUNNING, locked_by=task.locked_by, attempts=task.attempts,
+        )
+
+    def fail(self, task, task_type, error):
+        now = timezone.now()
+        running = self._leased(task)
+        if task.attempts < task.max_attempts and task_type is not None:
+            delay = task_type.retry_delay(task.attempts) * random.uniform(0.9, 1.1)
+            logger.warning("Task %s failed (attempt %d/%d), retrying in %.0fs",
+                           task, task.attempts, task.max_attempts, delay)
+            running.update(
+                status=Task.Status.QUEUED, run_at=now + timedelta(seconds=delay),
+                last_error=error, locked_by="", locked_until=None,
+            )
+        else:
+            logger.error("Task %s failed permanently:\n%s", task, error)
+            running.update(
+                status=Task.Status.FAILED, finished_at=now,
+                last_error=error, locked_by="", locked_until=None,
+            )
+
+    # ---------------- housekeeping ----------------
+
+    def maintain(self):
+        """Every MAINTENANCE_SECONDS: recover expired leases and purge old successes."""
+        with self._maintenance_lock:
+            if time.monotonic() - self._maintained_at < MAINTENANCE_SECONDS:
+                return
+            self._maintained_at = time.monotonic()
+        now = timezone.now()
+        expired = Task.objects.filter(status=Task.Status.RUNNING, locked_until__lt=now)
+        for task in expired:
+            self.fail(task, registry.get(task.name), f"Lease held by {task.locked_by} expired.")
+
+        keep_days = getattr(settings, "TASK_KEEP_SUCCEEDED_DAYS", 7)
+        Task.objects.filter(
+            status=Task.Status.SUCCEEDED, finished_at__lt=now - timedelta(days=keep_days)
+        ).delete()
+
@@ -141,7 +141,7 @@ const DocumentVerification = () => {
       const { status, isVerified, message } = res.data;
       if (status === "valid") {
         openModal(message || "Document is authentic!", false);
-      } else if (status === "invalid") {
+      } else if (status === "invalid" || status === "modified") {
         openModal(message || "Document is not recognized or is altered.", true);
       } else if (status === "error") {
         openModal(message || "An error occurred during verification.", true);